@@ -0,0 +1,392 @@
+"""Multiple NetCDF files opened as one, with an index that persists between sessions.
+
+xmlplot can open a set of NetCDF files as one file, by concatenating them
+along the single dimension whose coordinates differ between files (e.g.,
+daily files along time). To do so, it opens every file, compares the
+attributes of all variables and the coordinates of all dimensions, and reads
+the coordinates along the aggregated dimension to order the files and
+determine their overlap. For hundreds of files, this takes long, and it is
+repeated every time the set of files is opened.
+
+Here, the outcome is kept in an index, stored in a directory between
+sessions: for every file, its size and modification time, a signature of its
+variables, attributes and coordinates other than along the aggregated
+dimension, and its coordinates along the aggregated dimension. When the set
+is opened again, only files that have been added or changed since are
+opened and examined; they must have the same signature as the others. The
+index is then updated. Files are opened only when data are read from them.
+Files are opened and examined one at a time, with the NetCDF lock held for
+each, so that reads from files already open are not held up, and opening
+can be cancelled between files.
+
+Slices along the aggregated dimension find the files that contain them by
+binary search on the offset of each file. The coordinate variable of the
+aggregated dimension is read from the index.
+
+Sets of files that cannot be handled this way, e.g., because files differ
+in other ways than along a single dimension, are opened by xmlplot as before.
+"""
+
+import os,glob,hashlib,bisect,threading
+
+import numpy
+
+import xmlplot.common,xmlplot.data
+import xmlplot.data.netcdf
+
+from collections.abc import Mapping
+
+try:
+    from . import ncio
+except ImportError:
+    import ncio
+
+class Cancelled(Exception): pass
+
+def getPaths(paths):
+    """Returns the paths of the files in a set (which may contain wildcards),
+    in the order in which xmlplot would open them."""
+    result = []
+    for path in paths: result += glob.glob(path)
+    return [os.path.abspath(path) for path in result]
+
+def getSignature(nc,variabledim):
+    """Returns a signature of everything in a NetCDF file that must be the
+    same in all files of a set: dimensions, variables, their attributes, and
+    coordinates, except along the aggregated dimension."""
+    h = hashlib.sha1()
+    def add(value):
+        if isinstance(value,str):
+            h.update(value.encode('utf-8'))
+        else:
+            value = numpy.ma.getdata(numpy.asarray(value))
+            h.update(str(value.dtype).encode('utf-8'))
+            h.update(str(value.shape).encode('utf-8'))
+            if value.dtype.kind=='O':
+                h.update(repr(value.tolist()).encode('utf-8'))
+            else:
+                h.update(numpy.ascontiguousarray(value).tobytes())
+    for dim in sorted(nc.dimensions.keys()):
+        if dim==variabledim: continue
+        length = nc.dimensions[dim]
+        if not (length is None or isinstance(length,int)): length = len(length)
+        add('%s=%s;' % (dim,length))
+    for name in sorted(nc.variables.keys()):
+        ncvar = nc.variables[name]
+        add('%s(%s);' % (name,','.join(ncvar.dimensions)))
+        for att in sorted(xmlplot.data.netcdf.getNcAttributes(ncvar)):
+            add('%s=' % att)
+            add(getattr(ncvar,att))
+        if name in nc.dimensions and name!=variabledim: add(xmlplot.data.netcdf.getNcData(ncvar))
+    return h.hexdigest()
+
+def findVariableDimension(ncs):
+    """Returns the dimension along which the coordinates of NetCDF files
+    differ, as xmlplot's MultiNetCDFFile determines it. Coordinates are read
+    with the NetCDF lock held per file."""
+    with ncio.lock:
+        first = ncs[0]
+        dim2coords = dict([(dim,xmlplot.data.netcdf.getNcData(first.variables[dim])) for dim in first.dimensions.keys() if dim in first.variables])
+    varying = []
+    for nc in ncs[1:]:
+        with ncio.lock:
+            for dim,coords in dim2coords.items():
+                if dim in varying or dim not in nc.variables: continue
+                other = xmlplot.data.netcdf.getNcData(nc.variables[dim])
+                if other.shape!=coords.shape or numpy.any(other!=coords): varying.append(dim)
+    if not varying: raise xmlplot.data.netcdf.MultiNetCDFFile.CoordinatesIdenticalException('All dimensions have the same coordinates in the supplied files.')
+    if len(varying)>1: raise xmlplot.data.netcdf.NetCDFError('More than one dimension (%s) varies between files.' % ', '.join(varying))
+    return varying[0]
+
+class Member(object):
+    """A file in an aggregated set, described by its entry in the index."""
+    def __init__(self,path,size,mtime,signature,coords,converted,nc=None):
+        self.path = path
+        self.size,self.mtime = size,mtime
+        self.signature = signature
+        self.coords = coords           # Coordinates along the aggregated dimension, as stored.
+        self.converted = converted     # The same coordinates as interpreted by xmlplot (e.g., time).
+        self.nc = nc
+
+    @staticmethod
+    def fromFile(path,nc,variabledim):
+        """Creates the entry for a file, given the open NetCDF file."""
+        stat = os.stat(path)
+        ncvar = nc.variables[variabledim]
+        converted = numpy.asarray(numpy.ma.getdata(xmlplot.data.netcdf.getNcData(ncvar)),dtype=float)
+        coords = numpy.asarray(ncvar[:])
+        return Member(path,stat.st_size,stat.st_mtime,getSignature(nc,variabledim),coords,converted,nc)
+
+    def isCurrent(self):
+        """Returns whether the file has not changed since its entry was made."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size==self.size and stat.st_mtime==self.mtime
+
+class Index(object):
+    """Indices of sets of files, persisted in the specified directory."""
+    def __init__(self,directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def getKey(self,paths):
+        return '\n'.join(sorted(paths))
+
+    def getPath(self,key):
+        return os.path.join(self.directory,'%s.npz' % hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def load(self,paths):
+        """Returns the aggregated dimension and the members of a set of files
+        in their last known state, or (None,[]) if not available."""
+        key = self.getKey(paths)
+        try:
+            with numpy.load(self.getPath(key),allow_pickle=False) as f:
+                if str(f['key'])!=key: return None,[]
+                members = []
+                for i,(path,size,mtime,signature) in enumerate(zip(f['paths'],f['sizes'],f['mtimes'],f['signatures'])):
+                    members.append(Member(str(path),int(size),float(mtime),str(signature),f['coords%i' % i],f['converted%i' % i]))
+                return str(f['variabledim']),members
+        except (IOError,OSError,KeyError,ValueError):
+            return None,[]
+
+    def save(self,paths,variabledim,members):
+        key = self.getKey(paths)
+        arrays = {'key':numpy.array(key),'variabledim':numpy.array(variabledim),
+                  'paths':numpy.array([m.path for m in members]),'sizes':numpy.array([m.size for m in members],dtype=numpy.int64),
+                  'mtimes':numpy.array([m.mtime for m in members],dtype=float),'signatures':numpy.array([m.signature for m in members])}
+        for i,member in enumerate(members):
+            arrays['coords%i' % i],arrays['converted%i' % i] = member.coords,member.converted
+        path = self.getPath(key)
+        with self.lock:
+            try:
+                if not os.path.isdir(self.directory): os.makedirs(self.directory)
+                with open(path+'.tmp','wb') as f:
+                    numpy.savez(f,**arrays)
+                os.replace(path+'.tmp',path)
+            except (IOError,OSError) as e:
+                print('Unable to save index of "%s": %s' % (paths[0],e))
+
+class AggregatedFile(object):
+    """Multiple NetCDF files combined into one along a single dimension; a
+    replacement for xmlplot.data.netcdf.MultiNetCDFFile. Members must be
+    ordered by their coordinates along the aggregated dimension."""
+
+    class Variable(object):
+        def __init__(self,store,name):
+            self.store = store
+            self.name = name
+            self.ncvars = {}
+            self.calls = []
+            self.mask,self.scale = True,True
+
+        def getNcVariable(self,imember):
+            ncvar = self.ncvars.get(imember,None)
+            if ncvar is None:
+                ncvar = self.store.getMember(imember).variables[self.name]
+                for name,args in self.calls: getattr(ncvar,name)(*args)
+                self.ncvars[imember] = ncvar
+            return ncvar
+
+        def __array__(self,*args,**kwargs):
+            return numpy.asarray(self[(Ellipsis,)],*args,**kwargs)
+
+        def __getitem__(self,indices):
+            if not isinstance(indices,(tuple,list)): indices = (indices,)
+            dims = list(self.dimensions)
+            idim = dims.index(self.store.variabledim)
+            shape = self.shape
+            indices = list(xmlplot.common.processEllipsis(indices,len(shape)))
+            indices += [slice(None)]*(len(shape)-len(indices))
+            index = indices[idim]
+
+            # The coordinates of the aggregated dimension are taken from the index,
+            # if they are to be returned as stored.
+            if self.name==self.store.variabledim and len(dims)==1 and not (self.mask or self.scale): return numpy.array(self.store.coords[index])
+
+            offsets = self.store.offsets
+            if not isinstance(index,slice):
+                if index<0: index += shape[idim]
+                if index<0 or index>=shape[idim]: raise IndexError('Index %i is out of range for dimension %s with length %i.' % (indices[idim],self.store.variabledim,shape[idim]))
+                imember = bisect.bisect_right(offsets,index)-1
+                indices[idim] = index-offsets[imember]+self.store.skips[imember]
+                return self.getNcVariable(imember)[tuple(indices)]
+
+            start,stop,step = index.indices(shape[idim])
+            positions = range(start,stop,step)
+            if len(positions)==0:
+                indices[idim] = slice(0,0)
+                return self.getNcVariable(0)[tuple(indices)]
+            if step<0: positions = positions[::-1]
+            first,last,step = positions[0],positions[-1],positions.step
+
+            # Read from each member that contains part of the slice; members are found by binary search.
+            data = []
+            for imember in range(bisect.bisect_right(offsets,first)-1,bisect.bisect_right(offsets,last)):
+                lower,upper = max(offsets[imember],first),min(offsets[imember+1],last+1)
+                istart = first+-((first-lower)//step)*step
+                if istart>=upper: continue
+                istop = first+((upper-1-first)//step)*step+1
+                skip = self.store.skips[imember]-offsets[imember]
+                indices[idim] = slice(istart+skip,istop+skip,step)
+                data.append(self.getNcVariable(imember)[tuple(indices)])
+
+            # Integer indices before the aggregated dimension remove dimensions from the result.
+            axis = idim-len([i for i in indices[:idim] if not isinstance(i,slice)])
+            if any(isinstance(d,numpy.ma.MaskedArray) for d in data):
+                result = numpy.ma.concatenate(data,axis=axis)
+            else:
+                result = numpy.concatenate(data,axis=axis)
+            if index.indices(shape[idim])[2]<0: result = numpy.flip(result,axis=axis)
+            return result
+
+        def ncattrs(self):
+            return xmlplot.data.netcdf.getNcAttributes(self.getNcVariable(0))
+
+        def setAutoMaskAndScale(self,name,*args):
+            # Applies to the variable in all member files, including those opened later.
+            self.calls.append((name,args))
+            for ncvar in self.ncvars.values(): getattr(ncvar,name)(*args)
+            if name in ('set_auto_maskandscale','set_auto_mask'): self.mask = bool(args[0])
+            if name in ('set_auto_maskandscale','set_auto_scale'): self.scale = bool(args[0])
+
+        def __getattr__(self,name):
+            if name=='shape':
+                return [self.store.dim2length[d] for d in self.dimensions]
+            if name in ('set_auto_maskandscale','set_auto_mask','set_auto_scale','set_always_mask'):
+                return lambda *args: self.setAutoMaskAndScale(name,*args)
+            if name=='group':
+                # The variable does not belong to a single file.
+                raise AttributeError(name)
+            # Attributes are identical in all members.
+            return getattr(self.getNcVariable(0),name)
+
+    class Variables(Mapping):
+        def __init__(self,store):
+            self.store = store
+
+        def __getitem__(self,name):
+            var = self.store.aggregated.get(name,None)
+            if var is None:
+                ncvar = self.store.getMember(0).variables[name]
+                if self.store.variabledim not in ncvar.dimensions: return ncvar
+                var = AggregatedFile.Variable(self.store,name)
+                self.store.aggregated[name] = var
+            return var
+
+        def keys(self):
+            return self.store.getMember(0).variables.keys()
+
+        def __len__(self):
+            return len(self.keys())
+
+        def __iter__(self):
+            return iter(self.keys())
+
+    def __init__(self,members,variabledim):
+        self.members = members
+        self.variabledim = variabledim
+        self.aggregated = {}
+
+        # Determine the overlap between consecutive members as xmlplot does:
+        # values at the start of a member that do not exceed the last value of
+        # the previous member are skipped.
+        self.skips = [0]
+        for previous,member in zip(members[:-1],members[1:]):
+            self.skips.append(int(member.converted.searchsorted(previous.converted[-1],side='right')))
+        self.offsets = [0]
+        for member,skip in zip(members,self.skips):
+            self.offsets.append(self.offsets[-1]+max(len(member.coords)-skip,0))
+        self.coords = numpy.concatenate([member.coords[skip:] for member,skip in zip(members,self.skips)])
+
+        self.dim2length = {}
+        for dim,length in self.getMember(0).dimensions.items():
+            if not (length is None or isinstance(length,int)): length = len(length)
+            self.dim2length[dim] = length
+        self.dim2length[variabledim] = self.offsets[-1]
+
+    def getMember(self,imember):
+        """Returns the NetCDF file object of a member, opening it if needed."""
+        member = self.members[imember]
+        if member.nc is None: member.nc = xmlplot.data.netcdf.getNetCDFFile(member.path)
+        return member.nc
+
+    def ncattrs(self):
+        return xmlplot.data.netcdf.getNcAttributes(self.getMember(0))
+
+    def __getattr__(self,name):
+        if name=='dimensions':
+            return self.dim2length
+        elif name=='variables':
+            return AggregatedFile.Variables(self)
+        elif name=='filepath':
+            # The set does not correspond to a single file.
+            raise AttributeError(name)
+        return getattr(self.getMember(0),name)
+
+    def close(self):
+        for member in self.members:
+            if member.nc is not None: member.nc.close()
+            member.nc = None
+
+def openFiles(paths,directory,cancelled=None):
+    """Opens a set of NetCDF files as one, using the index in the specified
+    directory. Raises an exception if the files cannot be aggregated by
+    AggregatedFile; xmlplot must then open them. Files are opened and
+    examined one at a time, each with the NetCDF lock held, so that other
+    threads can use the NetCDF library in between. If the callable cancelled
+    returns True, Cancelled is raised."""
+    paths = getPaths(paths)
+    if len(paths)<2: raise xmlplot.data.netcdf.NetCDFError('Aggregation requires multiple files.')
+    index = Index(directory)
+    variabledim,members = index.load(paths)
+    known = dict([(member.path,member) for member in members if member.isCurrent()])
+    order = [member.path for member in members]
+
+    def checkCancelled():
+        if cancelled is not None and cancelled(): raise Cancelled()
+
+    # Reuse the entries of unchanged files; open and examine the others (all files the first time).
+    ncs,members = {},[]
+    try:
+        for path in paths:
+            if path in known: continue
+            checkCancelled()
+            with ncio.lock:
+                ncs[path] = xmlplot.data.netcdf.getNetCDFFile(path)
+        if variabledim is None: variabledim = findVariableDimension([ncs[path] for path in paths])
+        for path in paths:
+            member = known.get(path,None)
+            if member is None:
+                checkCancelled()
+                with ncio.lock:
+                    member = Member.fromFile(path,ncs[path],variabledim)
+            members.append(member)
+        if len(set([member.signature for member in members]))!=1: raise xmlplot.data.netcdf.NetCDFError('Files differ in other ways than along %s.' % variabledim)
+    except:
+        with ncio.lock:
+            for nc in ncs.values(): nc.close()
+        raise
+
+    # Order files as xmlplot does: by their first coordinate.
+    if all(len(member.coords)>0 for member in members): members.sort(key=lambda member: member.coords[0])
+
+    if any(member.nc is not None for member in members) or [member.path for member in members]!=order: index.save(paths,variabledim,members)
+    return AggregatedFile(members,variabledim)
+
+def openStore(paths,directory,cancelled=None):
+    """Returns an xmlplot data store for a set of NetCDF files, aggregated
+    using the index in the specified directory if possible. The NetCDF lock
+    is taken as needed; see openFiles for cancelled."""
+    try:
+        nc = openFiles(paths,directory,cancelled)
+    except Cancelled:
+        raise
+    except Exception:
+        with ncio.lock:
+            return xmlplot.data.open(paths)
+    with ncio.lock:
+        for convention in xmlplot.data.netcdf.NetCDFStore.conventions:
+            if convention.testFile(nc): return convention(nc)
+        return xmlplot.data.netcdf.NetCDFStore(nc)
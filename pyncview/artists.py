@@ -0,0 +1,164 @@
+"""In-place update of the data shown in a figure.
+
+Rebuilding an xmlplot figure (axes, colorbar, map, title) is much more
+expensive than drawing it. When only the slice index of the plotted variable
+changes, e.g., during an animation, the new data can instead be put in the
+artist that shows the data (a mesh or line), and texts that show the name of
+the slice (e.g., title and axis labels) can be replaced. Only these and the
+artists drawn on top of them are then redrawn over a saved background
+(blitting).
+
+This is only done if the result is identical to rebuilding the figure: the
+new slice must have the same grid, and the range of the axis that shows the
+data values must be fixed.
+"""
+
+import numpy
+import matplotlib.collections,matplotlib.lines,matplotlib.quiver,matplotlib.text
+
+def getPlottedSlice(slices,autosqueeze):
+    """Returns the single slice in slices, processed as by the figure before
+    plotting, or None if there is not exactly one valid slice."""
+    if isinstance(slices,(list,tuple)):
+        if len(slices)==1 and isinstance(slices[0],(list,tuple)): slices = slices[0]
+        if len(slices)!=1: return None
+        slices = slices[0]
+    if not slices.isValid() or 0 in slices.data.shape: return None
+    if autosqueeze: slices = slices.squeeze()
+    return slices
+
+def isEqual(a,b):
+    """Returns whether two (masked) arrays have the same shape, mask and unmasked values."""
+    if a.shape!=b.shape: return False
+    maska,maskb = numpy.ma.getmaskarray(a),numpy.ma.getmaskarray(b)
+    return numpy.array_equal(maska,maskb) and numpy.array_equal(numpy.ma.getdata(a)[~maska],numpy.ma.getdata(b)[~maskb])
+
+class ArtistUpdater(object):
+    """Updates the data of an xmlplot figure in place. After the figure has
+    been drawn in full, call record with the slice it shows; update then shows
+    a new slice on the same grid, if possible. Whenever the figure redraws
+    itself, the recorded state is discarded.
+    """
+    def __init__(self,figure):
+        self.figure = figure
+        self.figure.registerCallback('completeStateChange',self.onFigureStateChanged)
+        self.reset()
+
+    def reset(self):
+        self.artist = None
+        self.background = None
+
+    def onFigureStateChanged(self,validplot):
+        self.reset()
+
+    def isFixedAxis(self,axisid):
+        """Returns whether the range of the specified axis is fixed by the figure settings."""
+        node = self.figure['Axes'].getChildById('Axis',axisid)
+        if node is None: return False
+        if node['IsTimeAxis'].getValue(usedefault=True):
+            return node['MinimumTime'].getValue() is not None and node['MaximumTime'].getValue() is not None
+        return node['Minimum'].getValue() is not None and node['Maximum'].getValue() is not None and not node['LogScale'].getValue(usedefault=True)
+
+    def record(self,slices,longname=None):
+        """Records the artist that shows the specified slice, which the figure
+        has just been drawn with. The long name of the slice is used to find
+        texts that need to change with it. Returns whether subsequent slices
+        can be shown by updating this artist."""
+        self.reset()
+        figure = self.figure
+        if figure.dirty or figure.errors or not figure.figure.axes: return False
+        data = getPlottedSlice(slices,figure.autosqueeze)
+        if data is None or data.ndim not in (1,2): return False
+        values = numpy.ma.masked_invalid(data.data)
+
+        # The first axes hold the data; others (e.g., the colorbar) are left as they are.
+        axes = figure.figure.axes[0]
+        if data.ndim==2:
+            # Only a single colored mesh is supported (not contours or vectors).
+            meshes = [c for c in axes.collections if isinstance(c,matplotlib.collections.QuadMesh)]
+            if len(meshes)!=1 or any(isinstance(c,matplotlib.quiver.Quiver) for c in axes.collections): return False
+            artist = meshes[0]
+            current = artist.get_array()
+            if current is None: return False
+            if isEqual(current,values):
+                transpose = False
+            elif isEqual(current,values.T):
+                transpose = True
+            else:
+                # The figure processed the data further, e.g., to shift the longitude of a map.
+                return False
+            if not self.isFixedAxis('colorbar'): return False
+            coords,setdata = data.coords_stag,artist.set_array
+        else:
+            # Only a single line without confidence limits is supported.
+            if len(axes.lines)!=1 or axes.collections or axes.patches: return False
+            artist = axes.lines[0]
+            transpose = False
+            if isEqual(numpy.ma.asarray(artist.get_ydata()),values):
+                axisid,setdata = 'y',artist.set_ydata
+            elif isEqual(numpy.ma.asarray(artist.get_xdata()),values):
+                axisid,setdata = 'x',artist.set_xdata
+            else:
+                return False
+            if not self.isFixedAxis(axisid): return False
+            coords = data.coords
+
+        # Texts that show the name of the slice (e.g., the default title and
+        # axis labels) change along with the data.
+        self.longname,self.texts = longname,[]
+        if longname:
+            for text in figure.figure.findobj(matplotlib.text.Text):
+                if longname in text.get_text(): self.texts.append((text,text.get_text()))
+
+        # Determine the artists to redraw: in each axes, the first artist that
+        # changes and everything drawn on top of it.
+        changing = set([artist,axes.title]+[text for text,template in self.texts])
+        self.artists = []
+        for curaxes in figure.figure.axes:
+            children = [a for a in curaxes.get_children() if a is not curaxes.patch]
+            children.sort(key=lambda a: a.get_zorder())
+            for i,child in enumerate(children):
+                if changing.intersection(child.findobj()):
+                    self.artists += children[i:]
+                    break
+        for text,template in self.texts:
+            if not any(text in a.findobj() for a in self.artists): return False
+
+        self.axes,self.artist,self.setdata,self.transpose = axes,artist,setdata,transpose
+        self.dimensions,self.coords,self.shape = tuple(data.dimensions),list(coords),values.shape
+        return True
+
+    def update(self,slices,longname=None,title=None):
+        """Shows the specified slice by updating the data of the recorded
+        artist and the texts that contain its long name, and optionally
+        replaces the title. Returns whether this succeeded; if not, the
+        figure must be redrawn in full."""
+        if self.artist is None or self.figure.dirty or self.axes not in self.figure.figure.axes: return False
+        data = getPlottedSlice(slices,self.figure.autosqueeze)
+        if data is None or tuple(data.dimensions)!=self.dimensions: return False
+        if self.texts and not longname: return False
+        coords = data.coords_stag if data.ndim==2 else data.coords
+        if len(coords)!=len(self.coords) or not all(numpy.array_equal(c,oldc) for c,oldc in zip(coords,self.coords)): return False
+        values = numpy.ma.masked_invalid(data.data)
+        if values.shape!=self.shape: return False
+        if self.transpose: values = values.T
+
+        mplfigure = self.figure.figure
+        canvas = mplfigure.canvas
+        size = canvas.get_width_height()
+        if self.background is None or self.background[0]!=size:
+            # Draw and save everything except the artists that will be updated.
+            for artist in self.artists: artist.set_animated(True)
+            try:
+                canvas.draw()
+            finally:
+                for artist in self.artists: artist.set_animated(False)
+            self.background = size,canvas.copy_from_bbox(mplfigure.bbox)
+
+        self.setdata(values)
+        for text,template in self.texts: text.set_text(template.replace(self.longname,longname))
+        if title is not None: self.axes.title.set_text(title)
+        canvas.restore_region(self.background[1])
+        for artist in self.artists: mplfigure.draw_artist(artist)
+        canvas.blit(mplfigure.bbox)
+        return True
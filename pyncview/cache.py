@@ -0,0 +1,65 @@
+"""Caches shared by PyNcView components."""
+
+import threading,collections
+
+class LRUCache(object):
+    """Least-recently-used cache, bounded by the total size of its values in
+    bytes. The size of each value is provided when it is added. The cache can be
+    used from multiple threads. It counts hits and misses, for diagnostics.
+    """
+    def __init__(self,maxsize):
+        self.maxsize = maxsize
+        self.size = 0
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits,self.misses = 0,0
+
+    def get(self,key,default=None):
+        with self.lock:
+            item = self.items.get(key,None)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.items.move_to_end(key)
+            return item[0]
+
+    def __contains__(self,key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self,key,value,size):
+        """Adds a value, discarding the least recently used values if needed
+        to stay within the maximum size. Values larger than the maximum size
+        are not stored.
+        """
+        with self.lock:
+            if key in self.items: self.size -= self.items.pop(key)[1]
+            if size>self.maxsize: return
+            self.items[key] = (value,size)
+            self.size += size
+            self.trim()
+
+    def setMaximumSize(self,maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.trim()
+
+    def trim(self):
+        while self.size>self.maxsize:
+            key,(value,size) = self.items.popitem(last=False)
+            self.size -= size
+
+    def discard(self,test):
+        """Removes the values whose key passes the specified test."""
+        with self.lock:
+            for key in [key for key in self.items if test(key)]:
+                self.size -= self.items.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
@@ -0,0 +1,350 @@
+"""Reads from chunked NetCDF variables through a cache of decompressed chunks.
+
+NetCDF-4 variables are stored in chunks, and any read decompresses every
+chunk it touches in full. Reads that cut across the chunk layout therefore
+decompress the same chunks over and over: a time series at one grid point
+from a variable chunked by map, each index of a dimension along which chunks
+extend over multiple indices (e.g., while walking through time), or a
+neighboring region of a map that was shown before.
+
+A ChunkReader inspects the chunking of a variable, determines the chunks a
+read touches, and takes these from a least-recently-used cache of
+decompressed chunks. The chunks that are missing are read together in a
+single call to the NetCDF library (the block that spans them, if that is
+not much larger than the chunks themselves), split into chunks and added to
+the cache. The result is then assembled from the chunks. Reads for which
+this does not pay off are passed on to the NetCDF library as is: reads of
+variables that are not chunked, reads that would take up more than half of
+the cache (so that a single large read does not flush it), and reads with
+indices other than integers and slices with positive step.
+
+Each variable has its own cache; all have the same maximum size, which is
+set with setMaximumSize. Hits and misses are counted per chunk, for
+diagnostics (getStatistics).
+
+The NetCDF library decompresses the chunks of a read one after another, on
+a single core. If h5py is available, chunks compressed with zlib (with or
+without shuffle) are instead read in stored form through h5py, and
+decompressed on a pool of threads (zlib releases the GIL while it
+decompresses). Each thread copies the values selected from its chunks into
+the result, which is allocated in advance. This also applies to reads that
+are too large to be cached. The number of threads is set with setThreads.
+"""
+
+import os,numbers,itertools,weakref,threading,zlib,concurrent.futures
+
+import numpy
+
+# h5py is imported when first needed (see getH5py), as it takes long to import.
+h5py = None
+
+try:
+    from . import cache
+except ImportError:
+    import cache
+
+# Maximum size of the cache of each variable in bytes (0 to disable caching).
+maxsize = 256*1024*1024
+
+# Maximum number of chunks read or assembled for a single read.
+maxchunks = 4096
+
+# Number of threads that decompress chunks (0 for one per processor core).
+threads = 0
+pool = None
+poollock = threading.Lock()
+
+# All chunk readers in use, to update their maximum size and collect statistics.
+readers = weakref.WeakSet()
+
+# HDF5 filters that can be undone here.
+H5Z_FILTER_DEFLATE,H5Z_FILTER_SHUFFLE = 1,2
+
+def setMaximumSize(size):
+    """Sets the maximum size of the cache of each variable in bytes."""
+    global maxsize
+    maxsize = size
+    for reader in list(readers): reader.cache.setMaximumSize(size)
+
+def setThreads(count):
+    """Sets the number of threads that decompress chunks (0 for one per processor core)."""
+    global threads,pool
+    with poollock:
+        threads = count
+        pool = None
+
+def getPool():
+    """Returns the pool of threads that decompress chunks, or None if chunks
+    are to be decompressed one after another."""
+    global pool
+    with poollock:
+        count = threads or os.cpu_count() or 1
+        if count<2: return None
+        if pool is None: pool = concurrent.futures.ThreadPoolExecutor(count)
+        return pool
+
+def isParallelAvailable():
+    """Returns whether chunks can be decompressed in parallel (this requires h5py)."""
+    return getH5py() is not None
+
+def getH5py():
+    """Returns the h5py module, or None if it is not available."""
+    global h5py
+    if h5py is None:
+        try:
+            import h5py as module
+        except ImportError:
+            module = False
+        h5py = module
+    return h5py or None
+
+def getStatistics():
+    """Returns the number of chunk hits and misses, and the total size of the
+    cached chunks in bytes, summed over all variables."""
+    hits,misses,size = 0,0,0
+    for reader in list(readers):
+        hits += reader.cache.hits
+        misses += reader.cache.misses
+        size += reader.cache.size
+    return hits,misses,size
+
+def getChunkShape(ncvar):
+    """Returns the chunk shape of a NetCDF variable, or None if it is not
+    chunked (e.g., NetCDF-3 variables, or contiguous storage)."""
+    try:
+        chunking = ncvar.chunking()
+    except Exception:
+        return None
+    if not isinstance(chunking,(list,tuple)): return None
+    return tuple(chunking)
+
+def getReader(ncvar):
+    """Returns a ChunkReader for a NetCDF variable, or None if it is not chunked."""
+    chunkshape = getChunkShape(ncvar)
+    if chunkshape is None or len(chunkshape)!=len(ncvar.shape) or numpy.dtype(ncvar.dtype).kind not in 'biuf': return None
+    return ChunkReader(ncvar,chunkshape)
+
+def getRange(index,length):
+    """Returns start, stop, step of an index into a dimension of the specified
+    length, and whether the index is an integer (which removes the dimension),
+    or None if it cannot be read by chunk."""
+    if isinstance(index,numbers.Integral) and not isinstance(index,bool):
+        index = int(index)
+        if index<0: index += length
+        if index<0 or index>=length: return None
+        return index,index+1,1,True
+    if isinstance(index,slice):
+        start,stop,step = index.indices(length)
+        if step<=0 or stop<=start: return None
+        return start,stop,step,False
+    return None
+
+class ChunkDecoder(object):
+    """Reads the compressed chunks of a NetCDF-4 variable with h5py, and
+    decompresses them. Compression with zlib (deflate), with or without
+    shuffle, is supported, as are chunks without compression."""
+    def __init__(self,dataset,filters):
+        self.dataset = dataset
+        self.filters = filters
+        self.dtype = dataset.dtype
+
+    def readRaw(self,chunkid):
+        """Returns the stored (compressed) data of the chunk with the
+        specified index, or None if that is not available (e.g., the chunk
+        has not been written, and therefore contains fill values only)."""
+        offset = tuple([i*size for i,size in zip(chunkid,self.dataset.chunks)])
+        try:
+            filtermask,data = self.dataset.id.read_direct_chunk(offset)
+        except Exception:
+            return None
+        if filtermask!=0: return None
+        return data
+
+    def decode(self,data):
+        """Returns the full chunk for the stored data of a chunk."""
+        for filter in reversed(self.filters):
+            if filter==H5Z_FILTER_DEFLATE:
+                data = zlib.decompress(data)
+            elif filter==H5Z_FILTER_SHUFFLE and self.dtype.itemsize>1:
+                data = numpy.frombuffer(data,dtype=numpy.uint8).reshape(self.dtype.itemsize,-1).T.tobytes()
+        return numpy.frombuffer(data,dtype=self.dtype).reshape(self.dataset.chunks)
+
+def getDecoder(ncvar,chunkshape):
+    """Returns a ChunkDecoder for a NetCDF-4 variable, or None if its chunks
+    cannot be decompressed here (h5py is not available, or the variable uses
+    other filters)."""
+    if getH5py() is None: return None
+    try:
+        group = ncvar.group()
+        dataset = h5py.File(group.filepath(),'r')[group.path][ncvar.name]
+        plist = dataset.id.get_create_plist()
+        filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+    except Exception:
+        return None
+    if dataset.chunks!=chunkshape or dataset.shape!=tuple(ncvar.shape) or dataset.dtype.kind not in 'biuf': return None
+    if filters not in ([],[H5Z_FILTER_DEFLATE],[H5Z_FILTER_SHUFFLE,H5Z_FILTER_DEFLATE]): return None
+    return ChunkDecoder(dataset,filters)
+
+class ChunkReader(object):
+    """Reads from a chunked NetCDF variable through a cache of decompressed
+    chunks, decompressing chunks in parallel if possible. The caller must
+    hold the NetCDF lock (see the ncio module)."""
+    def __init__(self,ncvar,chunkshape):
+        self.ncvar = ncvar
+        self.chunkshape = chunkshape
+        self.cache = cache.LRUCache(maxsize)
+        self.decoder = False
+        readers.add(self)
+
+    def getDecoder(self):
+        if self.decoder is False: self.decoder = getDecoder(self.ncvar,self.chunkshape)
+        return self.decoder
+
+    def closeDecoder(self):
+        """Closes the file opened by h5py to read stored chunks, if any."""
+        if self.decoder:
+            try:
+                self.decoder.dataset.file.close()
+            except Exception:
+                pass
+        self.decoder = False
+
+    def setVariable(self,ncvar,shape):
+        """Continues reading from the specified NetCDF variable, which
+        replaces the variable read before (e.g., after the file was reopened
+        because it has changed). Chunks that extended beyond the specified
+        previous shape of the variable were cached incomplete, and are discarded.
+        So are the chunks with the last previous record along unlimited
+        dimensions, as the writer may have filled that record since."""
+        self.closeDecoder()
+        self.ncvar = ncvar
+        first = []
+        for length,newlength,size,dim in zip(shape,ncvar.shape,self.chunkshape,ncvar.get_dims()):
+            if dim.isunlimited():
+                first.append(max(length-1,0)//size)
+            else:
+                first.append(length//size if newlength>length else None)
+        self.cache.discard(lambda key: any(i is not None and chunkid>=i for chunkid,i in zip(key[1],first)))
+
+    def read(self,indices):
+        """Returns the data of the variable at the specified indices, as the
+        NetCDF variable itself would, or None if the read should be passed on
+        to the NetCDF variable."""
+        shape = self.ncvar.shape
+        if not isinstance(indices,tuple): indices = (indices,)
+        if any(index is Ellipsis for index in indices):
+            i = [index is Ellipsis for index in indices].index(True)
+            indices = indices[:i]+(slice(None),)*(len(shape)-len(indices)+1)+indices[i+1:]
+        if len(indices)>len(shape): return None
+        indices = indices+(slice(None),)*(len(shape)-len(indices))
+        ranges = []
+        for index,length in zip(indices,shape):
+            r = getRange(index,length)
+            if r is None: return None
+            ranges.append(r)
+        if all(isint for start,stop,step,isint in ranges): return None
+
+        # Determine the chunks that are touched along each dimension, and their total size.
+        chunkids = [numpy.unique(numpy.arange(start,stop,step)//size) for (start,stop,step,isint),size in zip(ranges,self.chunkshape)]
+        count = numpy.prod([len(ids) for ids in chunkids])
+        nbytes = numpy.prod([len(ids)*size for ids,size in zip(chunkids,self.chunkshape)])*numpy.dtype(self.ncvar.dtype).itemsize
+        if count>maxchunks: return None
+
+        # Chunks are cached if they take up at most half of the cache. They are
+        # decompressed in parallel if there are multiple, and the NetCDF variable
+        # would return them as stored (i.e., without masking and scaling).
+        # The cache key includes the masking and scaling, as these determine the values.
+        flags = (getattr(self.ncvar,'mask',None),getattr(self.ncvar,'scale',None))
+        usecache = nbytes<=self.cache.maxsize//2
+        pool = getPool() if count>1 and flags==(False,False) else None
+        decoder = self.getDecoder() if pool is not None else None
+        if not usecache and decoder is None: return None
+
+        chunks,missing = {},[]
+        for chunkid in itertools.product(*[ids.tolist() for ids in chunkids]):
+            data = self.cache.get((flags,chunkid)) if usecache else None
+            if data is None:
+                missing.append(chunkid)
+            else:
+                chunks[chunkid] = data
+        if missing and decoder is None:
+            chunks.update(self.readChunks(flags,missing,usecache))
+            missing = []
+
+        # Assemble the result from the chunks.
+        first = next(iter(chunks.values())) if chunks else None
+        outshape = [len(range(start,stop,step)) for start,stop,step,isint in ranges]
+        data = numpy.empty(outshape,dtype=numpy.dtype(self.ncvar.dtype) if first is None else first.dtype)
+        masked = any(isinstance(chunk,numpy.ma.MaskedArray) for chunk in chunks.values())
+        mask = numpy.zeros(outshape,dtype=bool) if masked else None
+        for chunkid,chunk in chunks.items(): self.copyChunk(ranges,chunkid,chunk,data,mask)
+        if missing: self.decodeChunks(decoder,pool,flags,missing,usecache,ranges,data)
+        if masked: data = numpy.ma.masked_array(data,mask=mask,fill_value=getattr(first,'fill_value',None))
+        return data[tuple([0 if isint else slice(None) for start,stop,step,isint in ranges])]
+
+    def copyChunk(self,ranges,chunkid,chunk,data,mask=None):
+        """Copies the selected values in a chunk to the result."""
+        target,source = [],[]
+        for (start,stop,step,isint),size,i in zip(ranges,self.chunkshape,chunkid):
+            # Positions of the selected indices within this chunk, and in the result.
+            chunkstart,chunkstop = i*size,min((i+1)*size,stop)
+            j0 = max(-((start-chunkstart)//step),0)
+            j1 = -((start-chunkstop)//step)
+            target.append(slice(j0,j1))
+            source.append(slice(start+j0*step-chunkstart,start+(j1-1)*step-chunkstart+1,step))
+        target,source = tuple(target),tuple(source)
+        data[target] = numpy.ma.getdata(chunk)[source]
+        if mask is not None: mask[target] = numpy.ma.getmaskarray(chunk)[source]
+
+    def readChunks(self,flags,chunkids,store=True):
+        """Reads the specified chunks from the NetCDF variable, adds them to
+        the cache if store is set, and returns them in a dictionary."""
+        shape,chunkshape = self.ncvar.shape,self.chunkshape
+
+        # Read the block that spans all chunks at once, unless that includes
+        # many more chunks than needed (e.g., for reads at a stride).
+        lower = [min(ids) for ids in zip(*chunkids)]
+        upper = [max(ids)+1 for ids in zip(*chunkids)]
+        if numpy.prod([u-l for l,u in zip(lower,upper)])<=2*len(chunkids):
+            blocks = [(lower,upper)]
+        else:
+            blocks = [(chunkid,[i+1 for i in chunkid]) for chunkid in chunkids]
+
+        chunks = {}
+        wanted = set(chunkids)
+        for lower,upper in blocks:
+            block = self.ncvar[tuple([slice(l*size,min(u*size,length)) for l,u,size,length in zip(lower,upper,chunkshape,shape)])]
+            for chunkid in itertools.product(*[range(l,u) for l,u in zip(lower,upper)]):
+                if chunkid not in wanted: continue
+                chunk = block[tuple([slice((i-l)*size,(i-l+1)*size) for i,l,size in zip(chunkid,lower,chunkshape)])]
+                if chunk.shape!=block.shape: chunk = chunk.copy()
+                chunks[chunkid] = chunk
+                if store: self.cache.put((flags,chunkid),chunk,chunk.nbytes)
+        return chunks
+
+    def decodeChunks(self,decoder,pool,flags,chunkids,store,ranges,data):
+        """Reads the specified chunks in stored form, and decompresses them
+        on the thread pool, each thread copying the selected values of its
+        chunks to the result. Chunks are added to the cache if store is set.
+        Chunks that cannot be decompressed are read from the NetCDF variable."""
+        shape = self.ncvar.shape
+        def process(chunkid,raw):
+            try:
+                chunk = decoder.decode(raw)
+            except Exception:
+                return chunkid
+            extent = tuple([slice(0,min(size,length-i*size)) for i,size,length in zip(chunkid,self.chunkshape,shape)])
+            chunk = chunk[extent]
+            if store:
+                if not chunk.flags.c_contiguous: chunk = chunk.copy()
+                self.cache.put((flags,chunkid),chunk,chunk.nbytes)
+            self.copyChunk(ranges,chunkid,chunk,data)
+            return None
+
+        # Reading stored chunks takes little time compared to decompression; it is done here, as
+        # h5py serializes it anyway. Chunks that are not available are read from the NetCDF variable.
+        raws = [(chunkid,decoder.readRaw(chunkid)) for chunkid in chunkids]
+        failed = [chunkid for chunkid,raw in raws if raw is None]
+        failed += [chunkid for chunkid in pool.map(lambda item: process(*item),[(chunkid,raw) for chunkid,raw in raws if raw is not None]) if chunkid is not None]
+        if failed:
+            for chunkid,chunk in self.readChunks(flags,failed,store).items(): self.copyChunk(ranges,chunkid,chunk,data)
@@ -0,0 +1,231 @@
+"""Reduction of the data requested by the figure to the detail it can show.
+
+A line with many more points than the axes are wide in pixels costs time to
+draw, but does not show more detail. Before a long series is plotted, its
+coordinate range on screen is therefore divided into one bin per pixel, and
+of the points in each bin only the first, last, minimum and maximum are
+kept. The result is drawn identically at the resolution of the figure (in
+particular, peaks remain visible), but has at most four points per pixel,
+however long the original series.
+
+If the range of the coordinate axis is fixed, bins cover that range only,
+and points outside it are dropped (except their nearest neighbors, which
+determine the line at the edges of the axes). As the figure requests its data
+again whenever its axes change, the series is then decimated anew.
+
+Large two-dimensional grids are read as overviews instead; see the overviews
+module. Figures exported to file or printed are drawn from full-resolution
+data, as these are not bound to the resolution of the screen.
+"""
+
+import math
+
+import numpy
+
+import xmlplot.common
+
+try:
+    from . import overviews
+except ImportError:
+    import overviews
+
+def getEnvelopeIndices(x,y,bins,start,stop):
+    """Returns the indices of the points of a series with monotonically
+    increasing coordinates x and (masked) values y that are kept when the
+    coordinate range from start to stop is divided into the specified number
+    of bins: the first, last, minimum and maximum point in each bin, and the
+    first masked point (so that gaps in the line are preserved)."""
+    # Select the points within the range, plus one on either side. Of the
+    # points further outside the range, the minimum and maximum are kept,
+    # as the figure uses these to determine the range of the value axis.
+    first,last = numpy.searchsorted(x,(start,stop))
+    first,last = max(first-1,0),min(last+1,len(x))
+    outside = [getExtremes(y[:first]),last+getExtremes(y[last:])]
+    x,y = x[first:last],y[first:last]
+    if len(x)==0: return numpy.unique(numpy.concatenate(outside))
+
+    # Divide the points over bins; consecutive points in the same bin form a segment.
+    ibin = numpy.clip(((x-start)*(bins/float(stop-start))).astype(int),-1,bins)
+    starts = numpy.concatenate(([0],numpy.flatnonzero(numpy.diff(ibin))+1))
+    ends = numpy.concatenate((starts[1:],[len(x)]))-1
+    segment = numpy.repeat(numpy.arange(len(starts)),ends-starts+1)
+
+    # Find the first minimum and maximum in each segment, ignoring masked values.
+    valid = ~numpy.ma.getmaskarray(y)
+    values = numpy.ma.getdata(y)
+    if values.dtype.kind=='f': valid &= numpy.isfinite(values)
+    lower = numpy.where(valid,values,numpy.inf)
+    upper = numpy.where(valid,values,-numpy.inf)
+    def getFirst(matches):
+        indices = numpy.flatnonzero(matches)
+        return indices[numpy.unique(segment[indices],return_index=True)[1]]
+    minimum = getFirst(lower==numpy.minimum.reduceat(lower,starts)[segment])
+    maximum = getFirst(upper==numpy.maximum.reduceat(upper,starts)[segment])
+    masked = getFirst(~valid)
+
+    return numpy.unique(numpy.concatenate(outside+[first+numpy.concatenate((starts,ends,minimum,maximum,masked))]))
+
+def getExtremes(y):
+    """Returns the indices of the minimum and maximum of the valid values in y."""
+    y = numpy.ma.masked_invalid(y)
+    if y.count()==0: return numpy.empty((0,),dtype=int)
+    return numpy.array((y.argmin(),y.argmax()))
+
+def decimateSlice(varslice,bins,start=None,stop=None):
+    """Returns a slice of a one-dimensional series reduced to its envelope
+    for the specified number of bins over the range from start to stop
+    (by default, the full range of coordinates). If the series cannot be
+    decimated, or is not long enough to benefit, it is returned as is."""
+    if varslice.ndim!=1 or varslice.lbound is not None or varslice.ubound is not None: return varslice
+    x,y = numpy.asarray(varslice.coords[0]),varslice.data
+    if len(x)<=4*bins or x.ndim!=1 or x.dtype.kind not in 'iuf' or numpy.ndim(y)!=1 or len(y)!=len(x): return varslice
+
+    # Coordinates must be monotonic.
+    if x[0]>x[-1]:
+        reverse = slice(None,None,-1)
+        x,y = x[reverse],y[reverse]
+    else:
+        reverse = None
+    if not (numpy.diff(x)>=0).all(): return varslice
+
+    if start is None: start = x[0]
+    if stop is None: stop = x[-1]
+    if start>stop: start,stop = stop,start
+    if not stop>start: return varslice
+
+    indices = getEnvelopeIndices(x,y,bins,start,stop)
+    if reverse is not None: indices = len(x)-1-indices[::-1]
+    newslice = xmlplot.common.Variable.Slice(varslice.dimensions)
+    newslice.coords = [numpy.asarray(varslice.coords[0])[indices]]
+    newslice.data = varslice.data[indices]
+    newslice.generateStaggered()
+    return newslice
+
+def switchAxes(xpref,ypref):
+    """Returns whether the figure shows the first dimension of a
+    two-dimensional slice on the y axis, given the preferred axes of the
+    dimensions (as done by xmlplot.plot.Figure)."""
+    if xpref is not None: xpref = xpref.upper()
+    if ypref is not None: ypref = ypref.upper()
+    if xpref=='T': return False
+    if xpref=='X': return ypref=='T'
+    if xpref=='Y': return ypref is None or ypref not in 'YZ'
+    if xpref=='Z': return ypref is None or ypref!='Z'
+    return ypref is not None and ypref in 'XT'
+
+class Decimator(object):
+    """Reduces the data requested by an xmlplot figure to the detail that
+    the figure can show, based on its size and the range of its axes: long
+    one-dimensional series are decimated (decimate), and large
+    two-dimensional slices are read as overviews (getOverviewBounds,
+    readOverview).
+
+    The size and axes ranges that determine overviews are taken from the
+    figure by update, which must be called from the thread that owns the
+    figure; overviews can then be read from any thread. If set, overviews
+    are persisted in the OverviewCache overviews. While disabled (see
+    setEnabled), data are read and returned at full resolution.
+    """
+    def __init__(self,figure):
+        self.figure = figure
+        self.state = None
+        self.overviews = None
+        self.onchange = None
+        self.enabled = True
+
+    def setEnabled(self,enabled):
+        """Sets whether data are reduced. This is disabled while the figure
+        is exported or printed, which can be at a higher resolution than the
+        screen. The next call to update then reports a change."""
+        if enabled==self.enabled: return
+        self.enabled = enabled
+        self.state = None
+
+    def getAxesSize(self):
+        """Returns the width and height of the axes of the figure in pixels.
+        The figure recreates its axes when drawn, after reading data; their
+        size is therefore taken from the subplot parameters, which it keeps."""
+        mplfigure = self.figure.figure
+        params = mplfigure.subplotpars
+        return mplfigure.bbox.width*(params.right-params.left),mplfigure.bbox.height*(params.top-params.bottom)
+
+    def getAxisRange(self,axisid):
+        """Returns the range of the specified axis, with None for bounds that are not fixed."""
+        axisnode = self.figure['Axes'].getChildById('Axis',axisid)
+        if axisnode is None: return None,None
+        if axisnode['IsTimeAxis'].getValue(usedefault=True):
+            start,stop = axisnode['MinimumTime'].getValue(),axisnode['MaximumTime'].getValue()
+            if start is not None: start = xmlplot.common.date2num(start)
+            if stop is not None: stop = xmlplot.common.date2num(stop)
+            return start,stop
+        return axisnode['Minimum'].getValue(),axisnode['Maximum'].getValue()
+
+    def update(self):
+        """Takes the size of the figure and the ranges of its axes, which
+        determine the overviews that are read. If these have changed, data
+        read before may no longer apply; onchange is then called if set.
+        Returns whether this is the case."""
+        width,height = self.getAxesSize()
+        state = (int(math.ceil(width)),int(math.ceil(height)),self.getAxisRange('x'),self.getAxisRange('y'))
+        if state==self.state: return False
+        self.state = state
+        if self.onchange is not None: self.onchange()
+        return True
+
+    def getOverviewBounds(self,var,bounds):
+        """Returns the bounds for reading an overview of a large two-dimensional
+        slice of a variable, given the bounds requested by the figure. If the
+        slice is not larger than the figure, the bounds are returned as is."""
+        if not self.enabled or self.state is None or bounds is None: return bounds
+        shape = var.getShape()
+        if shape is None: return bounds
+        dims = list(var.getDimensions())
+        newbounds = list(xmlplot.common.processEllipsis(bounds,len(dims)))
+        free = [i for i,bound in enumerate(newbounds) if isinstance(bound,slice)]
+        if len(free)!=2 or any(newbounds[i]!=slice(None) for i in free): return bounds
+
+        # Assign dimensions to axes as the figure does.
+        xdim,ydim = free
+        if var.hasReversedDimensions(): xdim,ydim = ydim,xdim
+        if switchAxes(var.getDimensionInfo(dims[xdim]).get('preferredaxis'),var.getDimensionInfo(dims[ydim]).get('preferredaxis')): xdim,ydim = ydim,xdim
+        width,height,xrange,yrange = self.state
+        if overviews.getStride(shape[xdim],width)==1 and overviews.getStride(shape[ydim],height)==1: return bounds
+
+        for idim,pixels,axisrange in ((xdim,width,xrange),(ydim,height,yrange)):
+            start,stop = 0,shape[idim]
+            if axisrange[0] is not None and axisrange[1] is not None:
+                # Zoomed in: read the region within the range of the axis only.
+                coords = overviews.getCoordinates(var,dims[idim],shape[idim])
+                if coords is not None: start,stop = overviews.getIndexRange(coords,axisrange[0],axisrange[1])
+            newbounds[idim] = overviews.getOverviewSlice(start,stop,pixels)
+        return tuple(newbounds)
+
+    def readOverview(self,var,bounds,getslice):
+        """Returns an overview of a variable, read with the specified bounds
+        (from getOverviewBounds) by getslice. Overviews at a stride are taken
+        from the persisted overviews, if set."""
+        cache = self.overviews
+        if cache is None or all(bound.step==1 for bound in bounds if isinstance(bound,slice)): return getslice(bounds)
+        varslice = cache.get(var,bounds)
+        if varslice is None:
+            varslice = getslice(bounds)
+            cache.put(var,bounds,varslice)
+        return varslice
+
+    def decimate(self,var,slices):
+        if isinstance(slices,(list,tuple)): return type(slices)([self.decimate(var,s) for s in slices])
+        if not self.enabled or slices is None or not isinstance(slices,xmlplot.common.Variable.Slice) or slices.ndim!=1: return slices
+
+        # The coordinate is on the horizontal axis, unless the figure puts it on the vertical axis
+        # (by default, for dimensions that represent y or z coordinates).
+        preferredaxis = (var.getDimensionInfo(slices.dimensions[0]).get('preferredaxis') or '').upper()
+        axisid = 'y' if preferredaxis in ('Y','Z') else 'x'
+        width,height = self.getAxesSize()
+        bins = int(math.ceil(height if axisid=='y' else width))
+        if bins<1: return slices
+
+        # Bins of equal width would not match pixels on a logarithmic axis.
+        axisnode = self.figure['Axes'].getChildById('Axis',axisid)
+        if axisnode is not None and not axisnode['IsTimeAxis'].getValue(usedefault=True) and axisnode['LogScale'].getValue(usedefault=True): return slices
+        start,stop = self.getAxisRange(axisid)
+        return decimateSlice(slices,bins,start,stop)
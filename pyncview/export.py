@@ -0,0 +1,152 @@
+"""Export of animation frames by a pool of worker processes.
+
+Each worker process opens the data sources itself and rebuilds the figure
+from its serialized properties. Frames are then distributed over the workers;
+for each frame, the worker replaces the plotted expression (and optionally
+the title) and either exports the figure to file, or returns the rendered
+image to be added to a video by the main process.
+"""
+
+import os,xml.dom.minidom,concurrent.futures,multiprocessing
+
+try:
+    from . import video
+except ImportError:
+    import video
+
+# Figure owned by the current worker process, created by initWorker, or the
+# exception raised while creating it (reported when the first frame is exported).
+figure = None
+initerror = None
+
+def initWorker(*args):
+    global initerror
+    try:
+        createFigure(*args)
+    except Exception as e:
+        initerror = e
+
+def createFigure(sources,properties,defaultsource,defaultfont,size,netcdfmodule):
+    """Opens the data sources and creates the figure in a worker process."""
+    global figure
+    import xmlplot.data,xmlplot.plot
+    if netcdfmodule is not None:
+        if xmlplot.data.netcdf.selectednetcdfmodule is None: xmlplot.data.netcdf.chooseNetCDFModule()
+        xmlplot.data.netcdf.selectednetcdfmodule = netcdfmodule
+
+    figure = xmlplot.plot.Figure(defaultfont=defaultfont)
+    for name,paths,maskoutsiderange,defaultcoordinates in sources:
+        store = xmlplot.data.open(paths)
+        store.maskoutsiderange = maskoutsiderange
+        store.defaultcoordinates = dict(defaultcoordinates)
+        figure.source.addChild(store,name)
+    figure.defaultsource = defaultsource
+    figure.setUpdating(False)
+    figure.setProperties(xml.dom.minidom.parseString(properties))
+    figure['Width'].setValue(size[0])
+    figure['Height'].setValue(size[1])
+
+def exportFrame(expression,title,path,dpi):
+    """Exports a single frame from a worker process. If path is None, the
+    rendered image is returned instead."""
+    if initerror is not None: raise initerror
+    oldseries = figure['Data/Series']
+    expression = figure.source.normalizeExpression(expression,figure.defaultsource)
+    if oldseries.getSecondaryId()!=expression:
+        newseries = figure.addVariable(expression)
+        newseries.copyFrom(oldseries)
+        figure['Data'].removeChildNode(oldseries)
+        if title is not None: figure['Title'].setValue(title)
+    figure.setUpdating(True)
+    try:
+        if path is None: return video.renderFrame(figure,dpi)
+        figure.exportToFile(path,dpi=dpi)
+    finally:
+        figure.setUpdating(False)
+    return path
+
+class ParallelExport(object):
+    """Exports the frames of an animation using a pool of worker processes.
+
+    Frames are specified as (expression,title,path) tuples; title is None
+    if the title of the figure should not change. If a video writer is
+    provided, paths are ignored and frames are instead added to the video,
+    in order, as progress is polled. Progress can be polled with
+    getProgress; the first error raised by any of the workers (or the
+    writer) is available from getError.
+    """
+    def __init__(self,figure,sources,frames,dpi,processes=None,netcdfmodule=None,writer=None):
+        if processes is None: processes = os.cpu_count() or 1
+        processes = max(1,min(processes,len(frames)))
+        initargs = (sources,
+                    figure.getPropertiesCopy().toxml(),
+                    figure.defaultsource,
+                    figure.defaultproperties['Font/Family'].getValue(),
+                    (figure['Width'].getValue(usedefault=True),figure['Height'].getValue(usedefault=True)),
+                    netcdfmodule)
+
+        # Worker processes are started fresh (rather than forked), as the GUI process is multithreaded.
+        self.executor = concurrent.futures.ProcessPoolExecutor(processes,mp_context=multiprocessing.get_context('spawn'),initializer=initWorker,initargs=initargs)
+        if writer is not None: frames = [(expression,title,None) for expression,title,path in frames]
+        self.futures = [self.executor.submit(exportFrame,expression,title,path,dpi) for expression,title,path in frames]
+        self.cancelled = False
+        self.writer = writer
+        self.written = 0
+        self.writeerror = None
+
+    def getProgress(self):
+        """Returns the number of frames that have been exported."""
+        if self.writer is not None:
+            self.writeFrames()
+            return self.written
+        return len([f for f in self.futures if f.done() and not f.cancelled()])
+
+    def writeFrames(self):
+        """Adds frames that have been rendered to the video, as long as all
+        frames before them have been added already."""
+        while self.writeerror is None and not self.cancelled and self.written<len(self.futures):
+            f = self.futures[self.written]
+            if not f.done() or f.exception() is not None: break
+            try:
+                self.writer.write(f.result())
+            except Exception as e:
+                self.writeerror = e
+                break
+            # Release the image.
+            self.futures[self.written] = finished
+            self.written += 1
+
+    def getError(self):
+        if self.writeerror is not None: return self.writeerror
+        for f in self.futures:
+            if f.done() and not f.cancelled() and f.exception() is not None: return f.exception()
+        return None
+
+    def isDone(self):
+        if self.writer is not None and not self.cancelled and self.getError() is None:
+            self.writeFrames()
+            return self.written==len(self.futures)
+        return all(f.done() for f in self.futures)
+
+    def cancel(self):
+        """Cancels all frames that have not been started yet. Frames that are
+        being exported are completed, but a video is discarded."""
+        self.cancelled = True
+        for f in self.futures: f.cancel()
+        self.executor.shutdown(wait=False)
+        if self.writer is not None: self.writer.abort()
+
+    def close(self):
+        """Waits for the workers to finish and completes the video, or
+        discards it if the export was cancelled or failed. Errors in
+        completing the video are raised."""
+        self.executor.shutdown(wait=True)
+        if self.writer is None or self.cancelled: return
+        if self.getError() is not None:
+            self.writer.abort()
+        else:
+            self.writer.close()
+
+# Placeholder for frames that have been added to the video.
+finished = concurrent.futures.Future()
+finished.set_result(None)
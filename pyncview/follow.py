@@ -0,0 +1,90 @@
+"""Following NetCDF files that are still being written.
+
+A model that is running appends records to its output along the unlimited
+dimension (usually time). A Follower polls such a file with a cheap check:
+for classic NetCDF files, the number of records in the header (the first 8
+bytes of the file); for other files, their size and modification time. Only
+when that changes is the file brought up to date (see ncio.Dataset.refresh),
+and only the records that were appended are read: coordinates cached by the
+data store (e.g., time) are extended with the new values, rather than read
+again in full.
+
+The caller decides what else must be updated for the dimensions that grew
+(e.g., the range of slice controls, or a figure that shows the full length
+of the dimension). Slices of records that were present before do not change.
+"""
+
+import os
+
+import numpy
+
+import xmlplot.data.netcdf
+
+try:
+    from . import ncio,ncmmap
+except ImportError:
+    import ncio,ncmmap
+
+def extendCoordinates(store,grown):
+    """Extends the coordinates cached by an xmlplot NetCDF store with the
+    values of records appended along the specified dimensions (a dictionary
+    with the previous and current length of each). Cached values that cannot
+    be extended (e.g., coordinates derived from multiple variables) are
+    discarded, so that they are computed anew when needed."""
+    if not grown: return
+    nc = store.getcdf()
+    for name,data in list(store.cachedcoords.items()):
+        var = store.getVariable_raw(name)
+        if type(var) is not xmlplot.data.netcdf.NetCDFStore.NetCDFVariable or var.ncvarname!=name:
+            del store.cachedcoords[name]
+            continue
+        ncvar = nc.variables[name]
+        dims = list(ncvar.dimensions)
+        axes = [i for i,dim in enumerate(dims) if dim in grown]
+        if not axes: continue
+        oldshape = tuple([grown[dim][0] if dim in grown else length for dim,length in zip(dims,ncvar.shape)])
+        if len(axes)>1 or numpy.shape(data)!=oldshape:
+            del store.cachedcoords[name]
+            continue
+        bounds = [slice(None)]*len(dims)
+        bounds[axes[0]] = slice(oldshape[axes[0]],None)
+        newdata = var.getNcData(tuple(bounds))
+        if isinstance(data,numpy.ma.MaskedArray) or isinstance(newdata,numpy.ma.MaskedArray):
+            store.cachedcoords[name] = numpy.ma.concatenate((data,newdata),axis=axes[0])
+        else:
+            store.cachedcoords[name] = numpy.concatenate((data,newdata),axis=axes[0])
+
+class Follower(object):
+    """Polls a NetCDF file that is open in an xmlplot data store (protected
+    by the ncio module) for records appended to it."""
+    def __init__(self,store,path):
+        self.store = store
+        self.path = path
+        self.state = self.getState()
+
+    def getState(self):
+        """Returns the number of records for classic NetCDF files, or else the
+        size and modification time of the file."""
+        numrecs = ncmmap.getRecordCount(self.path)
+        if numrecs is not None: return numrecs
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_size,stat.st_mtime
+
+    def poll(self):
+        """Checks whether the file has changed, and if so, brings the store
+        up to date. Returns a dictionary with the previous and current length
+        of each dimension that has grown. If the NetCDF library is busy, or
+        the file cannot be reopened (ncio.ReopenError is raised), the file is
+        checked again at the next poll."""
+        state = self.getState()
+        if state==self.state or not ncio.lock.acquire(False): return {}
+        try:
+            grown = self.store.nc.refresh()
+            extendCoordinates(self.store,grown)
+        finally:
+            ncio.lock.release()
+        self.state = state
+        return grown
@@ -0,0 +1,281 @@
+"""Fused evaluation of elementwise expressions with numexpr.
+
+By default, xmlplot evaluates an expression such as sqrt(u**2+v**2) one NumPy
+operation at a time, each creating a temporary array the size of the result.
+If numexpr (https://github.com/pydata/numexpr) is installed, each maximal
+part of an expression that consists of elementwise operations only is
+instead compiled into a single numexpr expression, which numexpr evaluates
+in blocks that fit in the CPU cache, using multiple threads, without
+intermediate arrays. Everything else (variables, slices, functions that
+remove a dimension, etc.) is evaluated as before and enters the fused
+expression as an input.
+
+The result of a fused expression is masked as numpy.ma would mask it: where
+any of its inputs is masked, and where a division, power or function with a
+limited domain (e.g., square root, logarithm) gives a non-finite result. Its
+type is also the one unfused evaluation gives. Should numexpr fail to
+evaluate an expression, the original expression is evaluated instead.
+"""
+
+import copy,re,importlib.util
+
+import numpy
+
+import xmlplot.common,xmlplot.expressions
+
+try:
+    from . import tracing
+except ImportError:
+    import tracing
+
+# numexpr is imported when first needed (see getNumexpr), as it takes long to import.
+numexpr = None
+
+# Operators and functions that numexpr supports, with their numexpr syntax.
+# Reversed operators (e.g., __radd__, used for 1+u) take their arguments in reversed order.
+operators = {'__add__':'+','__sub__':'-','__mul__':'*','__truediv__':'/','__div__':'/','__pow__':'**',
+             '__gt__':'>','__ge__':'>=','__lt__':'<','__le__':'<=','__eq__':'==','__ne__':'!='}
+reversedoperators = {'__radd__':'+','__rsub__':'-','__rmul__':'*','__rtruediv__':'/','__rdiv__':'/','__rpow__':'**'}
+unaryoperators = {'__neg__':'-','__pos__':'+'}
+functions = {'sqrt':'sqrt','sin':'sin','cos':'cos','tan':'tan','arcsin':'arcsin','arccos':'arccos','arctan':'arctan','arctan2':'arctan2',
+             'sinh':'sinh','cosh':'cosh','tanh':'tanh','arcsinh':'arcsinh','arccosh':'arccosh','arctanh':'arctanh',
+             'exp':'exp','expm1':'expm1','log':'log','log10':'log10','log1p':'log1p','abs':'abs','absolute':'abs','fabs':'abs'}
+
+# Functions that return a non-finite value for any non-finite argument.
+propagatingfunctions = ('sqrt','sin','cos','tan','arcsin','arccos','sinh','cosh','arcsinh','arccosh','arctanh','log','log10','log1p','abs','absolute','fabs')
+
+class FusionError(Exception):
+    pass
+
+def getNumexpr():
+    """Returns the numexpr module, or None if it is not available."""
+    global numexpr
+    if numexpr is None:
+        try:
+            import numexpr as module
+        except ImportError:
+            module = False
+        numexpr = module
+    return numexpr or None
+
+def isAvailable():
+    """Returns whether numexpr is available, without importing it."""
+    if numexpr is None: return importlib.util.find_spec('numexpr') is not None
+    return bool(numexpr)
+
+def fuseExpression(var):
+    """Returns a variable that evaluates the elementwise parts of the
+    specified variable or expression with numexpr. If there are no such
+    parts, or numexpr is not available, the variable itself is returned."""
+    if getNumexpr() is None or not isinstance(var,xmlplot.expressions.VariableExpression): return var
+    roots = [fuseNode(node) for node in var.root]
+    if all(new is old for new,old in zip(roots,var.root)): return var
+    return xmlplot.expressions.VariableExpression(roots)
+
+def fuseNode(node):
+    """Returns the specified expression node with its elementwise parts fused."""
+    if not isinstance(node,xmlplot.expressions.LazyExpression): return node
+    inputs = []
+    if compileNode(node,inputs) is not None and inputs: return FusedExpression(node,inputs)
+    if isinstance(node,(xmlplot.expressions.LazyVariable,xmlplot.expressions.LazySlice)): return node
+
+    # Not elementwise itself: fuse the arguments.
+    args = [fuseNode(arg) for arg in node.args]
+    kwargs = dict([(name,fuseNode(arg)) for name,arg in node.kwargs.items()])
+    if all(new is old for new,old in zip(args,node.args)) and all(kwargs[name] is arg for name,arg in node.kwargs.items()): return node
+    newnode = copy.copy(node)
+    newnode.args,newnode.kwargs = type(node.args)(args),kwargs
+    return newnode
+
+def compileNode(node,inputs,masked={}):
+    """Returns the numexpr text for an elementwise expression node, or None
+    if the node is not elementwise. Expression nodes that are not elementwise
+    are added to inputs (after fusing their own arguments), and referred to
+    by name in the text.
+
+    Masking follows numpy.ma, which depends on which inputs are masked arrays:
+    masked maps their names to the name of their mask (None if they have no
+    mask). With the text, the following are returned: whether unfused
+    evaluation would give a masked array, the names of the masks that the
+    result takes, the numexpr texts of the domain checks of the result (where
+    an operation with a limited domain gives a non-finite value), and whether
+    such a value can be absent from the result (e.g., 1/x for infinite x)."""
+    if isinstance(node,(bool,numpy.bool_)): return '(%r)' % bool(node),False,[],[],False
+    if isinstance(node,(int,float,numpy.integer,numpy.floating)):
+        # Numeric constants are passed as inputs, so that their type can be
+        # chosen as NumPy would (see FusedExpression._getValue).
+        name = 'c%i' % len(inputs)
+        inputs.append((name,node))
+        return name,False,[],[],False
+    if isinstance(node,xmlplot.expressions.LazyOperator) and not node.kwargs:
+        if len(node.args)==1 and node.name in unaryoperators:
+            arg = compileArgument(node.args[0],inputs,masked)
+            if arg is not None: return ('(%s%s)' % (unaryoperators[node.name],arg[0]),)+arg[1:]
+        elif len(node.args)==2 and (node.name in operators or node.name in reversedoperators):
+            args = [compileArgument(arg,inputs,masked) for arg in node.args]
+            if None not in args:
+                if node.name in reversedoperators: args.reverse()
+                op = operators.get(node.name,reversedoperators.get(node.name))
+                if op=='**' and isinstance(dict(inputs).get(args[1][0]),(int,float,numpy.integer,numpy.floating)):
+                    # A constant exponent becomes a literal, with a factor one to type the base (see FusedExpression._getValue).
+                    names = [name for name,value in inputs]
+                    i = names.index(args[1][0])
+                    inputs[i] = ('e%s' % inputs[i][0][1:],inputs[i][1])
+                    args = [('(%s*p%s)' % (args[0][0],inputs[i][0][1:]),)+args[0][1:],(inputs[i][0],)+args[1][1:]]
+
+                # numpy.ma masks non-finite results of division and power.
+                propagating = {'+':(True,True),'-':(True,True),'*':(True,True),'/':(True,False)}.get(op,(False,False))
+                return combineArguments('(%s%s%s)' % (args[0][0],op,args[1][0]),args,inputs,op in ('/','**'),propagating)
+    elif type(node) is xmlplot.expressions.LazyFunction and node.name in functions and node.removedim is None and not node.useslices and not node.kwargs:
+        args = [compileArgument(arg,inputs,masked) for arg in node.args]
+        if None not in args:
+            # xmlplot takes functions from numpy.ma: these always return masked arrays,
+            # with domain checks if the function has a limited domain.
+            text = '%s(%s)' % (functions[node.name],','.join([arg[0] for arg in args]))
+            return combineArguments(text,args,inputs,getattr(node.func,'domain',None) is not None,[node.name in propagatingfunctions]*len(args),True)
+    return None
+
+def compileArgument(arg,inputs,masked={}):
+    """Returns the numexpr text for an argument of an elementwise operation
+    (see compileNode): its own elementwise expression, or a reference to an
+    input."""
+    compiled = compileNode(arg,inputs,masked)
+    if compiled is not None or not isinstance(arg,xmlplot.expressions.LazyExpression): return compiled
+    for name,node in inputs:
+        if node is arg: break
+    else:
+        name = 'v%i' % len(inputs)
+        inputs.append((name,arg))
+    return name,name in masked,[masked[name]] if masked.get(name) is not None else [],[],False
+
+def combineArguments(text,args,inputs,domained,propagating,ma=False):
+    """Returns the compiled form (see compileNode) of an operation with
+    the specified text and compiled arguments. If any argument is a masked
+    array (or ma is set), numpy.ma evaluates the operation: the result takes
+    the masks of all arguments, and domain checks if the operation is
+    domained. numpy.ma also treats Python numbers as 64-bit values, whereas
+    plain NumPy gives them the type of the array they are combined with.
+    propagating specifies per argument whether a non-finite value of the
+    argument always makes the result non-finite."""
+    ma = ma or any([arg[1] for arg in args])
+    masks,checks = [],[]
+    for arg in args:
+        masks += [mask for mask in arg[2] if mask not in masks]
+        checks += arg[3]
+    hidden = any([arg[4] or (arg[3] and not p) for arg,p in zip(args,propagating)])
+    if ma:
+        names = [arg[0] for arg in args]
+        for i,(name,value) in enumerate(inputs):
+            if name in names and isinstance(value,(int,float)) and not isinstance(value,bool): inputs[i] = (name,numpy.asarray(value)[()])
+        if domained: checks.append('(~isfinite(%s))' % text)
+    return text,ma,masks,checks,hidden
+
+class FusedExpression(xmlplot.expressions.LazyOperation):
+    """An elementwise expression evaluated by numexpr. It behaves as the
+    expression node it replaces; its arguments are the inputs of the fused
+    expression."""
+    def __init__(self,original,inputs):
+        variables = [(name,node) for name,node in inputs if isinstance(node,xmlplot.expressions.LazyExpression)]
+        xmlplot.expressions.LazyOperation.__init__(self,*[fuseNode(node) for name,node in variables])
+        self.original = original
+        self.names = [name for name,node in variables]
+
+    def getText(self,type=0,addparentheses=True):
+        return self.original.getText(type,addparentheses)
+
+    def getShape(self):
+        return self.original.getShape()
+
+    def getDimensions(self):
+        return self.original.getDimensions()
+
+    def getValue(self,extraslices=None,dataonly=False):
+        try:
+            return xmlplot.expressions.LazyOperation.getValue(self,extraslices,dataonly)
+        except FusionError:
+            return self.original.getValue(extraslices,dataonly)
+
+    def _getValue(self,resolvedargs,resolvedkwargs,dataonly=False):
+        slices = [arg for arg in resolvedargs if isinstance(arg,xmlplot.common.Variable.Slice)]
+        values = [arg.data if isinstance(arg,xmlplot.common.Variable.Slice) else arg for arg in resolvedargs]
+
+        # Inputs are combined unmasked; their masks enter the expression for the mask of the result.
+        arrays,masked = {},{}
+        for name,value in zip(self.names,values):
+            arrays[name] = numpy.ma.getdata(value)
+            if isinstance(value,numpy.ma.MaskedArray):
+                masked[name] = None
+                if value.mask is not numpy.ma.nomask:
+                    masked[name] = 'm%s' % name[1:]
+                    arrays[masked[name]] = value.mask
+
+        # Which operations numpy.ma would evaluate depends on which inputs are masked,
+        # so the expression is compiled for these (numexpr caches compiled expressions).
+        inputs = []
+        text,ma,masks,checks,hidden = compileNode(self.original,inputs,masked)
+
+        # Constants that NumPy treats as typed values promote the data type (e.g., float32 data times 2.5
+        # is float64 in numpy.ma); other Python numbers take the type of the data as in plain NumPy.
+        floattypes = [value.dtype for value in arrays.values() if value.dtype.kind=='f']
+        floattype = numpy.result_type(*floattypes) if floattypes else numpy.float64
+
+        # numexpr combines integer and float arrays in the float type; NumPy may promote further (int32 and float32 give float64).
+        for name in self.names:
+            if floattypes and arrays[name].dtype.kind in 'iu': arrays[name] = arrays[name].astype(numpy.result_type(arrays[name].dtype,*floattypes))
+        literals = {}
+        for name,value in inputs:
+            if isinstance(value,xmlplot.expressions.LazyExpression): continue
+            strong = isinstance(value,numpy.generic)
+            if strong:
+                dtype = numpy.result_type(value,*floattypes)
+            else:
+                dtype = floattype if isinstance(value,float) or floattypes else numpy.asarray(value).dtype
+
+            # Constants are written as literals where numexpr types them correctly, as it folds
+            # and simplifies those (e.g., x**2 becomes x*x): numexpr takes float literals to be
+            # double, integer literals to have the type of the data, and evaluates a power with
+            # a literal exponent in the type of the base.
+            if name.startswith('e'):
+                literals[name] = repr(value.item() if strong else value)
+                if strong and dtype!=numpy.float64:
+                    arrays['p%s' % name[1:]] = numpy.ones((),dtype=dtype)
+                else:
+                    literals['p%s' % name[1:]] = '1.0' if strong else '1'
+            elif dtype==numpy.float64 and numpy.isfinite(value):
+                literals[name] = repr(float(value))
+            elif not strong and isinstance(value,int):
+                literals[name] = repr(value)
+            else:
+                arrays[name] = numpy.asarray(value,dtype=dtype)
+        substitute = lambda text: re.sub(r'\b[cep]\d+\b',lambda match: literals.get(match.group(0),match.group(0)),text)
+        text,checks = substitute(text),[substitute(check) for check in checks]
+        try:
+            with tracing.span('evaluate (numexpr)'):
+                data = getNumexpr().evaluate(text,local_dict=arrays,global_dict={})
+                mask = numpy.ma.nomask
+                if masks: mask = getNumexpr().evaluate('|'.join(masks),local_dict=arrays,global_dict={})
+                if checks:
+                    if hidden or data.dtype.kind not in 'fc':
+                        invalid = getNumexpr().evaluate('|'.join(checks),local_dict=arrays,global_dict={})
+                    else:
+                        # Non-finite values of domained operations all show in the result:
+                        # the domain checks are needed only where the result is non-finite.
+                        invalid = ~numpy.isfinite(data)
+                        if invalid.any():
+                            points = dict([(name,numpy.broadcast_to(value,data.shape)[invalid] if numpy.ndim(value) else value) for name,value in arrays.items()])
+                            invalid[invalid] = getNumexpr().evaluate('|'.join(checks),local_dict=points,global_dict={})
+                    mask = invalid if mask is numpy.ma.nomask else numpy.logical_or(mask,invalid)
+        except Exception as e:
+            raise FusionError(str(e))
+        if mask is not numpy.ma.nomask and mask.shape!=data.shape: mask = numpy.array(numpy.broadcast_to(mask,data.shape))
+        if ma: data = numpy.ma.masked_array(data,mask=mask)
+        if dataonly or not slices: return data
+
+        # Store the result in the input that has the shape of the result, or else the first.
+        targetslice = slices[0]
+        for s in slices:
+            if numpy.shape(s.data)==data.shape:
+                targetslice = s
+                break
+        targetslice.data = data
+        return targetslice
@@ -0,0 +1,278 @@
+"""Headers of NetCDF files, kept between sessions for a fast reopen.
+
+Opening a NetCDF file makes xmlplot read its header: dimensions, variables,
+and their attributes. For files with many variables, on slow (e.g., network)
+drives, or for NetCDF-4 files, whose metadata are spread throughout the file,
+this takes long, and it is repeated every time the file is opened.
+
+Here, the header is stored in a cache directory after a file is opened,
+keyed by the path, size and modification time of the file. When an
+unchanged file is opened again, a stand-in for the NetCDF file object
+(Dataset) serves the header from the cache, and the file itself is opened
+only when anything else is needed, usually when data are read. Data that
+xmlplot reads while setting up its store (e.g., coordinates that a
+convention examines to detect the grid) are kept in the cache as well, if
+small. Once the file is open, the stand-in passes everything on to the file
+object.
+
+Files with data types that cannot be stored in the cache (e.g., compound or
+variable-length types) are opened as before.
+"""
+
+import os,json,hashlib,threading,functools
+
+import numpy
+
+import xmlplot.data
+import xmlplot.data.netcdf
+
+try:
+    from . import ncio
+except ImportError:
+    import ncio
+
+# Maximum total size (bytes) of the data read while setting up a store that
+# are stored in the cache.
+maxreadsize = 2**23
+
+def encodeValue(value):
+    """Returns a JSON-compatible representation of an attribute value."""
+    if isinstance(value,str) or isinstance(value,(bool,int,float)) and not isinstance(value,numpy.generic): return value
+    if isinstance(value,list) and all([isinstance(item,str) for item in value]): return {'list':value}
+    array = numpy.asarray(value)
+    if array.dtype.kind not in 'biuf': raise ValueError('Attribute value %r cannot be cached.' % (value,))
+    return {'dtype':array.dtype.str,'shape':list(array.shape),'values':array.ravel().tolist(),'scalar':isinstance(value,numpy.generic)}
+
+def decodeValue(value):
+    """Returns an attribute value from its representation made by encodeValue."""
+    if not isinstance(value,dict): return value
+    if 'list' in value: return value['list']
+    array = numpy.array(value['values'],dtype=value['dtype']).reshape(value['shape'])
+    return array[()] if value['scalar'] else array
+
+def getAttributes(obj):
+    return dict([(name,encodeValue(obj.getncattr(name))) for name in obj.ncattrs()])
+
+def getHeader(nc):
+    """Returns the header of an open NetCDF file as a JSON-compatible
+    dictionary. Raises ValueError if it cannot be cached."""
+    if not (hasattr(nc,'data_model') and hasattr(nc,'ncattrs')): raise ValueError('NetCDF module does not describe the file in full.')
+    variables,variablemembers = [],[]
+    for name,ncvar in nc.variables.items():
+        dtype = ncvar.dtype
+        if not isinstance(dtype,numpy.dtype) or dtype.kind not in 'biufSU' or dtype.fields is not None:
+            raise ValueError('Data type of variable %s cannot be cached.' % name)
+        variables.append({'name':name,'dimensions':list(ncvar.dimensions),'shape':[int(l) for l in ncvar.shape],
+                          'dtype':dtype.str,'chunking':ncvar.chunking(),'attributes':getAttributes(ncvar)})
+        variablemembers = [member for member in dir(type(ncvar)) if not member.startswith('_')]
+    return {'data_model':nc.data_model,'file_format':nc.file_format,
+            'dimensions':[[name,len(dim),dim.isunlimited()] for name,dim in nc.dimensions.items()],
+            'attributes':getAttributes(nc),'variables':variables,
+            'members':[member for member in dir(type(nc)) if not member.startswith('_')],
+            'variablemembers':variablemembers,'reads':{}}
+
+class Cache(object):
+    """Headers of NetCDF files, persisted in the specified directory."""
+    def __init__(self,directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def getKey(self,path):
+        """Returns the key of a file in its current state, or None if it
+        cannot be determined."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return '%s\n%i\n%r' % (os.path.abspath(path),stat.st_size,stat.st_mtime)
+
+    def getPath(self,path):
+        return os.path.join(self.directory,'%s.npz' % hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest())
+
+    def load(self,path,key):
+        """Returns the header of a file if cached for the specified key, or None."""
+        if key is None: return None
+        try:
+            with numpy.load(self.getPath(path),allow_pickle=False) as f:
+                if str(f['key'])!=key: return None
+                header = json.loads(str(f['header']))
+                header['reads'] = dict([(read,f['read%i' % i]) for i,read in enumerate(header['reads'])])
+                return header
+        except (IOError,OSError,KeyError,ValueError):
+            return None
+
+    def save(self,path,key,header):
+        if key is None: return
+        reads = list(header['reads'].items())
+        arrays = {'key':numpy.array(key),'header':numpy.array(json.dumps(dict(header,reads=[read for read,data in reads])))}
+        for i,(read,data) in enumerate(reads): arrays['read%i' % i] = data
+        target = self.getPath(path)
+        with self.lock:
+            try:
+                if not os.path.isdir(self.directory): os.makedirs(self.directory)
+                with open(target+'.tmp','wb') as f:
+                    numpy.savez(f,**arrays)
+                os.replace(target+'.tmp',target)
+            except (IOError,OSError) as e:
+                print('Unable to save header of "%s": %s' % (path,e))
+
+class Dimension(object):
+    """Stand-in for a NetCDF dimension object."""
+    def __init__(self,name,size,unlimited):
+        self.name = name
+        self.size = size
+        self.unlimited = unlimited
+
+    def __len__(self):
+        return self.size
+
+    def isunlimited(self):
+        return self.unlimited
+
+class Variable(object):
+    """Stand-in for a NetCDF variable object, serving its metadata from the
+    cache until the file is opened. Calls that configure masking and scaling
+    are replayed on the variable object once the file is open."""
+    def __init__(self,dataset,entry):
+        self.dataset = dataset
+        self.ncvar = None
+        self.calls = []
+        self.cached = {'name':entry['name'],'dimensions':tuple(entry['dimensions']),'shape':tuple(entry['shape']),
+                       'dtype':numpy.dtype(entry['dtype']),'ndim':len(entry['shape']),'size':int(numpy.prod(entry['shape'])),
+                       'mask':True,'scale':True}
+        self.chunks = entry['chunking']
+        self.attributes = dict([(name,decodeValue(value)) for name,value in entry['attributes'].items()])
+
+    def getNcVariable(self):
+        if self.ncvar is None:
+            ncvar = self.dataset.open().variables[self.cached['name']]
+            for name,args in self.calls: getattr(ncvar,name)(*args)
+            self.ncvar = ncvar
+        return self.ncvar
+
+    def configure(self,name,*args):
+        self.calls = [call for call in self.calls if call[0]!=name]+[(name,args)]
+        if name in ('set_auto_maskandscale','set_auto_mask'): self.cached['mask'] = bool(args[0])
+        if name in ('set_auto_maskandscale','set_auto_scale'): self.cached['scale'] = bool(args[0])
+
+    def ncattrs(self):
+        if self.dataset.nc is not None: return self.getNcVariable().ncattrs()
+        return list(self.attributes.keys())
+
+    def getncattr(self,name):
+        if self.dataset.nc is not None: return self.getNcVariable().getncattr(name)
+        if name not in self.attributes: raise AttributeError('Variable %s has no attribute %s.' % (self.cached['name'],name))
+        return self.attributes[name]
+
+    def chunking(self):
+        if self.dataset.nc is not None: return self.getNcVariable().chunking()
+        return self.chunks
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self,*args,**kwargs):
+        return numpy.asarray(self[(Ellipsis,)],*args,**kwargs)
+
+    def __getitem__(self,indices):
+        reads = self.dataset.reads
+        if self.dataset.nc is None:
+            data = self.dataset.header['reads'].get(self.getReadKey(indices),None)
+            if data is not None: return data.copy()
+        data = self.getNcVariable()[indices]
+        if reads is not None and type(data) is numpy.ndarray and sum([d.nbytes for d in reads.values()])+data.nbytes<=maxreadsize:
+            reads[self.getReadKey(indices)] = data.copy()
+        return data
+
+    def getReadKey(self,indices):
+        return '%s\n%r\n%i%i' % (self.cached['name'],indices,self.mask,self.scale)
+
+    def __getattr__(self,name):
+        if self.dataset.nc is None:
+            if name in self.attributes: return self.attributes[name]
+            if name in self.cached: return self.cached[name]
+            if name.startswith('set_auto_') or name.startswith('set_always_'): return functools.partial(self.configure,name)
+            if name not in self.dataset.header['variablemembers']: raise AttributeError(name)
+        return getattr(self.getNcVariable(),name)
+
+class Dataset(object):
+    """Stand-in for a NetCDF file object, serving its header from the cache.
+    The file is opened when anything else is needed. If reads is set to a
+    dictionary, small reads are recorded in it, for storage in the cache."""
+    def __init__(self,path,header,nc=None):
+        self.nc = nc
+        self.path = path
+        self.header = header
+        self.reads = None
+        self.cacheddimensions = dict([(name,Dimension(name,size,unlimited)) for name,size,unlimited in header['dimensions']])
+        self.variables = dict([(entry['name'],Variable(self,entry)) for entry in header['variables']])
+        self.attributes = dict([(name,decodeValue(value)) for name,value in header['attributes'].items()])
+
+    def open(self):
+        """Returns the NetCDF file object, opening the file if needed."""
+        if self.nc is None: self.nc = xmlplot.data.netcdf.getNetCDFFile(self.path)
+        return self.nc
+
+    @property
+    def dimensions(self):
+        return self.cacheddimensions if self.nc is None else self.nc.dimensions
+
+    def filepath(self):
+        return self.path
+
+    def ncattrs(self):
+        if self.nc is not None: return self.nc.ncattrs()
+        return list(self.attributes.keys())
+
+    def getncattr(self,name):
+        if self.nc is not None: return self.nc.getncattr(name)
+        if name not in self.attributes: raise AttributeError('File has no attribute %s.' % name)
+        return self.attributes[name]
+
+    def close(self):
+        if self.nc is not None: self.nc.close()
+
+    def __getattr__(self,name):
+        if name in ('nc','header','attributes'): raise AttributeError(name)
+        if self.nc is None:
+            if name in self.attributes: return self.attributes[name]
+            if name in ('data_model','file_format'): return self.header[name]
+            if name not in self.header['members']: raise AttributeError(name)
+        return getattr(self.open(),name)
+
+def createStore(nc):
+    """Returns an xmlplot data store for an open NetCDF file, following the
+    first convention that applies to it."""
+    for convention in xmlplot.data.netcdf.NetCDFStore.conventions:
+        if convention.testFile(nc): return convention(nc)
+    return xmlplot.data.netcdf.NetCDFStore(nc)
+
+def openStore(path,directory):
+    """Returns an xmlplot data store for a NetCDF file, with its header taken
+    from the cache in the specified directory if the file has not changed
+    since it was cached, and otherwise stored there. The NetCDF lock is held
+    while the NetCDF library may be used, but not while the cache is accessed."""
+    cache = Cache(directory)
+    key = cache.getKey(path)
+    header = cache.load(path,key)
+    if header is not None:
+        try:
+            with ncio.lock:
+                return createStore(Dataset(path,header))
+        except Exception as e:
+            print('Unable to use cached header of "%s": %s' % (path,e))
+    with ncio.lock:
+        try:
+            nc = xmlplot.data.netcdf.getNetCDFFile(path)
+        except Exception:
+            return xmlplot.data.open(path)
+        try:
+            header = getHeader(nc)
+        except ValueError:
+            return createStore(nc)
+        dataset = Dataset(path,header,nc)
+        dataset.reads = {}
+        store = createStore(dataset)
+        header['reads'],dataset.reads = dataset.reads,None
+    cache.save(path,key,header)
+    return store
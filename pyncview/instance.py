@@ -0,0 +1,87 @@
+"""Handing files over to a PyNcView instance that is already running.
+
+When started with --single-instance, PyNcView first tries to connect to a
+local socket (QLocalServer; a named pipe on Windows) owned by a running
+instance. If that succeeds, it sends the paths from its command line there
+and exits, without importing anything beyond Qt. The running instance opens
+the files and brings its window to the front. If no instance is running, the
+new instance starts as usual and listens on the socket itself.
+
+The socket is named after the user, and is accessible to that user only.
+Paths are sent as a JSON list, followed by a newline; relative paths are
+made absolute first, as the running instance may have another working
+directory. The running instance acknowledges with "ok".
+"""
+
+import os,json,getpass,re
+
+from xmlstore.qt_compat import QtCore,importModule
+QtNetwork = importModule('QtNetwork')
+
+# Time (ms) to wait for a running instance to respond.
+timeout = 5000
+
+def getServerName():
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'default'
+    return 'pyncview-%s' % re.sub(r'[^\w.-]','_',user)
+
+def getAbsolutePaths(paths):
+    """Returns paths relative to the current working directory as absolute
+    paths. URLs are returned unchanged."""
+    return [path if '://' in path else os.path.abspath(path) for path in paths]
+
+def sendPaths(paths):
+    """Sends paths to the running instance, if any. Returns whether the
+    running instance has received them."""
+    socket = QtNetwork.QLocalSocket()
+    socket.connectToServer(getServerName())
+    if not socket.waitForConnected(timeout): return False
+    socket.write((json.dumps(getAbsolutePaths(paths))+'\n').encode('utf-8'))
+    socket.flush()
+    reply = b''
+    while not reply.endswith(b'\n') and socket.waitForReadyRead(timeout): reply += bytes(socket.readAll())
+    socket.disconnectFromServer()
+    return reply.strip()==b'ok'
+
+class Server(QtCore.QObject):
+    """Listens for paths sent by instances started later, and emits them
+    with the received signal."""
+    received = QtCore.Signal(object)
+
+    def __init__(self,parent=None):
+        QtCore.QObject.__init__(self,parent)
+        self.buffers = {}
+        self.server = QtNetwork.QLocalServer(self)
+        self.server.setSocketOptions(QtNetwork.QLocalServer.SocketOption.UserAccessOption)
+        self.server.newConnection.connect(self.onNewConnection)
+        name = getServerName()
+        if not self.server.listen(name):
+            # The socket may remain from an instance that did not exit cleanly.
+            QtNetwork.QLocalServer.removeServer(name)
+            if not self.server.listen(name): print('Unable to listen for files from other PyNcView instances: %s' % self.server.errorString())
+
+    def onNewConnection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.buffers[socket] = b''
+            socket.readyRead.connect(lambda socket=socket: self.onReadyRead(socket))
+            socket.disconnected.connect(lambda socket=socket: self.onDisconnected(socket))
+
+    def onReadyRead(self,socket):
+        self.buffers[socket] += bytes(socket.readAll())
+        if not self.buffers[socket].endswith(b'\n'): return
+        try:
+            paths = json.loads(self.buffers[socket].decode('utf-8'))
+        except ValueError:
+            socket.disconnectFromServer()
+            return
+        socket.write(b'ok\n')
+        socket.flush()
+        self.received.emit([str(path) for path in paths])
+
+    def onDisconnected(self,socket):
+        self.buffers.pop(socket,None)
+        socket.deleteLater()
@@ -56,6 +56,12 @@ def main():
     """Parses command line, creates multiplot.Plotter object, and calls plot.
     """
     
+    # In frozen builds, worker processes are started by running this entry point;
+    # freeze_support then runs the worker instead.
+    if hasattr(sys,'frozen'):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
     import optparse
 
     # Parse command line options
@@ -96,8 +102,9 @@ environment variable GOTMGUIDIR may be set, pointing to the GOTM-GUI root
     parser.add_option('-E','--namedexpression',type='string',action='callback',callback=newexpression,nargs=2,metavar='SERIESNAME EXPRESSION', help='Data series to plot. SERIESNAME: name for the data series (currently used in the default plot title and legend), EXPRESSION: variable name or mathematical expression that can contain variables from NetCDF files, as well as several standard functions (e.g., sum, mean, min, max) and named constants (e.g., pi).')
     parser.add_option('-x','--figurexml',      type='string',metavar='PATH',help='Path to XML file with figure settings. Typically this file is created by first running multiplot.py without the -o/--output option, changing figure settings through the graphical user interface, and then saving these to file.')
     parser.add_option('-q','--quiet',  action='store_true', help='suppress output of progress messages')
-    parser.add_option('-a','--animate',type='string',metavar='DIMENSION', help='Create an animation by varying the index of this dimension. Stills for each index will be exported to the output path, which should be an existing directory or a Python formatting template for file names accepting an integer (e.g. "./movie/still%05i.png"). If this switch is provided without the -o/--output option, only the first frame of the animation will be shown on screen.')
-    parser.add_option('-o','--output', type='string',metavar='PATH', help='Output path. This should be the name of the file to be created, unless --animate/-a is specified - in that case it can either be an existing directory or a formatting template for file names (see -a/--animate option). If this argument is ommitted, a dialog displaying the plot will be shown on-screen.')
+    parser.add_option('-a','--animate',type='string',metavar='DIMENSION', help='Create an animation by varying the index of this dimension. If the output path has the extension of a video (.mp4, .webm, .mkv; these require ffmpeg) or animated image (.png, .apng, .gif) and is not a template (i.e., contains no %), the animation is written directly to that file. Otherwise, stills for each index will be exported to the output path, which should be an existing directory or a Python formatting template for file names accepting an integer (e.g. "./movie/still%05i.png"). If this switch is provided without the -o/--output option, only the first frame of the animation will be shown on screen.')
+    parser.add_option('-o','--output', type='string',metavar='PATH', help='Output path. This should be the name of the file to be created, unless --animate/-a is specified - in that case it can either be a video file, an existing directory or a formatting template for file names (see -a/--animate option). If this argument is ommitted, a dialog displaying the plot will be shown on-screen.')
+    parser.add_option(     '--fps',    type='int', help='Frame rate of animations exported to a video file or animated image. The default is 24 frames per second.')
     parser.add_option(     '--reassign', type='string',help='Dimension reassignments. This should be a comma-separated list of olddimension=newdimension pairs.')
     parser.add_option('-d','--dpi',    type='int', help='Resolution of exported figure in dots per inch (integer). The default resolution is 96 dpi. Only used in combination with -o/--output.')
     parser.add_option('-i','--id',     type='string', action='append',help='Plot identifier to be shown in corner of the figure.')
@@ -105,7 +112,7 @@ environment variable GOTMGUIDIR may be set, pointing to the GOTM-GUI root
     parser.add_option('--nc', type='string', help='NetCDF module to use')
     parser.add_option('--nosqueeze',action='store_true',help='prevent squeezing out of singleton dimensions (with length 1)')
     parser.add_option('--nomask',action='store_true',help='prevent masking of values outside their valid range as defined in NetCDF')
-    parser.set_defaults(dpi=96,quiet=False,sources={},animate=None,output=None,expressions=[],lastsource=None,id=[],debug=False,nc=None,reassign=None,nosqueeze=False,nomask=False)
+    parser.set_defaults(dpi=96,fps=24,quiet=False,sources={},animate=None,output=None,expressions=[],lastsource=None,id=[],debug=False,nc=None,reassign=None,nosqueeze=False,nomask=False)
 
     # Add old deprecated options (not shown in help text)
     parser.add_option('-f','--font',     type='string',help=optparse.SUPPRESS_HELP)
@@ -154,7 +161,7 @@ environment variable GOTMGUIDIR may be set, pointing to the GOTM-GUI root
     # Create plotter object
     plt = Plotter(options.sources,options.expressions,assignments=assignments,verbose=not options.quiet,output=options.output,
                   figurexml=options.figurexml,animate=options.animate,dpi=options.dpi,id=options.id,debug=options.debug,
-                  nc=options.nc,reassign=dimassignments,autosqueeze=not options.nosqueeze,maskoutsiderange=not options.nomask)
+                  nc=options.nc,reassign=dimassignments,autosqueeze=not options.nosqueeze,maskoutsiderange=not options.nomask,fps=options.fps)
                   
     # Plot
     try:
@@ -170,10 +177,11 @@ environment variable GOTMGUIDIR may be set, pointing to the GOTM-GUI root
 
 matplotlib = None
 xmlplot = None
+video = None
 QtWidgets = None
 
 def importModules(verbose=True):
-    global matplotlib,xmlplot
+    global matplotlib,xmlplot,video
 
     # If MatPlotLib if already loaded, we are done: return.
     if matplotlib is not None: return
@@ -198,11 +206,15 @@ def importModules(verbose=True):
     except ImportError as e:
         print('Unable to import xmlplot (%s). Please ensure that it is installed.' % e)
         sys.exit(1)
+    try:
+        from . import video
+    except ImportError:
+        import video
 
     sys.path = path
 
 class Plotter(object):
-    def __init__(self,sources=None,expressions=None,assignments=None,output=None,verbose=True,figurexml=None,dpi=None,animate=None,id=[],debug=False,nc=None,reassign={},autosqueeze=False,maskoutsiderange=True):
+    def __init__(self,sources=None,expressions=None,assignments=None,output=None,verbose=True,figurexml=None,dpi=None,animate=None,id=[],debug=False,nc=None,reassign={},autosqueeze=False,maskoutsiderange=True,fps=24):
         if sources     is None: sources = {}
         if expressions is None: expressions = []
         if assignments is None: assignments = {}
@@ -218,6 +230,7 @@ class Plotter(object):
         self.figurexml = figurexml
         self.animate = animate
         self.dpi = dpi
+        self.fps = fps
         self.id = id
         self.verbose = verbose
         self.debug = debug
@@ -366,6 +379,22 @@ class Plotter(object):
                 if self.verbose:
                     print('Exporting figure to "%s".' % self.output)
                 fig.exportToFile(self.output,dpi=self.dpi)
+            elif video.isVideoPath(self.output) and '%' not in self.output:
+                # Render frames to memory and stream these directly to the video file.
+                # (a path with % is a template for the file names of stills, e.g., still%05i.png)
+                writer = video.openWriter(self.output,animator.length,self.fps)
+                try:
+                    while True:
+                        hasmore = animator.nextFrame()
+                        fig.setUpdating(True)
+                        if self.verbose:
+                            print('Creating frame %i of %s...' % (animator.index+1,animator.length))
+                        writer.write(video.renderFrame(fig,self.dpi))
+                        if not hasmore: break
+                except:
+                    writer.abort()
+                    raise
+                writer.close()
             else:
                 animator.animateAndExport(self.output,dpi=self.dpi,verbose=self.verbose)
 
@@ -0,0 +1,185 @@
+"""Access to NetCDF files from multiple threads.
+
+PyNcView opens and reads NetCDF files in worker threads, but the NetCDF
+library itself is not thread-safe. All calls into it are therefore serialized
+by a single lock. The Dataset class wraps a file object as returned by
+xmlplot.data.netcdf.openNetCDF and holds that lock for every access, so it
+can take the place of the file object of an xmlplot NetCDFStore.
+
+Reads from chunked variables go through a cache of decompressed chunks; see
+the chunks module. Variables in classic NetCDF files are read from a memory
+mapping of the file instead; see the ncmmap module.
+
+A file that is still being written (e.g., by a running model) can be brought
+up to date with the records appended since it was opened (Dataset.refresh).
+The proxies of its variables then read from the current file; decompressed
+chunks are kept, except those that were incomplete.
+"""
+
+import threading
+
+import xmlplot.data.netcdf
+
+import numpy
+
+try:
+    from . import chunks,ncmmap,tracing
+except ImportError:
+    import chunks,ncmmap,tracing
+
+try:
+    from collections.abc import Mapping as DictMixin
+except ImportError:
+    from UserDict import DictMixin
+
+# Lock that must be held for any call into the NetCDF library.
+lock = threading.RLock()
+
+class ReopenError(Exception):
+    pass
+
+def locked(function):
+    """Returns a wrapper that holds the NetCDF lock while calling function."""
+    def wrapper(*args,**kwargs):
+        with lock:
+            return function(*args,**kwargs)
+    return wrapper
+
+class Variable(object):
+    """Proxy for a NetCDF variable object."""
+    def __init__(self,dataset,name,ncvar):
+        self.dataset = dataset
+        self.name = name
+        self.ncvar = ncvar
+        self.reader = None
+
+    def __array__(self,*args,**kwargs):
+        return numpy.asarray(self[(Ellipsis,)],*args,**kwargs)
+
+    def __getitem__(self,indices):
+        with tracing.span('read NetCDF variable',variable=self.name),lock:
+            if self.reader is None: self.reader = chunks.getReader(self.ncvar) or False
+            if self.reader:
+                data = self.reader.read(indices)
+                if data is not None: return data
+            return self.ncvar[indices]
+
+    def __getattr__(self,name):
+        with lock:
+            value = getattr(self.ncvar,name)
+        if callable(value): value = locked(value)
+        return value
+
+class Variables(DictMixin):
+    def __init__(self,dataset):
+        self.dataset = dataset
+        self.cache = {}
+
+    def __getitem__(self,name):
+        var = self.cache.get(name,None)
+        if var is None:
+            with lock:
+                ncvar = self.dataset.nc.variables[name]
+            var = self.dataset.wrapVariable(name,ncvar)
+            self.cache[name] = var
+        return var
+
+    def __contains__(self,name):
+        with lock:
+            return name in self.dataset.nc.variables
+
+    def keys(self):
+        with lock:
+            return list(self.dataset.nc.variables.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+class Dataset(object):
+    """Proxy for a NetCDF file object, serializing all access to it."""
+    def __init__(self,nc):
+        self.nc = nc
+        self.variables = Variables(self)
+        self.reopening = None
+        with lock:
+            self.mapped = ncmmap.mapFile(nc)
+
+    def wrapVariable(self,name,ncvar):
+        var = Variable(self,name,ncvar)
+        with lock:
+            var.reader = ncmmap.getReader(self.mapped,name,ncvar)
+        return var
+
+    def refresh(self):
+        """Brings the file up to date with records appended to it since it
+        was opened. Classic NetCDF files are synchronized with the file on
+        disk; NetCDF-4 files are reopened, as the HDF5 library does not pick
+        up changes made by other processes otherwise. Returns a dictionary
+        with the previous and current length of each dimension that has grown.
+
+        The HDF5 library shares a file between all handles to it in a process,
+        so a NetCDF-4 file must be closed before it can be reopened. If it then
+        cannot be opened (e.g., the writer holds a lock on it), ReopenError is
+        raised, and reopening is retried by the next call."""
+        with lock:
+            if self.reopening is None:
+                before = getDimensionLengths(self.nc)
+                shapes = dict([(name,tuple(var.ncvar.shape)) for name,var in self.variables.cache.items()])
+                if self.nc.data_model in ('NETCDF3_CLASSIC','NETCDF3_64BIT_OFFSET','NETCDF3_64BIT_DATA'):
+                    self.nc.sync()
+                else:
+                    for var in self.variables.cache.values():
+                        if var.reader: var.reader.closeDecoder()
+                    self.reopening = (self.nc.filepath(),before,shapes)
+                    self.nc.close()
+            if self.reopening is not None:
+                path,before,shapes = self.reopening
+                try:
+                    self.nc = xmlplot.data.netcdf.getNetCDFFile(path)
+                except Exception as e:
+                    raise ReopenError('Unable to reopen %s: %s' % (path,e))
+                self.reopening = None
+            after = getDimensionLengths(self.nc)
+            grown = dict([(dim,(before[dim],length)) for dim,length in after.items() if dim in before and length>before[dim]])
+
+            # The memory mapping covers the records present when it was made.
+            if grown and self.mapped is not None: self.mapped = ncmmap.mapFile(self.nc)
+            for name,var in list(self.variables.cache.items()):
+                var.ncvar = self.nc.variables[name]
+                if isinstance(var.reader,chunks.ChunkReader):
+                    var.reader.setVariable(var.ncvar,shapes[name])
+                elif var.reader is not False:
+                    var.reader = ncmmap.getReader(self.mapped,name,var.ncvar)
+        return grown
+
+    def __getattr__(self,name):
+        with lock:
+            value = getattr(self.nc,name)
+        if callable(value): value = locked(value)
+        return value
+
+    def close(self):
+        with lock:
+            self.nc.close()
+        self.mapped = None
+
+def getDimensionLengths(nc):
+    """Returns the length of each dimension of a NetCDF file object."""
+    lengths = {}
+    for dim,length in nc.dimensions.items():
+        if not (length is None or isinstance(length,int)): length = len(length)
+        lengths[dim] = length
+    return lengths
+
+def protect(store):
+    """Replaces the NetCDF file object(s) of an xmlplot data store by
+    proxies that serialize all access to the NetCDF library.
+    """
+    for child in getattr(store,'stores',()): protect(child)
+    nc = getattr(store,'nc',None)
+    if nc is not None and not isinstance(nc,Dataset):
+        store.nc = Dataset(nc)
+    return store
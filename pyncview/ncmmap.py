@@ -0,0 +1,198 @@
+"""Memory-mapped reads from classic NetCDF files.
+
+Classic and 64-bit offset NetCDF files store each fixed-size variable as a
+contiguous big-endian array, and the records of variables along the
+unlimited dimension at a fixed interval. Such files can therefore be mapped
+into memory, and slabs of their variables taken as NumPy views of the
+mapping, without reading them through the NetCDF library into new arrays.
+The data are then read from the file by the operating system when they are
+first used, and the pages read are shared by all processes that map the file
+(e.g., several PyNcView windows).
+
+The views keep the byte order of the file (big-endian): NumPy converts
+values as it processes them. Missing values and scale/offset are likewise
+not applied to the view, but by xmlplot as it processes the data, as for
+data read through the NetCDF library (which xmlplot reads without automatic
+masking and scaling). Reads with automatic masking or scaling enabled, and
+reads with indices other than integers and slices, are passed on to the
+NetCDF library. Views are read-only; where xmlplot would scale the data in
+place, a copy is returned instead.
+
+The header of the file is parsed here (the NetCDF library does not expose
+the location of the variables); files that cannot be parsed, or do not match
+the description of the NetCDF library, are read as before.
+"""
+
+import os,mmap,struct,numbers
+
+import numpy
+
+# Whether classic NetCDF files opened from now on are memory-mapped.
+enabled = True
+
+# Data types by NetCDF type code (characters, code 2, are not supported).
+types = {1:'>i1',3:'>i2',4:'>i4',5:'>f4',6:'>f8'}
+typesizes = {1:1,2:1,3:2,4:4,5:4,6:8}
+
+NC_DIMENSION,NC_VARIABLE,NC_ATTRIBUTE = 10,11,12
+STREAMING = 0xFFFFFFFF
+
+class HeaderError(Exception):
+    pass
+
+class Header(object):
+    """Parser for the header of a classic or 64-bit offset NetCDF file."""
+    def __init__(self,buffer):
+        self.buffer = buffer
+        self.pos = 0
+        magic = self.read(4)
+        if magic not in (b'CDF\x01',b'CDF\x02'): raise HeaderError('Not a classic or 64-bit offset NetCDF file.')
+        self.offsetformat = '>i' if magic==b'CDF\x01' else '>q'
+        self.numrecs = self.readInt(unsigned=True)
+
+        self.dimensions = []
+        for i in range(self.readListLength(NC_DIMENSION)):
+            self.dimensions.append((self.readName(),self.readInt()))
+
+        self.skipAttributes()
+
+        # Variables: name, NetCDF type, dimension indices, offset of the data.
+        self.variables = []
+        for i in range(self.readListLength(NC_VARIABLE)):
+            name = self.readName()
+            dimids = [self.readInt() for j in range(self.readInt())]
+            self.skipAttributes()
+            nctype = self.readInt()
+            self.readInt()
+            begin = self.unpack(self.offsetformat,struct.calcsize(self.offsetformat))
+            self.variables.append((name,nctype,dimids,begin))
+
+    def read(self,n):
+        if self.pos+n>len(self.buffer): raise HeaderError('Unexpected end of header.')
+        data = self.buffer[self.pos:self.pos+n]
+        self.pos += n
+        return data
+
+    def unpack(self,format,n):
+        return struct.unpack(format,self.read(n))[0]
+
+    def readInt(self,unsigned=False):
+        return self.unpack('>I' if unsigned else '>i',4)
+
+    def readName(self):
+        n = self.readInt()
+        name = self.read(n)
+        self.read(-n%4)
+        return name.decode('utf-8')
+
+    def readListLength(self,tag):
+        curtag,n = self.readInt(),self.readInt()
+        if curtag not in (0,tag) or n<0: raise HeaderError('Invalid header.')
+        return n
+
+    def skipAttributes(self):
+        for i in range(self.readListLength(NC_ATTRIBUTE)):
+            self.readName()
+            nctype,n = self.readInt(),self.readInt()
+            if nctype not in typesizes: raise HeaderError('Invalid attribute type %i.' % nctype)
+            size = n*typesizes[nctype]
+            self.read(size+(-size%4))
+
+class MappedFile(object):
+    """A classic NetCDF file mapped into memory, with views of its variables."""
+    def __init__(self,path):
+        with open(path,'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        header = Header(self.mmap)
+
+        # Records contain the data of all record variables; each is padded
+        # to a multiple of 4 bytes, unless there is only one record variable.
+        def getLayout(nctype,dimids):
+            shape = [header.dimensions[i][1] for i in dimids]
+            isrecord = len(shape)>0 and shape[0]==0
+            size = typesizes[nctype]*int(numpy.prod(shape[1:] if isrecord else shape))
+            return shape,isrecord,size
+        recordvars = [name for name,nctype,dimids,begin in header.variables if getLayout(nctype,dimids)[1]]
+        recsize = 0
+        for name,nctype,dimids,begin in header.variables:
+            shape,isrecord,size = getLayout(nctype,dimids)
+            if isrecord: recsize += size if len(recordvars)==1 else size+(-size%4)
+
+        numrecs = header.numrecs
+        if numrecs==STREAMING:
+            begins = [begin for name,nctype,dimids,begin in header.variables if name in recordvars]
+            numrecs = (len(self.mmap)-min(begins))//recsize if begins and recsize else 0
+        self.numrecs = numrecs
+
+        self.arrays = {}
+        for name,nctype,dimids,begin in header.variables:
+            if nctype not in types or not dimids: continue
+            shape,isrecord,size = getLayout(nctype,dimids)
+            dtype = numpy.dtype(types[nctype])
+            strides = [dtype.itemsize*int(numpy.prod(shape[i+1:])) for i in range(len(shape))]
+            if isrecord:
+                shape[0],strides[0] = numrecs,recsize
+                end = begin+(numrecs-1)*recsize+size if numrecs>0 else begin
+            else:
+                end = begin+size
+            if end>len(self.mmap): continue
+            self.arrays[name] = numpy.ndarray(shape,dtype=dtype,buffer=self.mmap,offset=begin,strides=strides)
+
+def mapFile(nc):
+    """Returns a MappedFile for a NetCDF file object, or None if it is not a
+    local classic NetCDF file (or memory-mapping is disabled)."""
+    if not enabled or getattr(nc,'data_model',None) not in ('NETCDF3_CLASSIC','NETCDF3_64BIT_OFFSET'): return None
+    try:
+        path = nc.filepath()
+    except Exception:
+        return None
+    if not os.path.isfile(path): return None
+    try:
+        return MappedFile(path)
+    except (HeaderError,IOError,OSError,ValueError) as e:
+        print('Unable to memory-map %s: %s' % (path,e))
+        return None
+
+def getRecordCount(path):
+    """Returns the number of records in a classic NetCDF file according to
+    its header, or None if this is not available (e.g., the file is not a
+    classic NetCDF file). Only the first bytes of the file are read."""
+    try:
+        with open(path,'rb') as f:
+            start = f.read(8)
+    except (IOError,OSError):
+        return None
+    if len(start)<8 or start[:4] not in (b'CDF\x01',b'CDF\x02'): return None
+    numrecs = struct.unpack('>I',start[4:])[0]
+    return None if numrecs==STREAMING else numrecs
+
+def getReader(mapped,name,ncvar):
+    """Returns a MappedReader for a NetCDF variable in a MappedFile, or None
+    if its data cannot be read from the mapping."""
+    if mapped is None: return None
+    array = mapped.arrays.get(name,None)
+    if array is None or array.shape!=tuple(ncvar.shape): return None
+    return MappedReader(array,ncvar)
+
+class MappedReader(object):
+    """Reads from a NetCDF variable by taking views of its memory-mapped data."""
+    def __init__(self,array,ncvar):
+        self.array = array
+        self.ncvar = ncvar
+
+        # Data that xmlplot would scale in place cannot be returned as a (read-only) view.
+        self.copy = array.dtype.isnative and (hasattr(ncvar,'scale_factor') or hasattr(ncvar,'add_offset'))
+
+    def read(self,indices):
+        """Returns the data of the variable at the specified indices, or None
+        if the read should be passed on to the NetCDF variable."""
+        if getattr(self.ncvar,'mask',False) or getattr(self.ncvar,'scale',False): return None
+        if not isinstance(indices,tuple): indices = (indices,)
+        for index in indices:
+            if not (index is Ellipsis or isinstance(index,slice) or (isinstance(index,numbers.Integral) and not isinstance(index,bool))): return None
+        try:
+            data = self.array[indices]
+        except IndexError:
+            return None
+        if self.copy and isinstance(data,numpy.ndarray): data = data.copy()
+        return data
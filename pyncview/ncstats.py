@@ -0,0 +1,155 @@
+"""Persistent statistics of NetCDF variables.
+
+Statistics (minimum, maximum, sum and counts of valid, masked and NaN values)
+are computed per block of records along the first dimension of a variable,
+and stored in a sidecar file per NetCDF file. Entries are keyed by the
+absolute path of the NetCDF file, its size and its modification time. If a
+file has grown along its unlimited dimension, only the statistics of records
+not seen before are computed.
+"""
+
+import os,json,hashlib,threading
+
+import numpy
+
+try:
+    from . import ncio
+except ImportError:
+    import ncio
+
+class Statistics(object):
+    """Statistics of a NetCDF variable, combined over all blocks of records."""
+    def __init__(self,blocks):
+        self.minimum,self.maximum = None,None
+        self.sum,self.count,self.masked,self.nan = 0.,0,0,0
+        for start,stop,minimum,maximum,total,count,masked,nan in blocks:
+            if minimum is not None and (self.minimum is None or self.minimum>minimum): self.minimum = minimum
+            if maximum is not None and (self.maximum is None or self.maximum<maximum): self.maximum = maximum
+            self.sum += total
+            self.count += count
+            self.masked += masked
+            self.nan += nan
+
+    def getMean(self):
+        if self.count==0: return None
+        return self.sum/self.count
+
+def getNcVariable(var):
+    """Returns the path of the NetCDF file and name of the NetCDF variable
+    that a variable reads from directly, or (None,None) if the variable is
+    not taken from a single NetCDF file (e.g., an expression)."""
+    ncvarname = getattr(var,'ncvarname',None)
+    if ncvarname is None or not hasattr(var.store,'getcdf'): return None,None
+    try:
+        datafile = var.store.getcdf().filepath()
+    except Exception:
+        # Not a netCDF4 Dataset, e.g., multiple files combined.
+        return None,None
+    if not os.path.isfile(datafile): return None,None
+    return os.path.abspath(datafile),ncvarname
+
+class StatisticsCache(object):
+    """Statistics of NetCDF variables, persisted in the specified directory."""
+    def __init__(self,directory,maxblocksize=64*1024*1024):
+        self.directory = directory
+        self.maxblocksize = maxblocksize
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def getSidecarPath(self,path):
+        return os.path.join(self.directory,'%s.json' % hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+    def getFileEntry(self,path):
+        """Returns the cached statistics for all variables of a NetCDF file."""
+        entry = self.files.get(path,None)
+        if entry is None:
+            try:
+                with open(self.getSidecarPath(path)) as f:
+                    entry = json.load(f)
+            except (IOError,OSError,ValueError):
+                entry = None
+            if entry is None or entry.get('path')!=path: entry = {'path':path,'variables':{}}
+            self.files[path] = entry
+        return entry
+
+    def save(self,path):
+        entry = self.files.get(path,None)
+        if entry is None: return
+        try:
+            if not os.path.isdir(self.directory): os.makedirs(self.directory)
+            sidecarpath = self.getSidecarPath(path)
+            with open(sidecarpath+'.tmp','w') as f:
+                json.dump(entry,f)
+            os.replace(sidecarpath+'.tmp',sidecarpath)
+        except (IOError,OSError) as e:
+            print('Unable to save statistics for %s: %s' % (path,e))
+
+    def getStatistics(self,var,compute=True,progress=None):
+        """Returns the statistics of a variable, or None if these are not
+        available (compute is False and they are not cached, or the variable
+        is not read directly from a NetCDF file). Statistics depend on the
+        masking of values outside the valid range, as set on the data store.
+        """
+        path,ncvarname = getNcVariable(var)
+        if path is None: return None
+        key = '%s:%i' % (ncvarname,int(bool(var.store.maskoutsiderange)))
+        with self.lock:
+            stat = os.stat(path)
+            entry = self.getFileEntry(path)
+            shape = list(var.getShape())
+            cached = entry['variables'].get(key,None)
+            if cached is not None and (cached['size'],cached['mtime'])!=(stat.st_size,stat.st_mtime):
+                # The file has changed. If the variable grew along its first (unlimited) dimension,
+                # keep the statistics of complete blocks of records; otherwise (e.g., the file was
+                # rewritten with the same shape) start afresh.
+                if shape and cached['shape'][1:]==shape[1:] and cached['shape'][0]<shape[0] and self.isUnlimited(var):
+                    cached['blocks'] = [b for b in cached['blocks'] if b[1]-b[0]==cached['blocklength']]
+                else:
+                    cached = None
+            if cached is None:
+                cached = {'blocklength':self.getBlockLength(shape),'blocks':[]}
+            cached['shape'],cached['size'],cached['mtime'] = shape,stat.st_size,stat.st_mtime
+            length = shape[0] if shape else 1
+            done = cached['blocks'][-1][1] if cached['blocks'] else 0
+            if done<length:
+                if not compute: return None
+                blocklength = cached['blocklength']
+                for start in range(done,length,blocklength):
+                    stop = min(start+blocklength,length)
+                    cached['blocks'].append(self.getBlockStatistics(var,shape,start,stop))
+                    if progress is not None: progress(float(stop-done)/(length-done))
+                entry['variables'][key] = cached
+                self.save(path)
+            return Statistics(cached['blocks'])
+
+    def isUnlimited(self,var):
+        dims = var.getDimensions_raw()
+        if not dims: return False
+        with ncio.lock:
+            return var.store.getcdf().dimensions[dims[0]].isunlimited()
+
+    def getBlockLength(self,shape):
+        """Returns the number of records along the first dimension processed at
+        once, such that a block stays below the maximum size in memory."""
+        recordsize = 8
+        for l in shape[1:]: recordsize *= l
+        return max(1,self.maxblocksize//recordsize)
+
+    def getBlockStatistics(self,var,shape,start,stop):
+        if shape:
+            bounds = tuple([slice(start,stop)]+[slice(None)]*(len(shape)-1))
+        else:
+            bounds = ()
+        # Coordinates are read too, as their mask is transferred to the data.
+        data = var.getSlice(bounds)
+        while isinstance(data,(list,tuple)): data = data[0]
+        data = numpy.ma.asarray(data.data)
+        masked = int(numpy.ma.count_masked(data))
+        values = data.compressed()
+        nan = 0
+        if values.dtype.kind in 'fc':
+            isnan = numpy.isnan(values)
+            nan = int(isnan.sum())
+            if nan: values = values[~isnan]
+        if values.size==0: return [start,stop,None,None,0.,0,masked,nan]
+        return [start,stop,values.min().item(),values.max().item(),float(values.sum(dtype=numpy.float64)),int(values.size),masked,nan]
@@ -0,0 +1,231 @@
+"""Overviews of large two-dimensional grids.
+
+A grid with many more cells than the figure has pixels costs time and memory
+to read and draw, but does not show more detail. Such a grid is therefore
+read at a stride: every n-th cell along each dimension, with n the largest
+power of two for which the overview still has at least as many cells as the
+figure has pixels along that axis. Of each block of n cells, the middle one
+is taken, so that the overview covers the same area as the full grid. If the
+range of an axis is fixed (e.g., after zooming in), only the cells within
+that range are read, at a stride based on the size of that region; zooming
+in thus reveals the grid at full resolution.
+
+Overviews are strided rather than block-averaged: a strided read transfers
+only the cells that are shown (NetCDF libraries support this directly), and
+keeps the values and masks of individual cells intact (e.g., categorical or
+partially masked fields are not smeared).
+
+For compressed variables, a strided read still decompresses every chunk it
+touches. Overviews of the full extent of NetCDF variables can therefore be
+kept in a directory between sessions (OverviewCache), one file per overview.
+Entries are keyed by the absolute path of the NetCDF file, its size and its
+modification time, so that overviews of a file that has changed are no
+longer used. As overviews for different panel
+sizes use the same power-of-two strides, they form a pyramid that is shared
+between window sizes. When the total size of the directory exceeds its
+limit, the least recently used overviews are removed.
+"""
+
+import os,hashlib,threading
+
+import numpy
+
+import xmlplot.common,xmlplot.expressions
+
+try:
+    from . import ncstats
+except ImportError:
+    import ncstats
+
+def getStride(length,pixels):
+    """Returns the stride for reading a dimension of the specified length,
+    such that at least the specified number of cells is read: the largest
+    power of two that does not exceed length/pixels."""
+    stride = 1
+    while pixels>0 and length//(2*stride)>=pixels: stride *= 2
+    return stride
+
+def getOverviewSlice(start,stop,pixels):
+    """Returns the slice that reads the cells from start to stop (exclusive)
+    at the stride for the specified number of pixels, taking the middle cell
+    of each block of cells."""
+    stride = getStride(stop-start,pixels)
+    if stride==1: return slice(start,stop,1)
+    count = (stop-start)//stride
+    first = start+(stop-start-count*stride)//2+(stride-1)//2
+    return slice(first,first+(count-1)*stride+1,stride)
+
+def getIndexRange(coords,start,stop):
+    """Returns the first and last+1 index of the coordinates within the range
+    from start to stop, extended by one cell on either side (the cells that
+    straddle the edges of the range)."""
+    if start>stop: start,stop = stop,start
+    inside = numpy.flatnonzero((coords>=start)&(coords<=stop))
+    if len(inside)==0:
+        # The range lies within a single cell: take the cell nearest to its center.
+        inside = numpy.array([numpy.abs(coords-0.5*(start+stop)).argmin()])
+    return max(int(inside[0])-1,0),min(int(inside[-1])+2,len(coords))
+
+def getCoordinates(var,dim,length):
+    """Returns the one-dimensional coordinates of the specified dimension of
+    a variable or expression, or None if these are not available (e.g., on
+    a curvilinear grid, where coordinates depend on multiple dimensions)."""
+    if isinstance(var,xmlplot.expressions.VariableExpression):
+        sources = var.variables
+    else:
+        sources = [var]
+    for source in sources:
+        if not hasattr(source,'getCoordinateVariables'): continue
+        dims = list(source.getDimensions())
+        if dim not in dims: continue
+        coordvar = source.getCoordinateVariables()[dims.index(dim)]
+        if coordvar is None:
+            # No coordinate variable: the figure uses indices.
+            coords = numpy.arange(length,dtype=float)
+        elif tuple(coordvar.getDimensions())!=(dim,):
+            return None
+        else:
+            # Coordinates are read as by the variable itself, e.g., with time converted to dates.
+            coords = numpy.ma.getdata(coordvar.getSlice((slice(None),),dataonly=True,cache=True))
+        if coords.shape!=(length,): return None
+        return coords
+    return None
+
+def getSource(var):
+    """Returns the NetCDF variable that a variable or expression reads from
+    directly, and the indices it takes from that variable, or (None,None) if
+    the data come from elsewhere (e.g., an expression that combines
+    variables)."""
+    if isinstance(var,xmlplot.expressions.VariableExpression):
+        if len(var.root)!=1: return None,None
+        node,indices = var.root[0],None
+        if isinstance(node,xmlplot.expressions.LazySlice): node,indices = node.args[0],node.slice
+        if not isinstance(node,xmlplot.expressions.LazyVariable): return None,None
+        var = node.args[0]
+    else:
+        indices = None
+    shape = var.getShape()
+    if shape is None: return None,None
+    if indices is None: indices = (Ellipsis,)
+    indices = xmlplot.common.processEllipsis(indices,len(shape))
+    for index in indices:
+        if not (isinstance(index,int) or index==slice(None)): return None,None
+    return var,indices
+
+def reduceBroadcast(values):
+    """Returns an array with length 1 along each axis over which the specified
+    array is constant (e.g., coordinates that were broadcast to the shape of
+    the data), from which the array can be restored with numpy.broadcast_to."""
+    values = numpy.asarray(values)
+    for axis in range(values.ndim):
+        first = values.take([0],axis=axis)
+        if values.shape[axis]>1 and numpy.array_equal(values,numpy.broadcast_to(first,values.shape)): values = first
+    return values
+
+class OverviewCache(object):
+    """Overviews of NetCDF variables, persisted in the specified directory
+    up to the specified total size in bytes."""
+    def __init__(self,directory,maxsize=1024*1024*1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.size = None
+        self.lock = threading.Lock()
+
+    def getKey(self,var,bounds):
+        """Returns the key of an overview of a variable, given the bounds the
+        overview is read with, or None if it cannot be persisted."""
+        source,indices = getSource(var)
+        if source is None: return None
+        path,ncvarname = ncstats.getNcVariable(source)
+        if path is None: return None
+
+        # Combine the indices taken by the expression with the bounds of the overview.
+        bounds = list(bounds)
+        combined = []
+        for index in indices:
+            if isinstance(index,int):
+                combined.append(str(index))
+            else:
+                bound = bounds.pop(0)
+                if not isinstance(bound,slice): return None
+                combined.append('%s:%s:%s' % (bound.start,bound.stop,bound.step))
+        # Coordinates depend on their assignment to dimensions, which the user can change.
+        coordinates = ','.join(['%s=%s' % item for item in sorted(source.store.defaultcoordinates.items())])
+        stat = os.stat(path)
+        return '%s|%s|%i|%s|%s|%i|%r' % (path,ncvarname,int(bool(source.store.maskoutsiderange)),coordinates,','.join(combined),stat.st_size,stat.st_mtime)
+
+    def getPath(self,key):
+        return os.path.join(self.directory,'%s.npz' % hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self,var,bounds):
+        """Returns the cached overview of a variable read with the specified
+        bounds, or None if it is not available."""
+        key = self.getKey(var,bounds)
+        if key is None: return None
+        path = self.getPath(key)
+        try:
+            with numpy.load(path,allow_pickle=False) as f:
+                if str(f['key'])!=key: return None
+                ndim = len(f['dimensions'])
+                varslice = xmlplot.common.Variable.Slice([str(d) for d in f['dimensions']])
+                varslice.data = f['data']
+                shape = varslice.data.shape
+                varslice.coords = [numpy.array(numpy.broadcast_to(f['coords%i' % i],shape)) for i in range(ndim)]
+                varslice.coords_stag = [numpy.array(numpy.broadcast_to(f['coords_stag%i' % i],[l+1 for l in shape])) for i in range(ndim)]
+                if 'mask' in f.files: varslice.data = numpy.ma.masked_array(varslice.data,mask=f['mask'])
+        except (IOError,OSError,KeyError,ValueError):
+            return None
+
+        # Mark the overview as recently used.
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+        return varslice
+
+    def put(self,var,bounds,varslice):
+        """Stores an overview of a variable read with the specified bounds."""
+        if isinstance(varslice,(list,tuple)) and len(varslice)==1: varslice = varslice[0]
+        if not isinstance(varslice,xmlplot.common.Variable.Slice) or not varslice.isValid(): return
+        key = self.getKey(var,bounds)
+        if key is None: return
+        arrays = {'key':numpy.array(key),'dimensions':numpy.array(varslice.dimensions),'data':numpy.ma.getdata(varslice.data)}
+        if numpy.ma.isMaskedArray(varslice.data): arrays['mask'] = numpy.ma.getmaskarray(varslice.data)
+        for i,(coords,coords_stag) in enumerate(zip(varslice.coords,varslice.coords_stag)):
+            if numpy.shape(coords)!=varslice.data.shape or numpy.shape(coords_stag)!=tuple([l+1 for l in varslice.data.shape]): return
+            arrays['coords%i' % i],arrays['coords_stag%i' % i] = reduceBroadcast(coords),reduceBroadcast(coords_stag)
+        path = self.getPath(key)
+        with self.lock:
+            try:
+                if not os.path.isdir(self.directory): os.makedirs(self.directory)
+                with open(path+'.tmp','wb') as f:
+                    numpy.savez(f,**arrays)
+                os.replace(path+'.tmp',path)
+                if self.size is not None: self.size += os.path.getsize(path)
+            except (IOError,OSError) as e:
+                print('Unable to save overview: %s' % e)
+                return
+            self.prune()
+
+    def prune(self):
+        """Removes the least recently used overviews until the total size of
+        the directory is within its limit."""
+        if self.size is not None and self.size<=self.maxsize: return
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'): continue
+            path = os.path.join(self.directory,name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime,stat.st_size,path))
+        entries.sort()
+        self.size = sum([size for mtime,size,path in entries])
+        while entries and self.size>self.maxsize:
+            mtime,size,path = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
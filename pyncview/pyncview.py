@@ -7,7 +7,7 @@
 from __future__ import print_function
 
 # Import standard (i.e., non GOTM-GUI) modules.
-import sys,os,os.path,argparse,math,re,xml.dom.minidom,warnings
+import sys,os,os.path,math,re,xml.dom.minidom,warnings,copy,threading,zlib,time
 
 # Ignore DeprecationWarnings, which are interesting for developers only.
 warnings.simplefilter('ignore', DeprecationWarning)
@@ -20,7 +20,7 @@ if not hasattr(sys,'frozen'):
     # Auto-discover xmlstore and xmlplot in bbpy directory structure
     rootdir = os.path.dirname(os.path.realpath(__file__))
     path = sys.path[:]
-    if os.path.isdir(os.path.join(rootdir, '../../xmlstore/xmlstore')):
+    if os.path.isdir(os.path.join(rootdir, '../../xmlstore/xmlstore')) and 'xmlstore' not in sys.modules:
         print('Detected that we are running from BBpy source. Using local xmlstore/xmlplot.')
         sys.path.insert(0, os.path.join(rootdir, '../../xmlstore'))
         sys.path.insert(0, os.path.join(rootdir, '../../xmlplot'))
@@ -42,63 +42,24 @@ import matplotlib
 matplotlib.use('agg')
 
 # Override basemap data directory if running from binary distribution.
+# Basemap takes it from the environment when first imported (for a map projection).
 if hasattr(sys,'frozen'):
-    import mpl_toolkits.basemap
-    mpl_toolkits.basemap.basemap_datadir = os.path.join(rootdir,'basemap-data')
+    os.environ.setdefault('BASEMAPDATA',os.path.join(rootdir,'basemap-data'))
 
 # Import remaining GOTM-GUI modules
 try:
-    import xmlplot.data,xmlplot.plot,xmlplot.gui_qt4,xmlplot.expressions,xmlstore.gui_qt4,xmlplot.errortrap
+    import xmlplot.data,xmlplot.plot,xmlplot.gui_qt4,xmlplot.expressions,xmlstore.gui_qt4
 except ImportError as e:
     print('Unable to import xmlplot (https://pypi.python.org/pypi/xmlplot) Try "pip install xmlplot". Error: %s' % e)
     sys.exit(1)
-   
-def printVersion():
-    for n,v in xmlplot.common.getVersions():
-        print('%s: %s' % (n,v))
-    sys.exit(0)
-
-def get_argv():
-    """Uses shell32.GetCommandLineArgvW to get sys.argv as a list of Unicode
-    strings.
-
-    Versions 2.x of Python don't support Unicode in sys.argv on
-    Windows, with the underlying Windows API instead replacing multi-byte
-    characters with '?'.
-    
-    Taken from http://code.activestate.com/recipes/572200/
-    """
-    if sys.platform=='win32':
-        try:
-            from ctypes import POINTER, byref, cdll, c_int, windll
-            from ctypes.wintypes import LPCWSTR, LPWSTR
-
-            GetCommandLineW = cdll.kernel32.GetCommandLineW
-            GetCommandLineW.argtypes = []
-            GetCommandLineW.restype = LPCWSTR
-
-            CommandLineToArgvW = windll.shell32.CommandLineToArgvW
-            CommandLineToArgvW.argtypes = [LPCWSTR, POINTER(c_int)]
-            CommandLineToArgvW.restype = POINTER(LPWSTR)
-
-            cmd = GetCommandLineW()
-            argc = c_int(0)
-            argv = CommandLineToArgvW(cmd, byref(argc))
-            if argc.value > 0:
-                # Remove Python executable and commands if present
-                start = argc.value - len(sys.argv)
-                return [argv[i] for i in range(start, argc.value)]
-        except:
-            pass
-    args = []
-    for arg in sys.argv:
-        try:
-            arg = arg.decode(sys.getfilesystemencoding())
-        except:
-            pass
-        args.append(arg)
-    return args
 
+# Import PyNcView modules (relative import fails if we are run as a script)
+# Modules needed by specific features only (export, video, aggregation, headers, instance, startup) are imported on first use.
+try:
+    from . import ncio,chunks,ncmmap,cache,ncstats,artists,slabs,fusion,decimation,overviews,follow,tracing
+except ImportError:
+    import ncio,chunks,ncmmap,cache,ncstats,artists,slabs,fusion,decimation,overviews,follow,tracing
+   
 # -------------------------------------------------------------------
 # Actual code.
 # -------------------------------------------------------------------
@@ -125,11 +86,39 @@ class SettingsStore(xmlstore.xmlstore.TypedStore):
 	    <element name="Height" type="int"/>
 	</element>
 	<element name="MaskValuesOutsideRange" type="bool"/>
+	<element name="Prefetch">
+		<element name="Depth"       type="int"/>
+		<element name="MemoryLimit" type="int"/>
+	</element>
+	<element name="FrameCache">
+		<element name="MemoryLimit" type="int"/>
+	</element>
+	<element name="ChunkCache">
+		<element name="MemoryLimit" type="int"/>
+		<element name="Threads"     type="int"/>
+	</element>
+	<element name="FuseExpressions" type="bool"/>
+	<element name="PersistOverviews" type="bool"/>
+	<element name="MemoryMapClassic" type="bool"/>
 </element>
 """
     defaultvalues = """<?xml version="1.0"?>
 <Settings>
     <MaskValuesOutsideRange>True</MaskValuesOutsideRange>
+    <Prefetch>
+        <Depth>10</Depth>
+        <MemoryLimit>256</MemoryLimit>
+    </Prefetch>
+    <FrameCache>
+        <MemoryLimit>256</MemoryLimit>
+    </FrameCache>
+    <ChunkCache>
+        <MemoryLimit>256</MemoryLimit>
+        <Threads>0</Threads>
+    </ChunkCache>
+    <FuseExpressions>True</FuseExpressions>
+    <PersistOverviews>False</PersistOverviews>
+    <MemoryMapClassic>True</MemoryMapClassic>
 </Settings>
         """
 
@@ -162,6 +151,15 @@ class SettingsStore(xmlstore.xmlstore.TypedStore):
         else:
             return os.path.expanduser('~/.pyncview')
 
+    @staticmethod
+    def getCacheDirectory():
+        """Returns the directory for data that PyNcView keeps between sessions
+        to speed up operations, e.g., statistics of variables."""
+        if sys.platform == 'win32':
+            return os.path.join(os.path.dirname(SettingsStore.getSettingsPath()), 'Cache')
+        else:
+            return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'pyncview')
+
     def save(self):
         if not self.changed: return
         settingspath = self.getSettingsPath()
@@ -371,6 +369,10 @@ class AnimateToolBar(QtWidgets.QToolBar):
             self.actPlayPause.setIcon(xmlplot.gui_qt4.getIcon('player_pause.png'))
             self.actPlayPause.setText('Pause')
 
+    def onRangeChanged(self):
+        self.spinStride.setRange(1,max(1,self.spin.maximum()-self.spin.minimum()))
+        self.onSpinChanged()
+
     def onSpinChanged(self,value=None):
         if value is None: value = self.spin.value()
         self.actBegin.setEnabled(value>self.spin.minimum())
@@ -436,6 +438,59 @@ class AnimationController(QtWidgets.QWidget):
         QtWidgets.QWidget.closeEvent(self,event)
         self.callback(None)
            
+class DynamicTitles(object):
+    """Titles for the frames of an animation, showing the coordinate of the
+    animated dimension. The coordinate variable is read and decoded once;
+    each title is formatted on first use and remembered after that.
+    """
+    def __init__(self,var,dim):
+        if isinstance(var,xmlplot.expressions.VariableExpression):
+            self.store = var.variables[0].store
+        else:
+            self.store = var.store
+        self.dimension = dim
+        self.isdatetime = var.getDimensionInfo(dim).get('datatype','float')=='datetime'
+        self.titles = {}
+        self.format = None
+        self.coorddims,self.values = None,None
+        self.update()
+
+    def update(self):
+        """Takes the values of the coordinate variable. These are taken from
+        the coordinates cached by the store, which are extended rather than
+        read again when the file grows."""
+        coordvariable = self.store.getVariable(self.dimension)
+        if coordvariable is not None:
+            self.coorddims = list(coordvariable.getDimensions())
+            assert self.dimension in self.coorddims, 'Coordinate variable %s does not use its own dimension (dimensions: %s).' % (self.dimension,', '.join(self.coorddims))
+            self.values = coordvariable.getSlice([slice(None)]*len(self.coorddims),dataonly=True,cache=True)
+
+    def isValid(self,var,dim,slcs):
+        """Returns whether the titles apply to the specified variable and slices. They do
+        not if the coordinate variable has grown beyond the values read before."""
+        if isinstance(var,xmlplot.expressions.VariableExpression): var = var.variables[0]
+        if var.store is not self.store or dim!=self.dimension: return False
+        if self.values is None: return True
+        return all(slcs[cd]<l for cd,l in zip(self.coorddims,numpy.shape(self.values)) if cd in slcs)
+
+    def getTitle(self,slcs,fmt):
+        if self.values is None: return None
+        if fmt!=self.format: self.titles,self.format = {},fmt
+        key = tuple([slcs.get(cd) for cd in self.coorddims])
+        title = self.titles.get(key)
+        if title is None:
+            coordslice = tuple([slice(None) if i is None else i for i in key])
+            meanval = self.values[coordslice].mean()
+
+            # Convert the coordinate value to a string
+            if self.isdatetime:
+                title = xmlplot.common.num2date(meanval).strftime(fmt)
+            else:
+                if numpy.ma.getmask(meanval): meanval = numpy.nan
+                title = fmt % meanval
+            self.titles[key] = title
+        return title
+
 class SliceWidget(QtWidgets.QWidget):
 
     setAxesBounds = QtCore.Signal(object)
@@ -610,6 +665,22 @@ class SliceWidget(QtWidgets.QWidget):
     def onSpinChanged(self,value):
         self.sliceChanged.emit(False)
 
+    def setLength(self,dim,length,jump=False):
+        """Sets the new length of a dimension that has grown (e.g., as records
+        are appended to a file that is followed). The current slice is kept,
+        unless jump is set: the slice then moves to the last index."""
+        for i,(curdim,checkbox,spin,bnAnimate) in enumerate(self.dimcontrols):
+            if curdim!=dim: continue
+            spin.setMaximum(length-1)
+            if bnAnimate is None and length>1:
+                bnAnimate = QtWidgets.QPushButton(xmlplot.gui_qt4.getIcon('agt_multimedia.png'),None,self)
+                self.layout().addWidget(bnAnimate,i+1,2)
+                bnAnimate.clicked.connect(self.onAnimate)
+                bnAnimate.setVisible(checkbox.isChecked())
+                self.dimcontrols[i] = (curdim,checkbox,spin,bnAnimate)
+            if self.windowAnimate is not None and self.windowAnimate.dimension==dim: self.windowAnimate.toolbar.onRangeChanged()
+            if jump and checkbox.isChecked(): spin.setValue(length-1)
+
     def getSlices(self):
         slics = {}
         for (dim,checkbox,spin,bnAnimate) in self.dimcontrols:
@@ -618,7 +689,7 @@ class SliceWidget(QtWidgets.QWidget):
         return slics
 
 class NcPropertiesDialog(QtWidgets.QDialog):
-    def __init__(self,item,parent,flags=QtCore.Qt.WindowType.Dialog):
+    def __init__(self,item,parent,flags=QtCore.Qt.WindowType.Dialog,statistics=None):
         QtWidgets.QDialog.__init__(self,parent,flags)
         layout = QtWidgets.QVBoxLayout()
 
@@ -704,6 +775,37 @@ class NcPropertiesDialog(QtWidgets.QDialog):
                 lab = QtWidgets.QLabel('This file has no global attributes.',self)
             layout.addWidget(lab)
 
+        # Show statistics if known from before; otherwise offer to compute them.
+        if statistics is not None and ncstats.getNcVariable(item)[0] is not None:
+            layout.addSpacing(10)
+            lab = QtWidgets.QLabel('Statistics:',self)
+            layout.addWidget(lab)
+            def showStatistics(stats):
+                mean = stats.getMean()
+                rows = [('minimum',u''.__class__(stats.minimum)),
+                        ('maximum',u''.__class__(stats.maximum)),
+                        ('mean',u''.__class__(mean) if mean is not None else ''),
+                        ('valid values',str(stats.count)),
+                        ('masked values',str(stats.masked))]
+                if stats.nan: rows.append(('NaN values',str(stats.nan)))
+                self.listStatistics = createList(self,rows,('name','value'))
+                layout.insertWidget(layout.indexOf(lab)+1,self.listStatistics)
+            def onComputeStatistics():
+                QtWidgets.QApplication.setOverrideCursor(QtGui.QCursor(QtCore.Qt.CursorShape.WaitCursor))
+                try:
+                    stats = statistics.getStatistics(item)
+                finally:
+                    QtWidgets.QApplication.restoreOverrideCursor()
+                self.bnStatistics.hide()
+                showStatistics(stats)
+            stats = statistics.getStatistics(item,compute=False)
+            if stats is None:
+                self.bnStatistics = QtWidgets.QPushButton('Compute statistics',self)
+                self.bnStatistics.clicked.connect(onComputeStatistics)
+                layout.addWidget(self.bnStatistics)
+            else:
+                showStatistics(stats)
+
         # Add buttons
         bnLayout = QtWidgets.QHBoxLayout()
         bnOk = QtWidgets.QPushButton('OK',self)
@@ -812,25 +914,240 @@ class ReassignDialog(QtWidgets.QDialog):
         self.store.defaultcoordinates = {}
         self.selectComboValues()
 
-class NcTreeWidget(QtWidgets.QTreeWidget):
+class WorkspaceModel(QtCore.QAbstractItemModel):
+    """Item model behind the workspace explorer.
+
+    The model contains a root node per open file, with below it a node for each
+    combination of dimensions, and a root node for custom expressions. Nodes for
+    the variables below a combination of dimensions are only created when that
+    node is expanded, in batches as the view scrolls down. Thus, opening a file
+    with thousands of variables does not require reading all their metadata up front.
+    """
+
+    # Number of variable nodes created per fetch.
+    batchsize = 256
+
+    class Node(object):
+        def __init__(self,parent,text,expression=None,path=None,tooltip=None):
+            self.parent = parent
+            self.text = text
+            self.expression = expression
+            self.path = path
+            self.tooltip = tooltip
+            self.children = []
+            self.loading = False
+
+            # For dimension nodes: store and names of the variables that do not have a node yet.
+            self.store,self.storename,self.pending,self.sorted = None,None,None,False
+
+        def row(self):
+            return self.parent.children.index(self)
+
+    def __init__(self,parent=None):
+        QtCore.QAbstractItemModel.__init__(self,parent)
+        self.root = WorkspaceModel.Node(None,None)
+        self.expressionroot = None
+
+    def nodeFromIndex(self,index):
+        if not index.isValid(): return self.root
+        return index.internalPointer()
+
+    def indexFromNode(self,node):
+        if node is self.root: return QtCore.QModelIndex()
+        return self.createIndex(node.row(),0,node)
+
+    def index(self,row,column,parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row,column,parent): return QtCore.QModelIndex()
+        return self.createIndex(row,column,self.nodeFromIndex(parent).children[row])
+
+    def parent(self,index=None):
+        # Without arguments, this is QObject.parent.
+        if index is None: return QtCore.QAbstractItemModel.parent(self)
+        if not index.isValid(): return QtCore.QModelIndex()
+        return self.indexFromNode(index.internalPointer().parent)
+
+    def rowCount(self,parent=QtCore.QModelIndex()):
+        if parent.column()>0: return 0
+        return len(self.nodeFromIndex(parent).children)
+
+    def columnCount(self,parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self,parent=QtCore.QModelIndex()):
+        node = self.nodeFromIndex(parent)
+        return bool(node.children or node.pending)
+
+    def canFetchMore(self,parent):
+        # Only the first batch is offered to the view, which would otherwise fetch
+        # all remaining batches on expansion. Subsequent batches are fetched by
+        # NcTreeView.fetchVisible as the user scrolls.
+        node = self.nodeFromIndex(parent)
+        return bool(node.pending) and not node.children
+
+    def fetchMore(self,parent):
+        node = self.nodeFromIndex(parent)
+        if not node.pending: return
+        if not node.sorted:
+            # Variables are sorted on their long name, which is therefore read
+            # for all variables below this node when it is first expanded.
+            longnames = [(node.store.getVariable(name).getLongName(),name) for name in node.pending]
+            node.pending = sorted(longnames,key=lambda x: x[0].lower())
+            node.sorted = True
+        batch = node.pending[:self.batchsize]
+        del node.pending[:self.batchsize]
+        first = len(node.children)
+        self.beginInsertRows(parent,first,first+len(batch)-1)
+        for longname,varname in batch:
+            node.children.append(WorkspaceModel.Node(node,longname,'%s[\'%s\']' % (node.storename,varname)))
+        self.endInsertRows()
+
+    def hasPendingChildren(self,parent):
+        """Returns whether child nodes remain to be created below the specified node."""
+        return bool(self.nodeFromIndex(parent).pending)
+
+    def getFetchableIndices(self):
+        """Returns the indices of all nodes for which children remain to be created."""
+        return [self.indexFromNode(node) for fileroot in self.root.children for node in fileroot.children if node.pending]
+
+    def flags(self,index):
+        if not index.isValid(): return QtCore.Qt.ItemFlag.NoItemFlags
+        return QtCore.Qt.ItemFlag.ItemIsEnabled|QtCore.Qt.ItemFlag.ItemIsSelectable
+
+    def data(self,index,role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid(): return None
+        node = index.internalPointer()
+        if role==QtCore.Qt.ItemDataRole.DisplayRole:
+            return node.text
+        elif role==QtCore.Qt.ItemDataRole.ToolTipRole:
+            return node.tooltip
+        elif role==QtCore.Qt.ItemDataRole.UserRole:
+            return node.expression
+        elif role==QtCore.Qt.ItemDataRole.UserRole+1:
+            return node.path
+        return None
+
+    def getFileIndices(self):
+        """Returns the indices of the root nodes of all open files."""
+        return [self.indexFromNode(node) for node in self.root.children if node is not self.expressionroot]
+
+    def addFile(self,storename,path):
+        """Adds a root node for a file that is still being opened.
+        Returns the index of the new root node.
+        """
+        fileroot = WorkspaceModel.Node(self.root,'%s (loading...)' % storename,storename,path,path)
+        fileroot.loading = True
+
+        # Files are inserted before the node with custom expressions.
+        row = len(self.root.children)
+        if self.expressionroot is not None: row -= 1
+        self.beginInsertRows(QtCore.QModelIndex(),row,row)
+        self.root.children.insert(row,fileroot)
+        self.endInsertRows()
+        return self.indexFromNode(fileroot)
+
+    def setFileContents(self,index,store,dim2names):
+        """Adds a child node for each combination of dimensions to the root
+        node of a file that has finished opening. dim2names maps tuples of
+        dimension names to the names of the variables that use them.
+        """
+        fileroot = index.internalPointer()
+        dimroots = []
+        for dims in sorted(dim2names.keys(), key=lambda x: (len(x), ','.join(x))):
+            nodename = ','.join(dims)
+            if nodename=='': nodename = '[none]'
+            dimroot = WorkspaceModel.Node(fileroot,nodename)
+            dimroot.store,dimroot.storename,dimroot.pending = store,fileroot.expression,list(dim2names[dims])
+            dimroots.append(dimroot)
+        fileroot.text,fileroot.loading = fileroot.expression,False
+        if dimroots:
+            self.beginInsertRows(index,0,len(dimroots)-1)
+            fileroot.children = dimroots
+            self.endInsertRows()
+        self.dataChanged.emit(index,index)
+
+    def isLoading(self,index):
+        """Returns whether the index refers to a file that is still being opened."""
+        return index.isValid() and index.internalPointer().loading
+
+    def findFile(self,storename):
+        """Returns the index of the root node for the specified data store."""
+        for index in self.getFileIndices():
+            if index.data(QtCore.Qt.ItemDataRole.UserRole)==storename: return index
+        return QtCore.QModelIndex()
+
+    def removeRows(self,row,count,parent=QtCore.QModelIndex()):
+        node = self.nodeFromIndex(parent)
+        self.beginRemoveRows(parent,row,row+count-1)
+        removed = node.children[row:row+count]
+        del node.children[row:row+count]
+        if self.expressionroot in removed: self.expressionroot = None
+        self.endRemoveRows()
+        return True
+
+    def isExpression(self,index):
+        """Returns whether the index refers to a custom expression."""
+        return index.isValid() and self.expressionroot is not None and index.internalPointer().parent is self.expressionroot
+
+    def addExpression(self,expression):
+        """Adds a node for a custom expression and returns its index."""
+        if self.expressionroot is None:
+            row = len(self.root.children)
+            self.beginInsertRows(QtCore.QModelIndex(),row,row)
+            self.expressionroot = WorkspaceModel.Node(self.root,'expressions')
+            self.root.children.append(self.expressionroot)
+            self.endInsertRows()
+        row = len(self.expressionroot.children)
+        self.beginInsertRows(self.indexFromNode(self.expressionroot),row,row)
+        node = WorkspaceModel.Node(self.expressionroot,expression,expression)
+        self.expressionroot.children.append(node)
+        self.endInsertRows()
+        return self.indexFromNode(node)
+
+    def setExpression(self,index,expression):
+        node = index.internalPointer()
+        node.text,node.expression = expression,expression
+        self.dataChanged.emit(index,index)
+
+class NcTreeView(QtWidgets.QTreeView):
     fileDropped = QtCore.Signal(str)
     def __init__(self,parent):
-        QtWidgets.QTreeWidget.__init__(self,parent)
+        QtWidgets.QTreeView.__init__(self,parent)
         self.setAcceptDrops(True)
+        self.setUniformRowHeights(True)
+        self.verticalScrollBar().valueChanged.connect(self.fetchVisible)
+        self.expanded.connect(self.fetchVisible)
+
+    def fetchVisible(self,*args):
+        """Lets the model create more nodes below expanded nodes whose last
+        child has scrolled into view.
+        """
+        model = self.model()
+        if model is None: return
+        for index in model.getFetchableIndices():
+            if not self.isExpanded(index): continue
+            while model.hasPendingChildren(index):
+                self.executeDelayedItemsLayout()
+                last = model.index(model.rowCount(index)-1,0,index)
+                if self.visualRect(last).top()>self.viewport().height(): break
+                model.fetchMore(index)
+
+    def resizeEvent(self,event):
+        QtWidgets.QTreeView.resizeEvent(self,event)
+        self.fetchVisible()
 
     def dragEnterEvent(self,event):
         if event.mimeData().hasUrls():
             event.setDropAction(QtCore.Qt.DropAction.CopyAction)
             event.accept()
         else:
-            QtWidgets.QTreeWidget.dragEnterEvent(self,event)
+            QtWidgets.QTreeView.dragEnterEvent(self,event)
 
     def dragMoveEvent(self,event):
         if event.mimeData().hasUrls():
             event.setDropAction(QtCore.Qt.DropAction.CopyAction)
             event.accept()
         else:
-            QtWidgets.QTreeWidget.dragMoveEvent(self,event)
+            QtWidgets.QTreeView.dragMoveEvent(self,event)
 
     def dropEvent(self,event):
         data = event.mimeData()
@@ -839,7 +1156,413 @@ class NcTreeWidget(QtWidgets.QTreeWidget):
                 self.fileDropped.emit(u''.__class__(url.toLocalFile()))
             event.accept()
         else:
-            QtWidgets.QTreeWidget.dropEvent(self,event)
+            QtWidgets.QTreeView.dropEvent(self,event)
+
+class LoadThread(QtCore.QThread):
+    """Opens a NetCDF file (or set of files) in the background. When done, the
+    loaded signal is emitted with the thread itself as argument. The data store
+    is then available as attribute store, or the error that occurred as attribute error.
+    """
+    loaded = QtCore.Signal(object)
+
+    def __init__(self,paths,storename,maskoutsiderange,parent=None):
+        QtCore.QThread.__init__(self,parent)
+        self.paths = paths
+        self.storename = storename
+        self.maskoutsiderange = maskoutsiderange
+        self.cancelled = False
+        self.store,self.dim2names,self.error = None,None,None
+
+    def run(self):
+        try:
+            try:
+                from . import aggregation,headers
+            except ImportError:
+                import aggregation,headers
+
+            # Until the store is protected, xmlplot accesses the NetCDF library directly
+            # (header parsing, coordinate detection, reassignment). The lock is taken around
+            # each step that does so (per member file for aggregations), rather than for the
+            # entire open, so that reads by other threads can proceed in between.
+            if isinstance(self.paths,(list,tuple)) and len(self.paths)>1:
+                # Multiple files are aggregated using an index persisted between sessions.
+                store = aggregation.openStore(self.paths,os.path.join(SettingsStore.getCacheDirectory(),'aggregations'),cancelled=lambda: self.cancelled)
+            elif isinstance(self.paths,str) and os.path.isfile(self.paths):
+                # The header of a single file is cached between sessions, so an unchanged file reopens quickly.
+                store = headers.openStore(self.paths,os.path.join(SettingsStore.getCacheDirectory(),'headers'))
+            else:
+                with ncio.lock:
+                    store = xmlplot.data.open(self.paths)
+            with ncio.lock:
+                self.store = ncio.protect(store)
+
+            # Determine whether to mask values outside their valid range.
+            self.store.maskoutsiderange = self.maskoutsiderange
+
+            # Build dictionary linking combinations of dimensions to lists of variable names.
+            # Other metadata (e.g., long names) are read by the tree model when needed.
+            dim2names = {}
+            for name in self.store.getVariableNames():
+                if self.cancelled: break
+                dim2names.setdefault(tuple(self.store.getVariable(name).getDimensions()),[]).append(name)
+            self.dim2names = dim2names
+        except Exception as e:
+            self.error = e
+        self.loaded.emit(self)
+
+class FigureSource(xmlplot.common.VariableStore):
+    """Data source of the figure, with the stores of all open files as children.
+    Slices that have already been read and evaluated in the background can be
+    registered with prepare; the figure will then use these rather than reading
+    the data itself.
+
+    Parsed expressions are cached, and slices are applied to the cached object
+    of the unsliced expression (getSliceExpression), so that showing a new
+    slice does not require parsing and resolving variable names again. The
+    cache is cleared when stores are added or removed, or when their
+    coordinates are reassigned (clearExpressions). If enabled with setFusion,
+    expressions are evaluated with elementwise parts fused by numexpr.
+
+    Data are reduced to the detail that the figure can show by the decimator,
+    if set: long one-dimensional series are decimated, and large
+    two-dimensional slices are read as overviews. Slices read by others for
+    the figure (e.g., prepared slices) must be read with read, so that they
+    match.
+    """
+    def __init__(self):
+        xmlplot.common.VariableStore.__init__(self)
+        self.prepared = {}
+        self.expressions = cache.LRUCache(1000)
+        self.fuse = False
+        self.decimator = None
+
+    def addChild(self,child,name=None):
+        xmlplot.common.VariableStore.addChild(self,child,name)
+        self.clearExpressions()
+
+    def removeChild(self,name):
+        result = xmlplot.common.VariableStore.removeChild(self,name)
+        self.clearExpressions()
+        return result
+
+    def clearExpressions(self):
+        self.expressions.clear()
+
+    def setFusion(self,fuse):
+        """Sets whether elementwise parts of expressions are evaluated with numexpr."""
+        self.fuse = fuse and fusion.isAvailable()
+        self.clearExpressions()
+
+    def addExpression(self,key,var):
+        """Caches the object of a parsed expression, together with the object
+        used to evaluate it (which has elementwise parts fused if enabled)."""
+        entry = (var,fusion.fuseExpression(var) if self.fuse else var)
+        self.expressions.put(key,entry,1)
+        return entry
+
+    def getCachedExpression(self,expression,defaultchild=None):
+        """Returns the parsed object of an expression and the object used to evaluate it."""
+        key = (expression,defaultchild)
+        entry = self.expressions.get(key)
+        if entry is None: entry = self.addExpression(key,xmlplot.common.VariableStore.getExpression(self,expression,defaultchild))
+        return entry
+
+    def getExpression(self,expression,defaultchild=None):
+        return self.getCachedExpression(expression,defaultchild)[1]
+
+    def getSliceExpression(self,expression,slices):
+        """Returns the normalized expression for a slice (dictionary of
+        dimension indices) of the specified expression. The sliced object is
+        built from the cached object of the expression and cached itself.
+        The slice is pushed down to the variables the expression reads, so
+        that only the slab that is shown is read and computed.
+        """
+        slicedvar = slabs.sliceExpression(self.getCachedExpression(expression)[0],slices)
+        slicedexpression = slicedvar.buildExpression()
+        self.addExpression((slicedexpression,None),slicedvar)
+        return slicedexpression
+
+    def prepare(self,expression,slices):
+        self.prepared = {expression:slices}
+
+    @tracing.traced('read slice')
+    def read(self,var,bounds=None):
+        """Returns the data of a variable for the specified bounds (by default,
+        all data) as the figure reads them to show them."""
+        if bounds is None: bounds = tuple([slice(None)]*len(var.getDimensions()))
+        newbounds = bounds if self.decimator is None else self.decimator.getOverviewBounds(var,bounds)
+        if newbounds is bounds: return var.getSlice(bounds)
+        getslice = var.getSlice
+        if isinstance(var,xmlplot.expressions.VariableExpression):
+            # Take the overview of an expression through a sliced expression,
+            # so that only the cells needed are read from each variable.
+            def getslice(bounds):
+                expression = self.getSliceExpression(var.buildExpression(),dict(zip(var.getDimensions(),bounds)))
+                return self.getExpression(expression).getSlice()
+        return self.decimator.readOverview(var,newbounds,getslice)
+
+    def __getitem__(self,expression):
+        var = self.getExpression(expression)
+        if self.decimator is not None and self.decimator.update():
+            # The figure changed size or range: prepared slices may have been read at another resolution.
+            self.prepared = {}
+        slices = self.prepared.pop(expression,None)
+        if slices is None and self.decimator is None: return var
+
+        # Return a copy of the variable that serves the prepared slices if any,
+        # or else reads as done by read, and reduces data with the decimator.
+        # Prepared slices are copied, as the figure modifies them.
+        def getSlice(bounds=None,*args,**kwargs):
+            if isinstance(slices,(list,tuple)):
+                result = [copy.copy(s) for s in slices]
+            elif slices is not None:
+                result = copy.copy(slices)
+            elif args or kwargs:
+                result = var.getSlice(bounds,*args,**kwargs)
+            else:
+                result = self.read(var,bounds)
+            if self.decimator is not None: result = self.decimator.decimate(var,result)
+            return result
+        newvar = copy.copy(var)
+        newvar.getSlice = getSlice
+        return newvar
+
+def getSliceSize(slices):
+    """Returns the memory used by the data and coordinates of (a list of) slices, in bytes."""
+    if not isinstance(slices,(list,tuple)): slices = (slices,)
+    size = 0
+    for s in slices:
+        for values in [s.data]+list(s.coords)+list(s.coords_stag):
+            size += getattr(values,'nbytes',0)
+    return size
+
+def getChunkShape(var):
+    """Returns the chunk shape of a NetCDF variable, or None if it is not
+    chunked or not read directly from a NetCDF file."""
+    try:
+        ncvar = var.store.getcdf().variables[var.ncvarname]
+    except Exception:
+        return None
+    return chunks.getChunkShape(ncvar)
+
+def getRange(var,bounds,iterdims,dims,progress=None,maxblocksize=64*1024*1024):
+    """Determines the range of coordinates and values of a variable over all
+    slabs obtained by taking single indices of the dimensions in iterdims.
+    Bounds contains an integer index or slice(None) for every dimension of the
+    variable; the dimensions with slice(None) make up the slab. Returns lists
+    with the minimum and maximum of the (staggered) coordinates of each slab
+    dimension, followed by those of the values. Only ranges of the dimensions
+    in dims are determined (None in dims stands for the values); others are
+    set to None. The result is identical to that obtained by reading the slabs
+    one by one, but data are read in large blocks, aligned with the chunks of
+    the NetCDF variable. Variables with coordinates that vary along the
+    iterated dimensions are still read slab by slab, as xmlplot staggers
+    coordinates within a slab only.
+    """
+    alldims = var.getDimensions()
+    shape = var.getShape()
+    slabdims = [d for d,b in zip(alldims,bounds) if isinstance(b,slice)]
+    vmin,vmax = [None]*(len(slabdims)+1),[None]*(len(slabdims)+1)
+    iterdims = list(iterdims)
+    iteraxes = [alldims.index(d) for d in iterdims]
+    lengths = [shape[i] for i in iteraxes]
+
+    def update(i,curmin,curmax):
+        if curmin is not None and (vmin[i] is None or vmin[i]>curmin): vmin[i] = curmin
+        if curmax is not None and (vmax[i] is None or vmax[i]<curmax): vmax[i] = curmax
+
+    # If values are not needed and the coordinates of the slab dimensions do not vary along
+    # the iterated dimensions, the coordinates of the first slab suffice.
+    if None not in dims and hasattr(var,'getCoordinateVariables'):
+        fixeddims = set(slabdims)-set(iterdims)
+        for d,coordvar in zip(alldims,var.getCoordinateVariables()):
+            if d in dims and d in fixeddims and coordvar is not None and not set(coordvar.getDimensions())<=fixeddims: break
+        else:
+            slabbounds = list(bounds)
+            for iaxis in iteraxes: slabbounds[iaxis] = slice(0,1)
+            slab = var.getSlice(tuple(slabbounds))
+            while isinstance(slab,(list,tuple)): slab = slab[0]
+            slabbounddims = [d for d,b in zip(alldims,slabbounds) if isinstance(b,slice)]
+            for idim,d in enumerate(slabdims):
+                if d in dims and d in fixeddims:
+                    coords = slab.coords_stag[slabbounddims.index(d)]
+                    update(idim,coords.min(),coords.max())
+            return vmin,vmax
+
+    # The staggered coordinates of a block differ from those of its slabs if they vary along
+    # an iterated dimension (e.g., time-varying depth). Such variables are read slab by slab.
+    if hasattr(var,'getCoordinateVariables'):
+        varyingdims = [d for d,coordvar in zip(alldims,var.getCoordinateVariables()) if d in dims and d in slabdims and coordvar is not None and set(coordvar.getDimensions())&set(iterdims)]
+    else:
+        varyingdims = [d for d in slabdims if d in dims]
+    byslab = len(varyingdims)>0
+
+    # Determine the block of slabs to read at once: along each iterated dimension, a multiple
+    # of the chunk length, such that the block stays below the maximum size in memory.
+    slabsize = 8
+    for l,b in zip(shape,bounds):
+        if isinstance(b,slice): slabsize *= l
+    chunkshape = getChunkShape(var)
+    blockshape = [1]*len(iterdims)
+    nslabs = max(1,maxblocksize//slabsize)
+    for i in range(len(iterdims)-1,-1,-1):
+        if byslab: break
+        chunk = 1 if chunkshape is None else chunkshape[iteraxes[i]]
+        blockshape[i] = max(1,min(lengths[i],max(chunk,(nslabs//chunk)*chunk)))
+        nslabs = max(1,nslabs//blockshape[i])
+
+    # Dimensions of the block in the order of the variable, and position of the iterated dimensions therein.
+    blockdims = [d for d,b in zip(alldims,bounds) if isinstance(b,slice) or d in iterdims]
+    blockiteraxes = [blockdims.index(d) for d in iterdims]
+    blockslabaxes = tuple([i for i,d in enumerate(blockdims) if d not in iterdims])
+
+    # The minimum and maximum value of the first slab that is not fully masked take precedence
+    # if they are NaN (as with slab-by-slab comparisons); track that slab across blocks.
+    first = None
+    nblocks = 1
+    for l,b in zip(lengths,blockshape): nblocks *= int(math.ceil(float(l)/b))
+    iblock = 0
+    for start in numpy.ndindex(*[int(math.ceil(float(l)/b)) for l,b in zip(lengths,blockshape)]):
+        start = [i*b for i,b in zip(start,blockshape)]
+        blockbounds = list(bounds)
+        for iaxis,i,b,l in zip(iteraxes,start,blockshape,lengths): blockbounds[iaxis] = i if byslab else slice(i,min(i+b,l))
+        block = var.getSlice(tuple(blockbounds))
+        while isinstance(block,(list,tuple)): block = block[0]
+        coorddims = slabdims if byslab else blockdims
+
+        # Coordinates of slab dimensions.
+        for idim,d in enumerate(slabdims):
+            if d in dims:
+                update(idim,block.coords_stag[coorddims.index(d)].min(),block.coords_stag[coorddims.index(d)].max())
+
+        # Values: take the minimum and maximum per slab, ordered by iterated dimension.
+        if None in dims:
+            data = numpy.ma.asarray(block.data)
+            if byslab: data = data.reshape([1 if d in iterdims else data.shape[slabdims.index(d)] for d in blockdims])
+            if blockslabaxes:
+                slabmin,slabmax = data.min(axis=blockslabaxes),data.max(axis=blockslabaxes)
+            else:
+                slabmin,slabmax = data,data
+            slabmin = numpy.ma.asarray(slabmin).transpose(numpy.argsort(numpy.argsort(blockiteraxes)))
+            slabmax = numpy.ma.asarray(slabmax).transpose(numpy.argsort(numpy.argsort(blockiteraxes)))
+            valid = ~numpy.ma.getmaskarray(slabmin)
+            if valid.any():
+                local = numpy.unravel_index(numpy.argmax(valid.ravel()),valid.shape)
+                index = tuple([i+j for i,j in zip(start,local)])
+                if first is None or index<first[0]: first = (index,slabmin[local],slabmax[local])
+                curmin,curmax = slabmin.data[valid],slabmax.data[valid]
+                if curmin.dtype.kind in 'fc':
+                    curmin,curmax = curmin[~numpy.isnan(curmin)],curmax[~numpy.isnan(curmax)]
+                if curmin.size>0: update(-1,curmin.min(),None)
+                if curmax.size>0: update(-1,None,curmax.max())
+
+        iblock += 1
+        if progress is not None: progress(float(iblock)/nblocks)
+
+    if first is not None:
+        if first[1]!=first[1]: vmin[-1] = first[1]
+        if first[2]!=first[2]: vmax[-1] = first[2]
+        if vmin[-1] is None: vmin[-1] = first[1]
+        if vmax[-1] is None: vmax[-1] = first[2]
+    return vmin,vmax
+
+class RenderThread(QtCore.QThread):
+    """Reads and evaluates the data for the figure in the background. Requests
+    are coalesced: if a new request arrives while the thread is busy, it replaces
+    any request that is still pending. When done, the ready signal is emitted
+    with the expression and its slices (or the exception raised).
+
+    When idle, the thread reads ahead the slices set with prefetch (e.g., the next
+    frames of an animation), until these would exceed prefetchbudget bytes.
+    """
+    ready = QtCore.Signal(object,object)
+
+    def __init__(self,store,parent=None):
+        QtCore.QThread.__init__(self,parent)
+        self.store = store
+        self.condition = threading.Condition()
+        self.pending = None
+        self.stopped = False
+
+        self.prefetchqueue = []
+        self.prefetched = {}
+        self.prefetchedsize = 0
+        self.prefetchbudget = 0
+        self.lastsize = 0
+
+    def request(self,expression):
+        with self.condition:
+            self.pending = expression
+            self.condition.notify()
+
+    def prefetch(self,expressions):
+        """Sets the expressions to read ahead, in order of priority. Data read
+        ahead earlier for expressions that are not in the list are discarded.
+        """
+        with self.condition:
+            self.prefetchqueue = list(expressions)
+            for expression in list(self.prefetched.keys()):
+                if expression not in self.prefetchqueue: self.discard(expression)
+            self.condition.notify()
+
+    def take(self,expression):
+        """Returns the slices read ahead for the specified expression, or None if
+        these are not available. The slices are removed from the read-ahead buffer.
+        """
+        with self.condition:
+            result = self.discard(expression)
+            self.condition.notify()
+        return result
+
+    def discard(self,expression):
+        result = self.prefetched.pop(expression,None)
+        if result is not None: self.prefetchedsize -= getSliceSize(result)
+        return result
+
+    def getNextPrefetch(self):
+        # Returns the next expression to read ahead, or None if there is none
+        # or reading it would exceed the memory budget.
+        if self.prefetchedsize+self.lastsize>self.prefetchbudget: return None
+        for expression in self.prefetchqueue:
+            if expression not in self.prefetched: return expression
+        return None
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.getNextPrefetch() is None and not self.stopped: self.condition.wait()
+                if self.stopped: return
+                prefetching = self.pending is None
+                if prefetching:
+                    expression = self.getNextPrefetch()
+                else:
+                    expression,self.pending = self.pending,None
+            try:
+                # Take the same slice as the figure will.
+                with tracing.span('prefetch' if prefetching else 'read slice (background)',expression=expression):
+                    result = self.store.read(self.store.getExpression(expression))
+            except Exception as e:
+                if prefetching:
+                    # Leave it to the figure to report the error when this slice is shown.
+                    with self.condition:
+                        if expression in self.prefetchqueue: self.prefetchqueue.remove(expression)
+                    continue
+                result = e
+            if not prefetching:
+                self.ready.emit(expression,result)
+                continue
+            with self.condition:
+                # Keep the result only if the slice is still wanted.
+                self.lastsize = getSliceSize(result)
+                if expression in self.prefetchqueue and expression not in self.prefetched:
+                    self.prefetched[expression] = result
+                    self.prefetchedsize += self.lastsize
 
 class VisualizeDialog(QtWidgets.QMainWindow):
     """Main PyNCView window.
@@ -861,7 +1584,68 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         self.figurepanel = xmlplot.gui_qt4.FigurePanel(central)
         self.figurepanel.setMinimumSize(500,350)
         self.figurepanel.figure.autosqueeze = False
+        self.figurepanel.figure.source = FigureSource()
         self.store = self.figurepanel.figure.source
+        self.store.setFusion(self.settings['FuseExpressions'].getValue(usedefault=True))
+        self.store.decimator = decimation.Decimator(self.figurepanel.figure)
+        self.store.decimator.onchange = self.onOverviewsChanged
+        self.setPersistOverviews(self.settings['PersistOverviews'].getValue(usedefault=True))
+
+        # Decompressed chunks of NetCDF-4 variables are cached, so that reads across the chunk layout do not decompress them again.
+        chunks.setMaximumSize(self.settings['ChunkCache/MemoryLimit'].getValue(usedefault=True)*1024*1024)
+        chunks.setThreads(self.settings['ChunkCache/Threads'].getValue(usedefault=True))
+
+        # Classic NetCDF files are read from a memory mapping, without copies.
+        ncmmap.enabled = self.settings['MemoryMapClassic'].getValue(usedefault=True)
+
+        # Thread that reads data for the figure in the background while the user changes the slice.
+        self.renderthread = RenderThread(self.store,self)
+        self.renderthread.ready.connect(self.onRenderDataReady)
+        self.renderthread.prefetchbudget = self.settings['Prefetch/MemoryLimit'].getValue(usedefault=True)*1024*1024
+        self.renderthread.start()
+        self.renderexpression = None
+        self.readaheaddirection = 1
+        self.lastslices = {}
+
+        # Paths of the open files by store name, and the export of animation stills in progress (if any).
+        self.storepaths = {}
+        self.exporter,self.exportspan = None,None
+
+        # Statistics of variables, kept between sessions.
+        self.statistics = ncstats.StatisticsCache(os.path.join(SettingsStore.getCacheDirectory(),'statistics'))
+
+        # Cache of rendered frames (compressed RGBA images), used to replay animations and
+        # scrub through slices that were shown before. A frame taken from the cache is shown
+        # on the canvas only; the figure itself is brought up to date once the slice stops changing.
+        self.framecache = cache.LRUCache(self.settings['FrameCache/MemoryLimit'].getValue(usedefault=True)*1024*1024)
+        self.figurehash = None
+        self.framestale = False
+        self.switchingframe = False
+        self.frametimer = QtCore.QTimer(self)
+        self.frametimer.setSingleShot(True)
+        self.frametimer.setInterval(300)
+        self.frametimer.timeout.connect(self.onSyncFrame)
+        self.propertiesinterface = self.figurepanel.figure.properties.getInterface()
+        self.propertiesinterface.connect('afterChange',self.onFigurePropertyChanged)
+        self.propertiesinterface.connect('afterStoreChange',self.onFigurePropertyChanged)
+
+        # Files that are followed as they are being written, by store name, and the names of those
+        # for which the newest record is shown as it arrives. Followed files are polled by a timer.
+        self.followers = {}
+        self.shownewest = set()
+        self.followtimer = QtCore.QTimer(self)
+        self.followtimer.setInterval(1000)
+        self.followtimer.timeout.connect(self.onFollowTimer)
+
+        # When only the slice changes, the data shown by the figure are updated in place where possible.
+        self.artistupdater = artists.ArtistUpdater(self.figurepanel.figure)
+
+        # Each frame is timed for the readout in the status bar; its stages are traced if enabled (see the tracing module).
+        self.frames = tracing.FrameCounter()
+        self.instrumentFigure(self.figurepanel.figure)
+
+        # Figures exported to file or printed show data at full resolution, rather than reduced to the screen.
+        self.instrumentOutput()
 
         self.labelMissing = QtWidgets.QLabel('',central)
         self.labelMissing.setWordWrap(True)
@@ -877,16 +1661,18 @@ class VisualizeDialog(QtWidgets.QMainWindow):
 
         self.browsertoolbar = QtWidgets.QToolBar(browserwidget)
 
-        self.tree = NcTreeWidget(browserwidget)
+        self.treemodel = WorkspaceModel(self)
+        self.tree = NcTreeView(browserwidget)
+        self.tree.setModel(self.treemodel)
         self.tree.header().hide()
         self.tree.setSizePolicy(QtWidgets.QSizePolicy.Policy.Minimum,QtWidgets.QSizePolicy.Policy.Expanding)
         self.tree.setMinimumWidth(75)
         self.tree.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
         self.tree.setContextMenuPolicy(QtCore.Qt.ContextMenuPolicy.CustomContextMenu)
 
-        self.tree.itemSelectionChanged.connect(self.onSelectionChanged)
+        self.tree.selectionModel().selectionChanged.connect(self.onSelectionChanged)
         self.tree.fileDropped.connect(self.load)
-        self.tree.itemDoubleClicked.connect(self.onVarDoubleClicked)
+        self.tree.doubleClicked.connect(self.onVarDoubleClicked)
         self.tree.customContextMenuRequested.connect(self.onTreeContextMenuEvent)
         #self.bnAddExpression = QtWidgets.QPushButton('Add custom expression...',browserwidget)
         #self.connect(self.bnAddExpression, QtCore.SIGNAL('clicked()'), self.editExpression)
@@ -922,11 +1708,12 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         self.addDockWidget(QtCore.Qt.DockWidgetArea.LeftDockWidgetArea, self.dockFileBrowser)
         self.dockFileBrowser.setWidget(browserwidget)
 
-        self.expressionroot = None
         self.allowupdates = True
+        self.loaders = []
         self.defaultslices = {}
         self.animation = None
         self.animatedtitle = False
+        self.dynamictitles = None
 
         self.lastpath = ''
         if self.settings['Paths/MostRecentlyUsed'].children: self.lastpath = self.settings['Paths/MostRecentlyUsed'].children[0].getValue()
@@ -943,7 +1730,23 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         self.browsertoolbar.addAction(xmlplot.gui_qt4.getIcon('funct.png'),'Add custom expression',self.editExpression)
         self.browsertoolbar.setIconSize(QtCore.QSize(16,16))
 
-        self.statusBar()
+        # Add controls to the status bar that show files being opened.
+        statusbar = self.statusBar()
+        self.labelLoading = QtWidgets.QLabel(statusbar)
+        self.progressLoading = QtWidgets.QProgressBar(statusbar)
+        self.progressLoading.setRange(0,0)
+        self.progressLoading.setMaximumWidth(100)
+        self.bnCancelLoading = QtWidgets.QToolButton(statusbar)
+        self.bnCancelLoading.setText('Cancel')
+        self.bnCancelLoading.clicked.connect(self.onCancelLoading)
+        for widget in (self.labelLoading,self.progressLoading,self.bnCancelLoading):
+            statusbar.addPermanentWidget(widget)
+            widget.setVisible(False)
+
+        # Add the readout of the time taken by the last frame and the frame rate.
+        self.labelFrameTiming = QtWidgets.QLabel(statusbar)
+        statusbar.addPermanentWidget(self.labelFrameTiming)
+        self.labelFrameTiming.setVisible(False)
 
         if self.settings['WindowPosition/Maximized'].getValue():
             self.showMaximized()
@@ -958,6 +1761,69 @@ class VisualizeDialog(QtWidgets.QMainWindow):
             y = max(0,min(desktoprct.height()-h,self.settings['WindowPosition/Y'].getValue()))
             if x is not None and y is not None and w is not None and h is not None: self.setGeometry(x,y,w,h)
 
+    def instrumentFigure(self,figure):
+        """Times each update of the figure, and traces building and rendering
+        it. Figure methods are replaced by wrappers on the instance only."""
+        update,draw,canvasdraw = figure.update,figure.draw,figure.canvas.draw
+        def timedUpdate():
+            if not figure.updating: return update()
+            start = time.perf_counter()
+            with tracing.span('update figure'):
+                update()
+            self.onFrameShown(time.perf_counter()-start)
+        figure.update = timedUpdate
+        figure.draw = tracing.traced('build figure')(draw)
+        figure.canvas.draw = tracing.traced('render (Agg)')(canvasdraw)
+
+    def instrumentOutput(self):
+        """Makes the figure panel export and print the figure drawn from data
+        at full resolution. Both render the artists already on the canvas,
+        which hold data reduced to the detail the screen shows (see the
+        decimation module). The figure is therefore drawn again without
+        reduction first, and as before once exporting or printing is done.
+        Canvas methods are replaced by wrappers on the instance only."""
+        canvas,figure,decimator = self.figurepanel.canvas,self.figurepanel.figure,self.store.decimator
+        def setReduced(reduced,margins=None):
+            # The reduction depends on the size of the axes, which the figure takes from the
+            # margins of the previous drawing: those of the screen are restored first.
+            if margins is not None: figure.figure.subplots_adjust(**margins)
+            decimator.setEnabled(reduced)
+            figure.update()
+        def wrap(function):
+            def wrapper(*args,**kwargs):
+                if decimator.enabled:
+                    params = figure.figure.subplotpars
+                    margins = dict(left=params.left,right=params.right,bottom=params.bottom,top=params.top)
+                    setReduced(False)
+                    QtCore.QTimer.singleShot(0,lambda: setReduced(True,margins))
+                return function(*args,**kwargs)
+            return wrapper
+
+        # Exporting renders within print_figure; printing renders on the canvas returned by
+        # switch_backends (which matplotlib 3.8 and later lack, so that printing fails there).
+        # Both are done when control returns to Qt.
+        canvas.print_figure = wrap(canvas.print_figure)
+        if hasattr(canvas,'switch_backends'): canvas.switch_backends = wrap(canvas.switch_backends)
+
+    def onFrameShown(self,duration):
+        """Called when a frame has been shown, after taking the specified time
+        (in seconds) to produce. Updates the readout in the status bar."""
+        self.frames.add(duration)
+        if not self.labelFrameTiming.isVisible(): return
+        rate = self.frames.getRate()
+        text = 'Last frame: %i ms' % round(1000*duration)
+        if rate is not None: text += ', %.1f fps' % rate
+        self.labelFrameTiming.setText(text)
+
+    def onShowFrameTiming(self):
+        self.setFrameTimingVisible(self.actFrameTiming.isChecked())
+
+    def setFrameTimingVisible(self,visible):
+        """Shows or hides the readout of frame timing in the status bar."""
+        self.actFrameTiming.setChecked(visible)
+        self.labelFrameTiming.setText('Last frame: -' if self.frames.duration is None else 'Last frame: %i ms' % round(1000*self.frames.duration))
+        self.labelFrameTiming.setVisible(visible)
+
     def onHideSliceDockWidget(self):
         """Called when the slice widget is hidden (e.g., closed by the user.
         """
@@ -980,6 +1846,8 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         menuView = bar.addMenu('View')
         self.actSliceWindow = menuView.addAction('Slice Window',self.onShowSliceWindow)
         self.actSliceWindow.setCheckable(True)
+        self.actFrameTiming = menuView.addAction('Frame Timing',self.onShowFrameTiming)
+        self.actFrameTiming.setCheckable(True)
         #menuTools = bar.addMenu('Tools')
         #menuTools.addAction('Re-assign coordinates...',self.onReassignCoordinates)
 
@@ -1029,6 +1897,19 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         if not ok: return
         self.load(path)
 
+    def setPersistOverviews(self,persist):
+        """Sets whether overviews of large grids are kept on disk between sessions."""
+        if persist:
+            self.store.decimator.overviews = overviews.OverviewCache(os.path.join(SettingsStore.getCacheDirectory(),'overviews'))
+        else:
+            self.store.decimator.overviews = None
+
+    def onOverviewsChanged(self):
+        """Called when the size or axes ranges of the figure change, which
+        determine the resolution and region of large grids that are read.
+        Data read ahead before then may no longer apply."""
+        self.renderthread.prefetch(())
+
     def onEditOptions(self):
         dlg = QtWidgets.QDialog(self,QtCore.Qt.WindowType.Dialog|QtCore.Qt.WindowType.CustomizeWindowHint|QtCore.Qt.WindowType.WindowTitleHint|QtCore.Qt.WindowType.WindowCloseButtonHint)
         dlg.setWindowTitle('Options')
@@ -1038,6 +1919,58 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         cb.setChecked(self.settings['MaskValuesOutsideRange'].getValue(usedefault=True))
         layout.addWidget(cb)
 
+        layoutPrefetch = QtWidgets.QGridLayout()
+        spinDepth = QtWidgets.QSpinBox(dlg)
+        spinDepth.setRange(0,1000)
+        spinDepth.setValue(self.settings['Prefetch/Depth'].getValue(usedefault=True))
+        layoutPrefetch.addWidget(QtWidgets.QLabel('Animation frames to read ahead:',dlg),0,0)
+        layoutPrefetch.addWidget(spinDepth,0,1)
+        spinMemory = QtWidgets.QSpinBox(dlg)
+        spinMemory.setRange(1,1024*1024)
+        spinMemory.setSuffix(' MB')
+        spinMemory.setValue(self.settings['Prefetch/MemoryLimit'].getValue(usedefault=True))
+        layoutPrefetch.addWidget(QtWidgets.QLabel('Maximum memory for frames read ahead:',dlg),1,0)
+        layoutPrefetch.addWidget(spinMemory,1,1)
+        spinFrames = QtWidgets.QSpinBox(dlg)
+        spinFrames.setRange(0,1024*1024)
+        spinFrames.setSuffix(' MB')
+        spinFrames.setValue(self.settings['FrameCache/MemoryLimit'].getValue(usedefault=True))
+        layoutPrefetch.addWidget(QtWidgets.QLabel('Maximum memory for rendered frames:',dlg),2,0)
+        layoutPrefetch.addWidget(spinFrames,2,1)
+        spinChunks = QtWidgets.QSpinBox(dlg)
+        spinChunks.setRange(0,1024*1024)
+        spinChunks.setSuffix(' MB')
+        spinChunks.setValue(self.settings['ChunkCache/MemoryLimit'].getValue(usedefault=True))
+        hits,misses,size = chunks.getStatistics()
+        spinChunks.setToolTip('Currently cached: %.1f MB. Chunks taken from the cache: %i, read from file: %i.' % (size/1024./1024.,hits,misses))
+        layoutPrefetch.addWidget(QtWidgets.QLabel('Maximum memory for decompressed chunks, per variable:',dlg),3,0)
+        layoutPrefetch.addWidget(spinChunks,3,1)
+        spinThreads = QtWidgets.QSpinBox(dlg)
+        spinThreads.setRange(0,256)
+        spinThreads.setSpecialValueText('one per core')
+        spinThreads.setValue(self.settings['ChunkCache/Threads'].getValue(usedefault=True))
+        if not chunks.isParallelAvailable():
+            spinThreads.setEnabled(False)
+            spinThreads.setToolTip('This requires h5py, which is not installed.')
+        layoutPrefetch.addWidget(QtWidgets.QLabel('Threads for decompressing chunks:',dlg),4,0)
+        layoutPrefetch.addWidget(spinThreads,4,1)
+        layout.addLayout(layoutPrefetch)
+
+        cbFuse = QtWidgets.QCheckBox('Evaluate elementwise expressions with numexpr (multithreaded, no temporary arrays).',dlg)
+        cbFuse.setChecked(self.settings['FuseExpressions'].getValue(usedefault=True))
+        if not fusion.isAvailable():
+            cbFuse.setEnabled(False)
+            cbFuse.setToolTip('This requires numexpr, which is not installed.')
+        layout.addWidget(cbFuse)
+
+        cbOverviews = QtWidgets.QCheckBox('Keep overviews of large grids on disk, so that they show instantly when opened again.',dlg)
+        cbOverviews.setChecked(self.settings['PersistOverviews'].getValue(usedefault=True))
+        layout.addWidget(cbOverviews)
+
+        cbMap = QtWidgets.QCheckBox('Read classic NetCDF files from a memory mapping, without copies (applies to files opened hereafter).',dlg)
+        cbMap.setChecked(self.settings['MemoryMapClassic'].getValue(usedefault=True))
+        layout.addWidget(cbMap)
+
         layoutButtons = QtWidgets.QHBoxLayout()
         bnOk = QtWidgets.QPushButton('OK',dlg)
         bnCancel = QtWidgets.QPushButton('Cancel',dlg)
@@ -1053,6 +1986,33 @@ class VisualizeDialog(QtWidgets.QMainWindow):
 
         if dlg.exec()!=QtWidgets.QDialog.DialogCode.Accepted: return
 
+        self.settings['Prefetch/Depth'].setValue(spinDepth.value())
+        self.settings['Prefetch/MemoryLimit'].setValue(spinMemory.value())
+        self.renderthread.prefetchbudget = spinMemory.value()*1024*1024
+
+        self.settings['FrameCache/MemoryLimit'].setValue(spinFrames.value())
+        self.framecache.setMaximumSize(spinFrames.value()*1024*1024)
+
+        self.settings['ChunkCache/MemoryLimit'].setValue(spinChunks.value())
+        chunks.setMaximumSize(spinChunks.value()*1024*1024)
+        if spinThreads.isEnabled():
+            self.settings['ChunkCache/Threads'].setValue(spinThreads.value())
+            chunks.setThreads(spinThreads.value())
+
+        if cbFuse.isEnabled():
+            self.settings['FuseExpressions'].setValue(cbFuse.isChecked())
+            self.store.setFusion(cbFuse.isChecked())
+
+        self.settings['PersistOverviews'].setValue(cbOverviews.isChecked())
+        self.setPersistOverviews(cbOverviews.isChecked())
+
+        self.settings['MemoryMapClassic'].setValue(cbMap.isChecked())
+        ncmmap.enabled = cbMap.isChecked()
+
+        # Data read ahead and cached frames may have been masked differently.
+        self.renderthread.prefetch(())
+        self.framecache.clear()
+
         mask = cb.isChecked()
         self.settings['MaskValuesOutsideRange'].setValue(mask)
 
@@ -1081,6 +2041,9 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         """
         dialog = ReassignDialog(store,parent=self)
         if dialog.exec()==QtWidgets.QDialog.DialogCode.Accepted:
+            self.renderthread.prefetch(())
+            self.framecache.clear()
+            self.store.clearExpressions()
             self.figurepanel.figure.update()
 
     def onFileProperties(self,store):
@@ -1090,8 +2053,21 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         dialog = NcFilePropertiesDialog(store,parent=self)
         dialog.exec()
 
+    def onPathsReceived(self,paths):
+        """Opens files handed over by another PyNcView instance (see the instance
+        module), and brings the window to the front."""
+        for path in paths:
+            try:
+                self.load(path)
+            except Exception as e:
+                print('Error: %s' % e)
+        if self.isMinimized(): self.showNormal()
+        self.raise_()
+        self.activateWindow()
+
     def load(self,paths):
-        """Loads a new NetCDF file.
+        """Starts loading a new NetCDF file. The file is opened in the background;
+        until it is ready, its node in the tree shows it is loading.
         """
         path = paths
         if isinstance(paths,(list,tuple)): path = paths[0]
@@ -1101,25 +2077,13 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         # First check if the file is already open.
         # If so, just select the corresponding root node and return.
         curstorenames = []
-        for i in range(self.tree.topLevelItemCount()):
-            curnode = self.tree.topLevelItem(i)
-            curpath = u''.__class__(curnode.data(0,QtCore.Qt.ItemDataRole.UserRole+1))
+        for curindex in self.treemodel.getFileIndices():
+            curpath = u''.__class__(curindex.data(QtCore.Qt.ItemDataRole.UserRole+1))
             if path==curpath:
-                self.tree.clearSelection()
-                curnode.setSelected(True)
+                self.tree.setCurrentIndex(curindex)
                 QtWidgets.QMessageBox.information(self,'Already open','"%s" has already been opened.' % path)
                 return
-            curstorenames.append(u''.__class__(curnode.data(0,QtCore.Qt.ItemDataRole.UserRole)))
-
-        # Try to load the NetCDF file.
-        try:
-            store = xmlplot.data.open(paths)
-        except xmlplot.data.NetCDFError as e:
-            QtWidgets.QMessageBox.critical(self,'Error opening file',u'%s' % e)
-            return
-
-        # Determine whether to mask values otuside their valid range.
-        store.maskoutsiderange = self.settings['MaskValuesOutsideRange'].getValue(usedefault=True)
+            curstorenames.append(u''.__class__(curindex.data(QtCore.Qt.ItemDataRole.UserRole)))
 
         # Create a name for the data store based on the file name,
         # but make sure it is unique.
@@ -1131,67 +2095,242 @@ class VisualizeDialog(QtWidgets.QMainWindow):
             storename = '%s_%02i' % (basestorename,i)
             i += 1
 
-        # Add the store to the data sources for the figure.
-        self.figurepanel.figure.addDataSource(storename,store)
-
-        # Get all variables in the data store.
-        variables = [store.getVariable(name) for name in store.getVariableNames()]
+        # Add a node for the file to the tree, and start opening it.
+        self.treemodel.addFile(storename,path)
+        loader = LoadThread(paths,storename,self.settings['MaskValuesOutsideRange'].getValue(usedefault=True),self)
+        loader.loaded.connect(self.onLoaded)
+        self.loaders.append(loader)
+        self.updateLoadingStatus()
+        loader.start()
 
-        # Build dictionary linking combinations of dimensions to lists of variables.
-        dim2var = {}
-        for variable in variables:
-            dim2var.setdefault(tuple(variable.getDimensions()),[]).append(variable)
+    def onLoaded(self,loader):
+        """Called when a file has been opened in the background.
+        """
+        loader.wait()
+        self.loaders.remove(loader)
+        loader.deleteLater()
+        self.updateLoadingStatus()
+
+        # If loading was cancelled, the node in the tree is already gone.
+        if loader.cancelled:
+            if loader.store is not None: loader.store.unlink()
+            return
 
-        # Create root node for this file
-        fileroot = QtWidgets.QTreeWidgetItem([storename],QtWidgets.QTreeWidgetItem.ItemType.Type)
-        fileroot.setData(0,QtCore.Qt.ItemDataRole.UserRole,storename)
-        fileroot.setData(0,QtCore.Qt.ItemDataRole.UserRole+1,path)
-        fileroot.setToolTip(0,path)
+        index = self.treemodel.findFile(loader.storename)
+        if loader.error is not None:
+            self.treemodel.removeRow(index.row())
+            if isinstance(loader.error,xmlplot.data.NetCDFError):
+                QtWidgets.QMessageBox.critical(self,'Error opening file',u'%s' % loader.error)
+                return
+            raise loader.error
 
-        # Add a node for each dimension set and add dependent variables.
-        for dims in sorted(dim2var.keys(), key=lambda x: (len(x), ','.join(x))):
-            vars = dim2var[dims]
-            nodename = ','.join(dims)
-            if nodename=='': nodename = '[none]'
-            curdimroot = QtWidgets.QTreeWidgetItem([nodename],QtWidgets.QTreeWidgetItem.ItemType.Type)
-            items = []
-            for variable in sorted(vars, key=lambda x: x.getLongName().lower()):
-                varname, longname = variable.getName(),variable.getLongName()
-                item = QtWidgets.QTreeWidgetItem([longname],QtWidgets.QTreeWidgetItem.ItemType.Type)
-                item.setData(0,QtCore.Qt.ItemDataRole.UserRole,'%s[\'%s\']' % (storename,varname))
-                curdimroot.addChild(item)
-            if curdimroot.childCount()>0: fileroot.addChild(curdimroot)
-
-        # Add the file to the tree
-        index = self.tree.topLevelItemCount()
-        if self.expressionroot is not None: index -= 1
-        self.tree.insertTopLevelItem(index,fileroot)
-        fileroot.setExpanded(True)
+        # Add the store to the data sources for the figure, and its variables to the tree.
+        self.figurepanel.figure.addDataSource(loader.storename,loader.store)
+        self.storepaths[loader.storename] = loader.paths
+        self.treemodel.setFileContents(index,loader.store,loader.dim2names)
+        self.tree.expand(index)
 
         # Store the path (to be used for consecutive open file dialogs)
+        path = index.data(QtCore.Qt.ItemDataRole.UserRole+1)
         self.lastpath = path
 
         # Add the newly opened file to the list of Most Recently Used files.
         self.settings.addUniqueValue('Paths/MostRecentlyUsed','Path',path)
         self.updateMRU()
 
+    def cancelLoading(self,loader):
+        """Cancels loading of a file. The thread that opens the file cannot be
+        interrupted, but its result will be discarded.
+        """
+        loader.cancelled = True
+        index = self.treemodel.findFile(loader.storename)
+        if index.isValid(): self.treemodel.removeRow(index.row())
+        self.updateLoadingStatus()
+
+    def onCancelLoading(self):
+        """Called when the user clicks the "Cancel" button in the status bar.
+        """
+        for loader in self.loaders:
+            if not loader.cancelled: self.cancelLoading(loader)
+
+    def updateLoadingStatus(self):
+        """Shows or hides the status bar controls for files being loaded.
+        """
+        active = [loader.storename for loader in self.loaders if not loader.cancelled]
+        if active: self.labelLoading.setText('Opening %s...' % ', '.join(active))
+        for widget in (self.labelLoading,self.progressLoading,self.bnCancelLoading):
+            widget.setVisible(bool(active))
+
     def getSelectedVariable(self):
         """Returns the currently selected variable as an expression (string), that
         can be used to obtain the variable from the figure's data store.
         """
-        selected = self.tree.selectedItems()
+        selected = self.tree.selectionModel().selectedIndexes()
         if len(selected)==0: return None
 
-        if selected[0].parent() is None: return None
+        if not selected[0].parent().isValid(): return None
 
         # Get name and path of variable about to be shown.
-        return selected[0].data(0,QtCore.Qt.ItemDataRole.UserRole)
+        return selected[0].data(QtCore.Qt.ItemDataRole.UserRole)
 
     def onSliceChanged(self,dimschanged):
         """Called when the slice specification changes in the slice widget.
         """
+        self.renderexpression = None
+        slcs = self.slicetab.getSlices()
+        if self.animation is not None:
+            # Read ahead in the direction in which the animated dimension last moved.
+            dim = self.animation.dimension
+            if dim in slcs and dim in self.lastslices and slcs[dim]!=self.lastslices[dim]:
+                self.readaheaddirection = 1 if slcs[dim]>self.lastslices[dim] else -1
+        self.lastslices = slcs
+        if not dimschanged:
+            # Only the slice index changed. Use data read ahead if available.
+            # Otherwise, read the data for the new slice in the background,
+            # and redraw when they are available.
+            varname = self.getSelectedVariable()
+            if varname is None: return
+            var = self.store.getExpression(varname)
+            varshape = var.getShape()
+            if varshape is not None and len(varshape)-len(slcs) in (1,2):
+                expression = self.addSliceSpec(varname,var)
+                result = self.renderthread.take(expression)
+                self.renderthread.prefetch(self.getReadAheadExpressions(varname,var))
+                if self.showCachedFrame(expression,slcs):
+                    self.renderexpression = None
+                    return
+                if result is not None:
+                    self.onRenderDataReady(expression,result,requested=False)
+                else:
+                    self.renderexpression = expression
+                    self.renderthread.request(expression)
+                return
+        self.renderthread.prefetch(())
         self.redraw(preserveproperties=True,preserveaxesbounds=not dimschanged)
 
+    def getReadAheadExpressions(self,varname,var):
+        """Returns expressions for the slices that the current animation will
+        show next, taking into account its stride and direction.
+        """
+        if self.animation is None: return ()
+        dim = self.animation.dimension
+        slcs = self.slicetab.getSlices()
+        if dim not in slcs: return ()
+        imin,imax = self.slicetab.getRange(dim)
+        step = self.animation.toolbar.spinStride.value()*self.readaheaddirection
+        expressions = []
+        for i in range(self.settings['Prefetch/Depth'].getValue(usedefault=True)):
+            slcs[dim] += step
+            if slcs[dim]<imin or slcs[dim]>imax: break
+            expressions.append(self.addSliceSpec(varname,var,slices=dict(slcs)))
+        return expressions
+
+    def onRenderDataReady(self,expression,result,requested=True):
+        """Called when the background thread has read the data for a new slice.
+        """
+        # Drop the result if the slice has changed since it was requested.
+        if requested and expression!=self.renderexpression: return
+        self.renderexpression = None
+
+        # If reading failed, just redraw: the figure will then report the error.
+        if not isinstance(result,Exception):
+            start = time.perf_counter()
+            if self.updateFrame(expression,result):
+                self.onFrameShown(time.perf_counter()-start)
+                self.storeFrame(expression,self.slicetab.getSlices())
+                return
+            self.store.prepare(expression,result)
+        self.switchingframe = True
+        try:
+            self.redraw(preserveproperties=True,preserveaxesbounds=True)
+        finally:
+            self.switchingframe = False
+        self.store.prepared = {}
+        if not isinstance(result,Exception): self.artistupdater.record(result,self.store.getExpression(expression).getLongName())
+        self.storeFrame(expression,self.slicetab.getSlices())
+
+    @tracing.traced('update frame in place')
+    def updateFrame(self,expression,result):
+        """Shows the data of a new slice by updating the figure in place, rather
+        than rebuilding it. Returns whether this succeeded.
+        """
+        if not self.figurepanel.isVisible(): return False
+        title = None
+        if self.animation is not None and self.animation.checkboxFormat.isChecked():
+            title = self.getDynamicTitle(self.store.getExpression(self.getSelectedVariable()))
+        if not self.artistupdater.update(result,self.store.getExpression(expression).getLongName(),title): return False
+
+        # Bring the figure itself up to date once the slice has not changed for a while.
+        self.framestale = True
+        self.frametimer.start()
+        return True
+
+    def getFigureHash(self):
+        """Returns a hash of the figure properties, excluding those that change
+        from frame to frame (the plotted expression and a dynamic title).
+        """
+        if self.figurehash is None:
+            dom = self.figurepanel.figure.getPropertiesCopy()
+            for node in dom.getElementsByTagName('Series'): node.removeAttribute('id')
+            if self.animatedtitle:
+                for node in dom.getElementsByTagName('Title'):
+                    for child in list(node.childNodes):
+                        if child.nodeType==child.TEXT_NODE: node.removeChild(child)
+            self.figurehash = hash(dom.toxml())
+        return self.figurehash
+
+    def getFrameKey(self,expression,slcs):
+        renderer = self.figurepanel.canvas.get_renderer()
+        titleformat = None
+        if self.animation is not None and self.animation.checkboxFormat.isChecked(): titleformat = str(self.animation.editFormat.text())
+        return (expression,tuple(sorted(slcs.items())),self.getFigureHash(),renderer.width,renderer.height,titleformat)
+
+    def storeFrame(self,expression,slcs):
+        """Adds the frame currently shown on the canvas to the frame cache.
+        """
+        figure = self.figurepanel.figure
+        if figure.dirty or figure.errors or not self.figurepanel.isVisible(): return
+        renderer = self.figurepanel.canvas.get_renderer()
+        data = zlib.compress(numpy.asarray(renderer.buffer_rgba()).tobytes(),1)
+        self.framecache.put(self.getFrameKey(expression,slcs),data,len(data))
+
+    @tracing.traced('show cached frame')
+    def showCachedFrame(self,expression,slcs):
+        """Shows a frame from the frame cache on the canvas, if available.
+        Returns whether this succeeded.
+        """
+        if not self.figurepanel.isVisible(): return False
+        start = time.perf_counter()
+        key = self.getFrameKey(expression,slcs)
+        data = self.framecache.get(key)
+        if data is None: return False
+        buffer = numpy.asarray(self.figurepanel.canvas.get_renderer().buffer_rgba())
+        buffer[...] = numpy.frombuffer(zlib.decompress(data),dtype=buffer.dtype).reshape(buffer.shape)
+        self.figurepanel.canvas.update()
+        self.onFrameShown(time.perf_counter()-start)
+
+        # Bring the figure itself up to date once the slice has not changed for a while.
+        self.framestale = True
+        self.frametimer.start()
+        return True
+
+    def onSyncFrame(self):
+        """Called when the slice has not changed for a while after a frame was taken
+        from the cache. Redraws the figure, so that it matches the current slice.
+        """
+        if not self.framestale: return
+        self.switchingframe = True
+        try:
+            self.redraw(preserveproperties=True,preserveaxesbounds=True)
+        finally:
+            self.switchingframe = False
+
+    def onFigurePropertyChanged(self,*args):
+        """Called when a property of the figure changes. Unless this is due to a
+        change in slice, cached frames no longer match the figure.
+        """
+        if not self.switchingframe: self.figurehash = None
+
     def onTreeContextMenuEvent(self,point):
         """Called when the user right-clicks a node (file or variable) in the tree.
         """
@@ -1205,16 +2344,35 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         # Return without showing the context menu.
         if varname is None: return
 
+        # Files that are still being opened can only be cancelled.
+        if self.treemodel.isLoading(index):
+            menu = QtWidgets.QMenu(self)
+            actCancel = menu.addAction('Cancel')
+            if menu.exec(self.tree.mapToGlobal(point)) is actCancel:
+                for loader in self.loaders:
+                    if loader.storename==varname and not loader.cancelled: self.cancelLoading(loader)
+            return
+
         # Get the selected variable
         item = self.store[varname]
 
         # Build and show the context menu
         menu = QtWidgets.QMenu(self)
-        actReassign,actClose,actProperties = None,None,None
+        actReassign,actClose,actProperties,actFollow,actNewest = None,None,None,None,None
         if isinstance(item,(xmlplot.common.VariableStore,xmlplot.common.Variable)):
             actProperties = menu.addAction('Properties...')
         if isinstance(item,xmlplot.common.VariableStore):
             actReassign = menu.addAction('Reassign coordinates...')
+            path = self.storepaths.get(varname)
+            if isinstance(getattr(item,'nc',None),ncio.Dataset) and isinstance(path,str) and os.path.isfile(path):
+                # Single local files can be followed while they are being written.
+                actFollow = menu.addAction('Follow changes')
+                actFollow.setCheckable(True)
+                actFollow.setChecked(varname in self.followers)
+                actNewest = menu.addAction('Show newest records')
+                actNewest.setCheckable(True)
+                actNewest.setChecked(varname in self.shownewest)
+                actNewest.setEnabled(varname in self.followers)
             actClose    = menu.addAction('Close')
         if menu.isEmpty(): return
         actChosen = menu.exec(self.tree.mapToGlobal(point))
@@ -1222,39 +2380,103 @@ class VisualizeDialog(QtWidgets.QMainWindow):
 
         # Interpret and execute the action chosen in the menu.
         if actChosen is actProperties:
-            dialog = NcPropertiesDialog(item,parent=self,flags=QtCore.Qt.WindowType.CustomizeWindowHint|QtCore.Qt.WindowType.Dialog|QtCore.Qt.WindowType.WindowTitleHint|QtCore.Qt.WindowType.WindowCloseButtonHint)
+            dialog = NcPropertiesDialog(item,parent=self,flags=QtCore.Qt.WindowType.CustomizeWindowHint|QtCore.Qt.WindowType.Dialog|QtCore.Qt.WindowType.WindowTitleHint|QtCore.Qt.WindowType.WindowCloseButtonHint,statistics=self.statistics)
             dialog.exec()
         elif actChosen is actReassign:
             self.onReassignCoordinates(item)
+        elif actChosen is actFollow:
+            self.setFollow(varname,actFollow.isChecked())
+        elif actChosen is actNewest:
+            if actNewest.isChecked():
+                self.shownewest.add(varname)
+            else:
+                self.shownewest.discard(varname)
         elif actChosen is actClose:
-            self.tree.takeTopLevelItem(index.row())
+            self.setFollow(varname,False)
+            self.renderthread.prefetch(())
+            self.framecache.clear()
+            self.treemodel.removeRow(index.row())
             self.figurepanel.figure.clearVariables()
             item = self.figurepanel.figure.removeDataSource(varname)
             item.unlink()
+            del self.storepaths[varname]
             self.redraw()
 
+    def setFollow(self,storename,enable):
+        """Starts or stops following a file as it is being written."""
+        if enable:
+            self.followers[storename] = follow.Follower(self.store.children[storename],self.storepaths[storename])
+            self.followtimer.start()
+        else:
+            self.followers.pop(storename,None)
+            self.shownewest.discard(storename)
+            if not self.followers: self.followtimer.stop()
+
+    def onFollowTimer(self):
+        """Called periodically while files are followed. Checks whether
+        records have been appended to these files."""
+        for storename,follower in list(self.followers.items()):
+            try:
+                grown = follower.poll()
+            except ncio.ReopenError as e:
+                # The file is reopened again at the next poll.
+                self.statusBar().showMessage(str(e))
+                continue
+            except Exception as e:
+                self.setFollow(storename,False)
+                self.statusBar().showMessage('Stopped following %s: %s' % (storename,e))
+                continue
+            if grown: self.onFileGrown(storename,grown)
+
+    def onFileGrown(self,storename,grown):
+        """Called when records have been appended to a followed file. grown
+        contains the previous and current length of each dimension that has
+        grown. Data that do not depend on these dimensions, and slices of
+        records that were present before, remain valid. The slice controls
+        are extended; the figure is redrawn only if it shows the full length
+        of a dimension that has grown.
+        """
+        # Sliced expressions may have been built for the previous length, but frames
+        # of slices through the dimensions that grew still apply.
+        self.store.clearExpressions()
+        self.framecache.discard(lambda key: any(dim not in dict(key[1]) for dim in grown))
+
+        varname = self.getSelectedVariable()
+        if varname is None or self.slicetab is None: return
+        var = self.store.getExpression(varname)
+        if isinstance(var,xmlplot.expressions.VariableExpression):
+            stores = [v.store for v in var.variables]
+        else:
+            stores = [var.store]
+        if not any(store is self.store.children[storename] for store in stores): return
+        dims,shape = list(var.getDimensions()),var.getShape()
+        grown = [dim for dim in dims if dim in grown]
+        if not grown or shape is None: return
+
+        if self.dynamictitles is not None: self.dynamictitles.update()
+        slcs = self.slicetab.getSlices()
+        free = [dim for dim in grown if dim not in slcs]
+        if free:
+            # Data read ahead may not include the new records.
+            self.renderthread.prefetch(())
+        for dim in grown: self.slicetab.setLength(dim,shape[dims.index(dim)],jump=storename in self.shownewest)
+        if free and self.slicetab.getSlices()==slcs: self.figurepanel.figure.update()
+
     def addSliceSpec(self,varname,var,ignore=None,slices=None):
         """Appends a slice specification to the variable name, based on the
         selection in the slice widget.
         """
         if slices is None: slices = self.slicetab.getSlices()
-        if not slices: return varname
+        if not slices: return self.store.normalizeExpression(varname)
         if ignore is not None:
             for d in ignore: del slices[d]
-        if isinstance(var,xmlplot.expressions.VariableExpression):
-            # This is an expression that natively supports slicing:
-            # let the object itself handle it.
-            slicedvar = var[tuple([slices.get(dim,slice(None)) for dim in var.getDimensions()])]
-            return slicedvar.buildExpression()
-        else:
-            # This is a variable that does not natively support slicing:
-            # append a slice specification to the variable name.
-            slictexts = ','.join(map(str,[slices.get(dim,':') for dim in var.getDimensions()]))
-            return '%s[%s]' % (varname,slictexts)
+        return self.store.getSliceExpression(varname,slices)
 
+    @tracing.traced('redraw')
     def redraw(self,preserveproperties=True,preserveaxesbounds=True):
         """Redraws the currently selected variable.
         """
+        self.framestale = False
         varname = self.getSelectedVariable()
         if varname is None: return
 
@@ -1340,30 +2562,10 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         """
         dim = self.animation.dimension
         if slcs is None: slcs = self.slicetab.getSlices()
-        if isinstance(var,xmlplot.expressions.VariableExpression):
-            store = var.variables[0].store
-        else:
-            store = var.store
-        coordvariable = store.getVariable(dim)
-        if coordvariable is not None:
-            coorddims = list(coordvariable.getDimensions())
-            assert dim in coorddims, 'Coordinate variable %s does not use its own dimension (dimensions: %s).' % (dim,', '.join(coorddims))
-            coordslice = [slice(None)]*len(coorddims)
-            for icd,cd in enumerate(coorddims):
-                if cd in slcs: coordslice[icd] = slcs[cd]
-            meanval = coordvariable.getSlice(coordslice,dataonly=True).mean()
-
-            # Convert the coordinate value to a string
-            fmt = str(self.animation.editFormat.text())
-            try:
-                if var.getDimensionInfo(dim).get('datatype','float')=='datetime':
-                    return xmlplot.common.num2date(meanval).strftime(fmt)
-                else:
-                    if numpy.ma.getmask(meanval): meanval = numpy.nan
-                    return fmt % meanval
-            except:
-                raise
+        if self.dynamictitles is None or not self.dynamictitles.isValid(var,dim,slcs): self.dynamictitles = DynamicTitles(var,dim)
+        return self.dynamictitles.getTitle(slcs,str(self.animation.editFormat.text()))
 
+    @tracing.traced('set axes bounds')
     def setAxesBounds(self,dim=None):
         varname = self.getSelectedVariable()
         if varname is None: return
@@ -1388,13 +2590,8 @@ class VisualizeDialog(QtWidgets.QMainWindow):
             # This will serve as the base name/variable to which we apply slices.
             basevarname = self.store.normalizeExpression(varname)
             basevar = self.store.getExpression(basevarname)
-
-            # Get the variable name and variable with the start slice applied.
-            # The variable will have the number of dimensions of the slabs that will be taken.
-            varname = self.addSliceSpec(basevarname,basevar,slices=curslices)
-            var = self.store.getExpression(varname)
-            slabdims = var.getDimensions()
-            dim2length = dict(zip(slabdims,var.getShape()))
+            basedims = basevar.getDimensions()
+            slabdims = [d for d in basedims if d not in curslices]
 
             if dim is None:
                 # All dimensions that were set to a single index now need to be iterated over.
@@ -1403,57 +2600,44 @@ class VisualizeDialog(QtWidgets.QMainWindow):
                 # Only the selected dimension needs to be iterated over.
                 todoslices = [dim]
 
-            def iterdim(curslices,todoslices,progweight=1.,cumprog=0.):
-                if todoslices:
-                    # We have to iterate over at least one dimension more.
-                    curdim = todoslices[0]
-                    length = dim2length[curdim]
-                    vmin,vmax = [None]*(len(slabdims)+1),[None]*(len(slabdims)+1)
-                    newcurslices = dict(curslices)
-                    for i in range(length):
-                        #newcurslices[curdim] = '%i:%i' % (i,i+1)
-                        newcurslices[curdim] = slice(i,i+1)
-                        curmin,curmax = iterdim(newcurslices,todoslices[1:],progweight=progweight/length,cumprog=cumprog)
-                        for i in range(len(curmin)):
-                            if curmin[i] is not None and (vmin[i] is None or vmin[i]>curmin[i]): vmin[i] = curmin[i]
-                            if curmax[i] is not None and (vmax[i] is None or vmax[i]<curmax[i]): vmax[i] = curmax[i]
-                        cumprog += (1./length)*progweight
-                        progdialog.setValue(int(round(100*cumprog)))
-                    return vmin,vmax
-                else:
-                    # No iteration needed: just obtain the data using the current slice, and
-                    # read minimum and maximum values.
-                    curvarname = self.addSliceSpec(basevarname,basevar,slices=curslices)
-                    curvar = self.store.getExpression(curvarname)
-                    curvardata = curvar.getSlice([slice(None)]*len(slabdims))
-                    while isinstance(curvardata,(list,tuple)): curvardata = curvardata[0]
-                    vmin,vmax = [],[]
-                    for idim in range(len(slabdims)):
-                        vmin.append(curvardata.coords_stag[idim].min())
-                        vmax.append(curvardata.coords_stag[idim].max())
-                    datamin,datamax = None,None
-                    if not numpy.all(numpy.ma.getmask(curvardata.data)):
-                        datamin,datamax = curvardata.data.min(),curvardata.data.max()
-                    vmin.append(datamin)
-                    vmax.append(datamax)
-                    return vmin,vmax
+            # Get the name of the data dimension as used by the current plot.
+            # (this is based on the originally configured slice)
+            plottedvarname = self.addSliceSpec(basevarname,basevar,slices=slics)
+
+            # Determine which dimensions the axes need ranges for.
+            ismap = self.figurepanel.figure['Map'].getValue(usedefault=True)
+            axisdims = set()
+            for axisnode in self.figurepanel.figure['Axes'].children:
+                if axisnode.getSecondaryId() in 'xy' and ismap: continue
+                axisdims.update(axisnode['Dimensions'].getValue(usedefault=True).split(';'))
+            dims = [d for d in slabdims if d in axisdims]
+            if plottedvarname in axisdims: dims.append(None)
 
             # Find minimum and maximum or coordinates and values over selected dimensions.
-            vmin,vmax = iterdim(curslices,todoslices)
+            def progress(value):
+                progdialog.setValue(int(round(100*value)))
+            bounds = [curslices.get(d,slice(None)) for d in basedims]
+
+            # If all dimensions are iterated over, the range of values is that of the entire variable,
+            # which may be known from before. Variables with NaN values are examined slab by slab, as
+            # the outcome then depends on the order in which slabs are processed.
+            statistics = None
+            if dim is None and None in dims:
+                statistics = self.statistics.getStatistics(basevar,progress=progress)
+                if statistics is not None and statistics.nan==0:
+                    dims.remove(None)
+                else:
+                    statistics = None
+            vmin,vmax = getRange(basevar,bounds,todoslices,dims,progress)
+            if statistics is not None: vmin[-1],vmax[-1] = statistics.minimum,statistics.maximum
 
             # Show complete progress
             progdialog.setValue(100)
 
-            # Get the name of the data dimension as used by the current plot.
-            # (this is based on the originally configured slice)
-            plottedvarname = self.addSliceSpec(basevarname,basevar,slices=slics)
-            plottedvarname = self.store.normalizeExpression(plottedvarname)
-
             # Register that the last min/max value apply to the data dimension.
             minmaxdims = list(slabdims) + [plottedvarname]
 
             oldupdating = self.figurepanel.figure.setUpdating(False)
-            ismap = self.figurepanel.figure['Map'].getValue(usedefault=True)
             for axisnode in self.figurepanel.figure['Axes'].children:
                 # If we are dealing with a map, the x and y coordinates will change according to the selected
                 # projection. Therefore, the x and y bounds in the data are useless - skip these axes.
@@ -1503,68 +2687,112 @@ class VisualizeDialog(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.critical(self,'Too many slice dimensions selected','Before creating an animation you must first deselect at least %i slice dimensions. For the animation, 1 or 2 free (non-sliced) dimensions should remain.' % (1-nfree))
             return
 
-        # Get the directory to export PNG images to.
-        targetdir = u''.__class__(QtWidgets.QFileDialog.getExistingDirectory(self,'Select directory for still images'))
-        if targetdir=='': return
-
-        # Show wait cursor
-        QtWidgets.QApplication.setOverrideCursor(QtGui.QCursor(QtCore.Qt.CursorShape.WaitCursor))
+        if self.exporter is not None:
+            QtWidgets.QMessageBox.information(self,'Export in progress','Another animation is still being exported. Please wait until this has finished, or cancel it.')
+            return
 
         try:
-            # Get the slice selection, and the range across we will vary for the animation.
-            imin,imax = self.slicetab.getRange(dim)
-
-            sourcefigure = self.figurepanel.figure
+            from . import export,video
+        except ImportError:
+            import export,video
+
+        # Ask whether to create a video (or animated image), or separate still images.
+        box = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Icon.Question,'Export animation','Do you want to export the animation to a single video file, or as separate still images?',QtWidgets.QMessageBox.StandardButton.Cancel,self)
+        buttonVideo = box.addButton('Video file...',QtWidgets.QMessageBox.ButtonRole.AcceptRole)
+        buttonStills = box.addButton('Still images...',QtWidgets.QMessageBox.ButtonRole.AcceptRole)
+        box.setDefaultButton(buttonVideo)
+        box.exec()
+        if box.clickedButton() is buttonVideo:
+            # Get the path of the video file.
+            targetpath,filter = QtWidgets.QFileDialog.getSaveFileName(self,'Select video file','',';;'.join(video.getFileFilters()))
+            targetpath = u''.__class__(targetpath)
+            if targetpath=='': return
+            if not video.isVideoPath(targetpath):
+                QtWidgets.QMessageBox.critical(self,'Unsupported video format','"%s" does not have the extension of a supported video format or animated image.' % targetpath)
+                return
+            targetdir = None
+        elif box.clickedButton() is buttonStills:
+            # Get the directory to export PNG images to.
+            targetdir = u''.__class__(QtWidgets.QFileDialog.getExistingDirectory(self,'Select directory for still images'))
+            if targetdir=='': return
+        else:
+            return
 
-            # Create figure
-            fig = xmlplot.plot.Figure(defaultfont=sourcefigure.defaultproperties['Font/Family'].getValue())
-            fig.copyFrom(sourcefigure)
-            fig['Width'].setValue(sourcefigure['Width'].getValue(usedefault=True))
-            fig['Height'].setValue(sourcefigure['Height'].getValue(usedefault=True))
+        # Get the slice selection, and the range across we will vary for the animation.
+        imin,imax = self.slicetab.getRange(dim)
 
-            # Create progress dialog
-            dlgProgress = QtWidgets.QProgressDialog('Please wait while stills are generated.','Cancel',imin,imax,self,QtCore.Qt.WindowType.Dialog|QtCore.Qt.WindowType.WindowTitleHint)
-            dlgProgress.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
-            dlgProgress.setWindowTitle('Please wait...')
+        sourcefigure = self.figurepanel.figure
 
-            try:
-                oldseries = fig['Data/Series']
+        # Create template for filename, ensuring the right number of zeros
+        # is prefixed to each frame number.
+        nametemplate = '%%0%ii.png' % (1+math.floor(math.log10(imax)))
 
-                # Create template for filename, ensuring the right number of zeros
-                # is prefixed to each frame number.
-                nametemplate = '%%0%ii.png' % (1+math.floor(math.log10(imax)))
+        # Determine the expression, title and path of each frame.
+        frames = []
+        for i in range(imin,imax+1):
+            slics[dim] = i
+            curvarname = self.addSliceSpec(varname,var,slices=slics)
+            title = None
+            if self.animation.checkboxFormat.isChecked(): title = self.getDynamicTitle(var,slics)
+            frames.append((curvarname,title,None if targetdir is None else os.path.join(targetdir,nametemplate % i)))
 
-                # Create stills
-                for i in range(imin,imax+1):
-                    if dlgProgress.wasCanceled(): break
+        # Frames of a video are rendered to memory and streamed to the video file in order.
+        writer = None
+        if targetdir is None:
+            try:
+                writer = video.openWriter(targetpath,len(frames),self.animation.spinInterval.value())
+            except video.VideoError as e:
+                QtWidgets.QMessageBox.critical(self,'Unable to create video',u''.__class__(e))
+                return
 
-                    slics[dim] = i
-                    curvarname = self.addSliceSpec(varname,var,slices=slics)
-                    curvarname = fig.source.normalizeExpression(curvarname)
+        # Render the frames in worker processes, each of which opens the data sources itself.
+        sources = [(name,self.storepaths[name],store.maskoutsiderange,store.defaultcoordinates) for name,store in sourcefigure.source.children.items()]
+        self.exportspan = tracing.begin('export animation',frames=len(frames),video=writer is not None)
+        self.exporter = export.ParallelExport(sourcefigure,sources,frames,self.logicalDpiX(),netcdfmodule=xmlplot.data.netcdf.selectednetcdfmodule,writer=writer)
 
-                    if oldseries.getSecondaryId()!=curvarname:
-                        oldupdating = fig.setUpdating(False)
-                        newseries = fig.addVariable(curvarname)
-                        newseries.copyFrom(oldseries)
-                        fig['Data'].removeChildNode(oldseries)
-                        if self.animation.checkboxFormat.isChecked():
-                            fig['Title'].setValue(self.getDynamicTitle(var,slics))
-                        fig.setUpdating(oldupdating)
-                        oldseries = newseries
-
-                    path = os.path.join(targetdir,nametemplate % i)
-                    fig.exportToFile(path,dpi=self.logicalDpiX())
-
-                    dlgProgress.setValue(i)
-            finally:
-                # Make sure progress dialog is closed
-                dlgProgress.close()
-        finally:
-            # Restore original cursor
-            QtWidgets.QApplication.restoreOverrideCursor()
+        # Create progress dialog. It is not modal: the application remains usable during export.
+        if writer is None:
+            message,title = 'Please wait while stills are generated.','Exporting stills...'
+        else:
+            message,title = 'Please wait while the video is generated.','Exporting video...'
+        self.dlgExport = QtWidgets.QProgressDialog(message,'Cancel',0,len(frames),self,QtCore.Qt.WindowType.Dialog|QtCore.Qt.WindowType.WindowTitleHint)
+        self.dlgExport.setWindowTitle(title)
+        self.dlgExport.setAutoClose(False)
+        self.dlgExport.setAutoReset(False)
+        self.dlgExport.setMinimumDuration(0)
+        self.dlgExport.setValue(0)
+        self.exporttimer = QtCore.QTimer(self)
+        self.exporttimer.timeout.connect(self.onExportProgress)
+        self.exporttimer.start(200)
+
+    def onExportProgress(self):
+        """Called periodically while an animation is exported, to update
+        the progress dialog and finish up when all frames are done.
+        """
+        exporter = self.exporter
+        error = exporter.getError()
+        if not exporter.cancelled and (error is not None or self.dlgExport.wasCanceled()): exporter.cancel()
+        if not exporter.isDone():
+            if not exporter.cancelled: self.dlgExport.setValue(exporter.getProgress())
+            return
+        self.exporttimer.stop()
+        self.exporttimer.deleteLater()
+        self.dlgExport.close()
+        self.dlgExport.deleteLater()
+        self.exporter = None
+        try:
+            exporter.close()
+        except Exception as e:
+            error = e
+        self.exportspan.end(cancelled=exporter.cancelled)
+        self.exportspan = None
+        if error is not None:
+            QtWidgets.QMessageBox.critical(self,'Error exporting animation','The animation could not be exported.\nReason: %s' % error)
 
-    def onSelectionChanged(self):
+    def onSelectionChanged(self,selected=None,deselected=None):
         if not self.allowupdates: return
+        self.renderexpression = None
+        self.renderthread.prefetch(())
 
         varname = self.getSelectedVariable()
         if varname is None:
@@ -1594,9 +2822,9 @@ class VisualizeDialog(QtWidgets.QMainWindow):
 
         self.figurepanel.figure.setUpdating(oldupdating)
 
-    def onVarDoubleClicked(self,item,column):
-        if item.parent() is not self.expressionroot: return
-        self.editExpression(item)
+    def onVarDoubleClicked(self,index):
+        if not self.treemodel.isExpression(index): return
+        self.editExpression(index)
 
     def onAnimation(self,dlg):
         if self.animation is None and dlg is not None:
@@ -1608,6 +2836,11 @@ class VisualizeDialog(QtWidgets.QMainWindow):
             else:
                 dlg.editFormat.setText(diminfo['label']+': %.4f')
 
+            # Read the coordinates for the frame titles now, rather than for every frame.
+            self.dynamictitles = DynamicTitles(var,dlg.dimension)
+        elif dlg is None:
+            self.dynamictitles = None
+
         self.animation = dlg
         oldupdating = self.figurepanel.figure.setUpdating(False)
         if self.animatedtitle and (dlg is None or not dlg.checkboxFormat.isChecked()):
@@ -1616,11 +2849,11 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         self.onSliceChanged(False)
         self.figurepanel.figure.setUpdating(oldupdating)
 
-    def editExpression(self,item=None):
+    def editExpression(self,index=None):
         dlg = BuildExpressionDialog(self,variables=self.store.getVariableLongNames(alllevels=True))
 
-        if item is not None:
-            expression = item.data(0,QtCore.Qt.ItemDataRole.UserRole)
+        if index is not None:
+            expression = index.data(QtCore.Qt.ItemDataRole.UserRole)
             dlg.edit.setText(expression)
 
         valid = False
@@ -1634,28 +2867,34 @@ class VisualizeDialog(QtWidgets.QMainWindow):
                 QtWidgets.QMessageBox.critical(self,'Unable to parse expression',str(e))
                 dlg.edit.selectAll()
 
-        if item is None:
-            if self.expressionroot is None:
-                self.expressionroot = QtWidgets.QTreeWidgetItem(['expressions'],QtWidgets.QTreeWidgetItem.ItemType.Type)
-                self.tree.addTopLevelItem(self.expressionroot)
-            item = QtWidgets.QTreeWidgetItem(QtWidgets.QTreeWidgetItem.ItemType.Type)
-            self.expressionroot.addChild(item)
-        item.setData(0,QtCore.Qt.ItemDataRole.DisplayRole,expression)
-        item.setData(0,QtCore.Qt.ItemDataRole.UserRole,expression)
+        if index is None:
+            index = self.treemodel.addExpression(expression)
+        else:
+            self.treemodel.setExpression(index,expression)
 
-        if not item.isSelected():
+        if not self.tree.selectionModel().isSelected(index):
             self.allowupdates = False
-            self.tree.clearSelection()
-            item.setSelected(True)
+            self.tree.setCurrentIndex(index)
             self.allowupdates = True
         self.onSelectionChanged()
 
-        par = item.parent()
-        while par is not None:
-            par.setExpanded(True)
+        par = index.parent()
+        while par.isValid():
+            self.tree.expand(par)
             par = par.parent()
 
     def closeEvent(self,event):
+        self.renderthread.stop()
+        if self.exporter is not None:
+            self.exporter.cancel()
+            self.exportspan.end(cancelled=True)
+            self.exportspan = tracing.nullspan
+
+        # Threads that are opening files cannot be interrupted; wait for them to finish.
+        for loader in self.loaders:
+            loader.cancelled = True
+            loader.wait()
+
         rct = self.geometry()
         x,y,w,h = rct.left(),rct.top(),rct.width(),rct.height()
         self.settings['WindowPosition/Maximized'].setValue(self.isMaximized())
@@ -1664,7 +2903,7 @@ class VisualizeDialog(QtWidgets.QMainWindow):
         self.settings['WindowPosition/Width'].setValue(w)
         self.settings['WindowPosition/Height'].setValue(h)
 
-def start(args):
+def start(args,splash=None,report=None):
     if args.nc is not None:
         if xmlplot.data.netcdf.selectednetcdfmodule is None: xmlplot.data.netcdf.chooseNetCDFModule()
         for xmlplot.data.netcdf.selectednetcdfmodule,(m,v) in enumerate(xmlplot.data.netcdf.netcdfmodules):
@@ -1690,8 +2929,30 @@ def start(args):
         except:
             pass
 
+    # Trace the stages of each frame if requested (see the tracing module).
+    if args.trace is not None: tracing.setEnabled(True)
+
     # Create main dialog.
     dialog = VisualizeDialog()
+    if args.trace is not None: dialog.setFrameTimingVisible(True)
+    if report is not None: report.mark('create main window')
+
+    # Open files handed over by instances started later, if requested.
+    if args.single_instance:
+        try:
+            from . import instance
+        except ImportError:
+            import instance
+        server = instance.Server(dialog)
+        server.received.connect(dialog.onPathsReceived)
+
+    # Show dialog before files are opened, so it appears as soon as possible.
+    dialog.show()
+    if splash is not None: splash.finish(dialog)
+    app.processEvents()
+    if report is not None:
+        report.mark('show main window')
+        report.write()
 
     # Open files provided on the command line (if any).
     for path in args.path:
@@ -1700,11 +2961,9 @@ def start(args):
         except Exception as e:
             print('Error: %s' % e)
 
-    # Show dialog
-    dialog.show()
-
     # Redirect expections to Qt-based dialog.
     if not args.debug:
+        import xmlplot.errortrap
         xmlplot.errortrap.redirect_stderr('PyNcView','You may be able to continue working. However, we would appreciate it if you report this error. To do so, post a message to <a href="https://github.com/BoldingBruggeman/pyncview/issues">the PyNcView issue tracker</a> with the above error message, and the circumstances under which the error occurred.')
 
     # Start application message loop
@@ -1713,34 +2972,22 @@ def start(args):
     # Save persistent program settings.    
     dialog.settings.save()
 
+    # Save the trace of the session, if requested.
+    if args.trace is not None:
+        try:
+            tracing.save(args.trace)
+        except (IOError,OSError) as e:
+            print('Unable to save trace to %s: %s' % (args.trace,e))
+
     return ret
 
 def main():
-    # Parse command line options
-    parser = argparse.ArgumentParser(description="""This utility may be used to visualize the
-contents of a NetCDF file.
-""")
-    parser.add_argument('-v', '--version', action='store_true', help='show program\'s version number and exit')
-    parser.add_argument('--nc', help='NetCDF module to use')
-    parser.add_argument('-p','--profile', help='activates profiling, saving to the supplied path.')
-    parser.add_argument('-d','--debug',action='store_true',help='Send exceptions to stderr')
-    parser.add_argument('path', nargs='*', help='Path or URL to open')
-    args = parser.parse_args(get_argv()[1:])
-    if args.version:
-        printVersion()
-    elif args.profile is not None:
-        # We will do profiling
-        import cProfile
-        import pstats
-        cProfile.run('start(args)', args.profile)
-        p = pstats.Stats(args.profile)
-        p.strip_dirs().sort_stats('cumulative').print_stats()
-    else:
-        # Just enter the main loop
-        ret = start(args)
-
-    # Exit
-    sys.exit(ret)
+    # The command line is parsed by the light-weight entry point, which imports this module only when needed.
+    try:
+        from . import startup
+    except ImportError:
+        import startup
+    startup.main(sys.modules[__name__])
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,93 @@
+"""Slices of expressions that read only the slab that is shown.
+
+A slice of an expression (e.g., sqrt(u**2+v**2) at a single time and depth)
+is built by pushing the selected indices down the expression tree to each
+variable it reads, before any arithmetic is done. Indices are matched to the
+dimensions of each variable by name. Functions that remove a dimension
+(mean, sum, etc.) receive the slice of their argument, with their axis
+adjusted for the dimensions that the slice removes. The data read and
+processed is thus limited to the slab that is plotted, whatever the size of
+the variables in the expression. A slice of a slice (e.g., of an expression
+that is sliced already) is combined with it into a single slice.
+
+Where a node in the expression cannot be handled this way (e.g., a function
+that reduces over all dimensions, or a slice with computed indices), the
+slice is applied to the result of that node instead.
+"""
+
+import copy
+
+import xmlplot.common,xmlplot.expressions
+
+def sliceExpression(var,slices):
+    """Returns a VariableExpression for a slice (dictionary of dimension
+    names and indices) of a variable or expression."""
+    if isinstance(var,xmlplot.expressions.VariableExpression):
+        roots = var.root
+    else:
+        # A variable taken directly from a store: wrap it as done when parsing.
+        lazyvar = xmlplot.expressions.LazyVariable(var)
+        lazyvar.name = var.namespacename
+        roots = [lazyvar]
+    return xmlplot.expressions.VariableExpression([pushSlices(node,slices) for node in roots])
+
+def pushSlices(node,slices):
+    """Returns an expression node that takes the specified slice (dictionary
+    of dimension names and indices) of the given node, with the slice applied
+    as close as possible to the variables that are read."""
+    if not isinstance(node,xmlplot.expressions.LazyExpression): return node
+    dims = list(node.getDimensions())
+    slices = dict([(dim,index) for dim,index in slices.items() if dim in dims])
+    if not slices: return node
+
+    if isinstance(node,xmlplot.expressions.LazyVariable):
+        # Dimensions with length 1 are broadcast against the other arguments: take their only index.
+        shape = node.getShape()
+        indices = []
+        for i,dim in enumerate(dims):
+            index = slices.get(dim,slice(None))
+            if shape is not None and shape[i]==1 and not isinstance(index,slice): index = 0
+            indices.append(index)
+        return xmlplot.expressions.LazySlice(node,tuple(indices))
+
+    if isinstance(node,xmlplot.expressions.LazySlice) and node.canprocessslice:
+        # A slice of a slice: combine the indices, and push them down to the sliced node.
+        # (xmlplot can combine slices itself, but then miscalculates the end of a range
+        # that does not start at the first index.)
+        argdims = list(node.args[0].getDimensions())
+        combined = {}
+        for dim,base,length in zip(argdims,xmlplot.common.processEllipsis(node.slice,len(argdims)),node.args[0].getShape()):
+            if isinstance(base,slice) and dim in slices:
+                index = range(*base.indices(length))[slices[dim]]
+                if isinstance(index,range): index = slice(index.start,None if index.stop<0 else index.stop,None if index.step==1 else index.step)
+                base = index
+            combined[dim] = base
+        return pushSlices(node.args[0],combined)
+
+    if isinstance(node,xmlplot.expressions.LazyOperator) or (type(node) is xmlplot.expressions.LazyFunction and not node.useslices):
+        removedim = getattr(node,'removedim',None)
+        if removedim is None:
+            newnode = copy.copy(node)
+            newnode.args = tuple([pushSlices(arg,slices) for arg in node.args])
+            newnode.kwargs = dict([(name,pushSlices(arg,slices)) for name,arg in node.kwargs.items()])
+            return newnode
+        elif removedim>=0 and node.args and isinstance(node.args[0],xmlplot.expressions.LazyExpression):
+            # Function that removes a dimension from its first argument, specified
+            # by an "axis" argument. Indices in front of that dimension remove
+            # dimensions too, so the axis shifts accordingly.
+            argdims = list(node.args[0].getDimensions())
+            newaxis = removedim-len([dim for dim in argdims[:removedim] if dim in slices])
+            newnode = copy.copy(node)
+            args = [pushSlices(arg,slices) for arg in node.args]
+            kwargs = dict([(name,pushSlices(arg,slices)) for name,arg in node.kwargs.items()])
+            if 'axis' in kwargs:
+                kwargs['axis'] = newaxis
+            elif len(args)>1:
+                args[1] = newaxis
+            else:
+                return node[tuple([slices.get(dim,slice(None)) for dim in dims])]
+            newnode.args,newnode.kwargs,newnode.removedim = args,kwargs,newaxis
+            return newnode
+
+    # Any other node: slice its result.
+    return node[tuple([slices.get(dim,slice(None)) for dim in dims])]
@@ -0,0 +1,189 @@
+"""Entry point of PyNcView, kept light so that the program starts quickly.
+
+Importing the main module (pyncview.pyncview) loads Qt, matplotlib and
+xmlplot. On a cold start, e.g., from a network drive, that takes seconds.
+The command line is therefore parsed before any of these is imported, and
+options that need none of them (--version) are handled without them.
+Otherwise, Qt is loaded first, and a splash screen is shown while the
+plotting modules are imported and the main window is built. Modules that
+only some features need (e.g., h5py, basemap, numexpr, and the PyNcView
+modules for export and for opening files) are imported on first use.
+
+With --startup-report, the time taken by each stage of startup is written
+to stderr, in the format of "python -X importtime" (microseconds spent in the
+stage, and since the start), so that regressions in startup time are easily
+spotted. For the imports within a stage, run python -X importtime.
+"""
+
+import sys,os,argparse,importlib,time
+
+if not hasattr(sys,'frozen'):
+    # Auto-discover xmlstore and xmlplot in bbpy directory structure (before Qt is imported through xmlstore)
+    rootdir = os.path.dirname(os.path.realpath(__file__))
+    if os.path.isdir(os.path.join(rootdir, '../../xmlstore/xmlstore')):
+        print('Detected that we are running from BBpy source. Using local xmlstore/xmlplot.')
+        sys.path.insert(0, os.path.join(rootdir, '../../xmlstore'))
+        sys.path.insert(0, os.path.join(rootdir, '../../xmlplot'))
+else:
+    rootdir = os.path.dirname(sys.executable)
+
+class StartupReport(object):
+    """Times the stages of startup."""
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+
+    def mark(self,stage):
+        """Ends the current stage, which is given the specified name."""
+        now = time.perf_counter()
+        self.stages.append((stage,now-self.last,now-self.start))
+        self.last = now
+
+    def write(self,f=None):
+        if f is None: f = sys.stderr
+        f.write('startup time: self [us] | cumulative | stage\n')
+        for stage,duration,elapsed in self.stages:
+            f.write('startup time: %9i | %10i | %s\n' % (duration*1e6,elapsed*1e6,stage))
+        f.flush()
+
+def getVersions():
+    """Returns the versions of Python, PyNcView and the packages it uses,
+    as far as they are installed. No packages are imported."""
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        metadata = None
+    versions = [('Python','%i.%i.%i %s %i' % tuple(sys.version_info))]
+    for name in ('pyncview','xmlplot','xmlstore','numpy','matplotlib','netCDF4','PySide6','PyQt6','PySide2','PyQt5','basemap','h5py','numexpr'):
+        try:
+            versions.append((name,metadata.version(name)))
+        except Exception:
+            pass
+    return versions
+
+def printVersion():
+    for n,v in getVersions():
+        print('%s: %s' % (n,v))
+
+def get_argv():
+    """Uses shell32.GetCommandLineArgvW to get sys.argv as a list of Unicode
+    strings.
+
+    Versions 2.x of Python don't support Unicode in sys.argv on
+    Windows, with the underlying Windows API instead replacing multi-byte
+    characters with '?'.
+    
+    Taken from http://code.activestate.com/recipes/572200/
+    """
+    if sys.platform=='win32':
+        try:
+            from ctypes import POINTER, byref, cdll, c_int, windll
+            from ctypes.wintypes import LPCWSTR, LPWSTR
+
+            GetCommandLineW = cdll.kernel32.GetCommandLineW
+            GetCommandLineW.argtypes = []
+            GetCommandLineW.restype = LPCWSTR
+
+            CommandLineToArgvW = windll.shell32.CommandLineToArgvW
+            CommandLineToArgvW.argtypes = [LPCWSTR, POINTER(c_int)]
+            CommandLineToArgvW.restype = POINTER(LPWSTR)
+
+            cmd = GetCommandLineW()
+            argc = c_int(0)
+            argv = CommandLineToArgvW(cmd, byref(argc))
+            if argc.value > 0:
+                # Remove Python executable and commands if present
+                start = argc.value - len(sys.argv)
+                return [argv[i] for i in range(start, argc.value)]
+        except:
+            pass
+    args = []
+    for arg in sys.argv:
+        try:
+            arg = arg.decode(sys.getfilesystemencoding())
+        except:
+            pass
+        args.append(arg)
+    return args
+
+def importMain():
+    """Imports the main module of PyNcView, and returns it."""
+    if __package__:
+        return importlib.import_module('.pyncview',__package__)
+    return importlib.import_module('pyncview')
+
+def main(module=None):
+    """Runs PyNcView with the options on the command line. If the main module
+    has been imported already, it may be provided."""
+    # In frozen builds, worker processes (see the export module) are started by
+    # running this entry point; freeze_support then runs the worker instead.
+    if hasattr(sys,'frozen'):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
+    # Parse command line options
+    parser = argparse.ArgumentParser(description="""This utility may be used to visualize the
+contents of a NetCDF file.
+""")
+    parser.add_argument('-v', '--version', action='store_true', help='show program\'s version number and exit')
+    parser.add_argument('--nc', help='NetCDF module to use')
+    parser.add_argument('-p','--profile', help='activates profiling, saving to the supplied path.')
+    parser.add_argument('-d','--debug',action='store_true',help='Send exceptions to stderr')
+    parser.add_argument('--trace', help='traces the stages of drawing each frame, saving them as a Chrome trace (JSON) to the supplied path.')
+    parser.add_argument('-s','--single-instance',action='store_true',help='open the files in the PyNcView instance started with this option, if running')
+    parser.add_argument('--startup-report',action='store_true',help='write the time taken by each stage of startup to stderr')
+    parser.add_argument('path', nargs='*', help='Path or URL to open')
+
+    report = StartupReport()
+    args = parser.parse_args(get_argv()[1:])
+    if args.version:
+        printVersion()
+        sys.exit(0)
+    report.mark('parse command line')
+
+    if args.single_instance:
+        # Hand the files over to the running instance, if any (see the instance module).
+        try:
+            from . import instance
+        except ImportError:
+            import instance
+        if instance.sendPaths(args.path): sys.exit(0)
+        report.mark('contact running instance')
+
+    # Show a splash screen while the plotting modules are imported and the main window is built.
+    from xmlstore.qt_compat import QtCore,QtGui,QtWidgets
+    report.mark('import Qt')
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([' '])
+        app.lastWindowClosed.connect(app.quit)
+    splash = QtWidgets.QSplashScreen(QtGui.QPixmap(os.path.join(rootdir,'pyncview.png')))
+    splash.show()
+    splash.showMessage('Loading PyNcView...',QtCore.Qt.AlignmentFlag.AlignBottom|QtCore.Qt.AlignmentFlag.AlignHCenter)
+    app.processEvents()
+    report.mark('show splash screen')
+
+    if module is None:
+        import matplotlib
+        report.mark('import matplotlib')
+        module = importMain()
+        report.mark('import xmlplot and PyNcView')
+
+    if not args.startup_report: report = None
+    if args.profile is not None:
+        # We will do profiling
+        import cProfile
+        import pstats
+        cProfile.runctx('module.start(args,splash=splash,report=report)', globals(), locals(), args.profile)
+        p = pstats.Stats(args.profile)
+        p.strip_dirs().sort_stats('cumulative').print_stats()
+        ret = 0
+    else:
+        # Just enter the main loop
+        ret = module.start(args,splash=splash,report=report)
+
+    # Exit
+    sys.exit(ret)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Timing of the stages of showing a frame, for finding out why drawing is slow.
+
+Spans (named intervals of time) are placed around the stages of showing a
+frame: reading a slice (with expression evaluation and masking), reads from
+NetCDF variables, building the figure (which includes map projection),
+rendering it with Agg, and the operations that trigger these (e.g., redraw).
+Spans nest; reads by the background thread appear on their own track.
+Exports of animations, which run in the background, are spanned from start
+to finish.
+
+When tracing is enabled, every span is recorded as a "complete" event of the
+Chrome trace event format; save writes them to a JSON file that can be
+viewed with chrome://tracing or https://ui.perfetto.dev. When tracing is
+disabled (the default), span returns a shared object that does nothing, so
+that the spans cost no more than a function call.
+
+Independently, a FrameCounter keeps the duration of the last frame shown and
+the rate at which frames are shown, for display while the user animates.
+"""
+
+import os,json,time,threading,functools,collections
+
+# Whether spans are recorded.
+enabled = False
+
+# Maximum number of events recorded; later events are counted, but dropped.
+maxevents = 1000000
+
+events = []
+threadnames = {}
+dropped = 0
+origin = time.perf_counter()
+
+class Span(object):
+    """An interval of time, recorded as an event when it ends."""
+    def __init__(self,name,args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc_info):
+        global dropped
+        end = time.perf_counter()
+        if len(events)>=maxevents:
+            dropped += 1
+            return
+        tid = threading.get_ident()
+        if tid not in threadnames: threadnames[tid] = threading.current_thread().name
+        event = {'name':self.name,'ph':'X','ts':(self.start-origin)*1e6,'dur':(end-self.start)*1e6,'pid':os.getpid(),'tid':tid}
+        if self.args: event['args'] = self.args
+        events.append(event)
+
+    def end(self,**args):
+        """Ends a span started with begin, adding the specified arguments."""
+        if args: self.args = dict(self.args or {},**args)
+        self.__exit__(None,None,None)
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        pass
+
+    def end(self,**args):
+        pass
+
+nullspan = NullSpan()
+
+def span(name,**args):
+    """Returns a context manager that records the time spent within it as
+    an event with the specified name (and arguments), if tracing is enabled."""
+    if not enabled: return nullspan
+    return Span(name,args)
+
+def begin(name,**args):
+    """Starts a span that lasts until its end method is called, for intervals
+    that do not fit in a with statement (e.g., work that continues after the
+    function that started it returns)."""
+    return span(name,**args).__enter__()
+
+def traced(name):
+    """Returns a decorator that records each call to a function as a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            if not enabled: return function(*args,**kwargs)
+            with Span(name,None):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def setEnabled(value):
+    """Enables or disables the recording of spans."""
+    global enabled
+    enabled = value
+
+def save(path):
+    """Saves the recorded events as a trace in Chrome trace event format."""
+    pid = os.getpid()
+    metadata = [{'name':'process_name','ph':'M','pid':pid,'tid':0,'args':{'name':'PyNcView'}}]
+    metadata += [{'name':'thread_name','ph':'M','pid':pid,'tid':tid,'args':{'name':name}} for tid,name in list(threadnames.items())]
+    with open(path,'w') as f:
+        json.dump({'traceEvents':metadata+list(events),'displayTimeUnit':'ms','otherData':{'droppedEvents':dropped}},f)
+
+class FrameCounter(object):
+    """Keeps the duration of the last frame shown, and the times at which
+    frames were shown during the specified period (in seconds), from which
+    the frame rate is computed."""
+    def __init__(self,period=2.):
+        self.period = period
+        self.duration = None
+        self.times = collections.deque()
+
+    def add(self,duration):
+        """Registers that a frame was shown, after taking the specified time
+        (in seconds) to produce."""
+        now = time.perf_counter()
+        self.duration = duration
+        self.times.append(now)
+        while self.times[0]<now-self.period: self.times.popleft()
+
+    def getRate(self):
+        """Returns the number of frames shown per second during the last
+        period, or None if fewer than two frames were shown."""
+        if len(self.times)<2 or self.times[-1]<time.perf_counter()-self.period: return None
+        return (len(self.times)-1)/max(self.times[-1]-self.times[0],1e-6)
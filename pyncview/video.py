@@ -0,0 +1,208 @@
+"""Direct export of animations to video files and animated images.
+
+Frames are taken from the Agg buffer of a figure as RGB arrays and streamed
+to the output file without intermediate still images. MP4, WebM and MKV
+files are encoded by an ffmpeg process that reads frames from a pipe;
+animated PNG files are written directly, and animated GIF files are written
+with Pillow.
+"""
+
+import os,struct,zlib,shutil,subprocess
+
+import numpy
+
+class VideoError(Exception):
+    pass
+
+ffmpegformats = {'.mp4': ['-c:v','libx264','-crf','18','-pix_fmt','yuv420p'],
+                 '.mkv': ['-c:v','libx264','-crf','18','-pix_fmt','yuv420p'],
+                 '.webm':['-c:v','libvpx-vp9','-b:v','0','-crf','30','-pix_fmt','yuv420p']}
+imageformats = ('.png','.apng','.gif')
+
+def getFFmpeg():
+    """Returns the path to the ffmpeg executable, or None if it is not available."""
+    return os.environ.get('PYNCVIEW_FFMPEG') or shutil.which('ffmpeg')
+
+def isVideoPath(path):
+    """Returns whether the extension of a path is that of a supported video or animated image format."""
+    ext = os.path.splitext(path)[1].lower()
+    return ext in ffmpegformats or ext in imageformats
+
+def getFileFilters():
+    """Returns filters for a file dialog, listing the video and animated
+    image formats that can currently be written."""
+    filters = []
+    if getFFmpeg() is not None:
+        filters += ['MP4 video (*.mp4)','WebM video (*.webm)','Matroska video (*.mkv)']
+    filters += ['Animated PNG (*.png *.apng)','Animated GIF (*.gif)']
+    return filters
+
+def renderFrame(figure,dpi):
+    """Draws an xmlplot figure at the specified resolution and returns the
+    image as an array of RGB values (rows x columns x 3). The result is
+    equivalent to exporting the figure to a PNG file."""
+    mplfigure = figure.figure
+    olddpi,oldface,oldedge = mplfigure.get_dpi(),mplfigure.get_facecolor(),mplfigure.get_edgecolor()
+    mplfigure.set_dpi(dpi)
+    mplfigure.set_facecolor('w')
+    mplfigure.set_edgecolor('w')
+    try:
+        canvas = mplfigure.canvas
+        canvas.draw()
+        image = numpy.array(numpy.asarray(canvas.buffer_rgba())[:,:,:3])
+    finally:
+        mplfigure.set_dpi(olddpi)
+        mplfigure.set_facecolor(oldface)
+        mplfigure.set_edgecolor(oldedge)
+    return image
+
+def openWriter(path,framecount,fps=24):
+    """Creates a writer for the video or animated image at the specified path,
+    based on its extension. The number of frames must be known up front."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ffmpegformats:
+        ffmpeg = getFFmpeg()
+        if ffmpeg is None: raise VideoError('Cannot create "%s": encoding %s video requires ffmpeg, which was not found. Install ffmpeg, or export to an animated PNG or GIF file instead.' % (path,ext[1:].upper()))
+        return FFmpegWriter(path,fps,ffmpeg,ffmpegformats[ext])
+    elif ext in ('.png','.apng'):
+        return APNGWriter(path,framecount,fps)
+    elif ext=='.gif':
+        return GIFWriter(path,fps)
+    raise VideoError('Cannot create "%s": unknown video format "%s". Supported extensions: %s.' % (path,ext,', '.join(sorted(ffmpegformats)+list(imageformats))))
+
+class Writer(object):
+    """Base class for writers. Frames are RGB arrays that all have the same
+    shape. After the last frame, close must be called; abort discards a
+    partially written file."""
+    def __init__(self,path,fps):
+        self.path = path
+        self.fps = fps
+        self.shape = None
+        self.count = 0
+
+    def write(self,image):
+        if self.shape is None:
+            self.shape = image.shape
+        elif image.shape!=self.shape:
+            raise VideoError('Frame %i has size %i x %i, but previous frames were %i x %i.' % (self.count,image.shape[1],image.shape[0],self.shape[1],self.shape[0]))
+        self.writeFrame(image)
+        self.count += 1
+
+    def writeFrame(self,image):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def abort(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class FFmpegWriter(Writer):
+    """Streams raw frames to an ffmpeg process that encodes the video."""
+    def __init__(self,path,fps,ffmpeg,codecargs):
+        Writer.__init__(self,path,fps)
+        self.ffmpeg = ffmpeg
+        self.codecargs = codecargs
+        self.process = None
+
+    def writeFrame(self,image):
+        if self.process is None:
+            # Common codecs require even dimensions; pad with white where needed.
+            args = [self.ffmpeg,'-y','-loglevel','error',
+                    '-f','rawvideo','-pix_fmt','rgb24','-s','%ix%i' % (image.shape[1],image.shape[0]),'-r',str(self.fps),'-i','-',
+                    '-vf','pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white']+self.codecargs+[self.path]
+            self.process = subprocess.Popen(args,stdin=subprocess.PIPE,stderr=subprocess.PIPE)
+        try:
+            self.process.stdin.write(numpy.ascontiguousarray(image).tobytes())
+        except (IOError,OSError):
+            self.process.stdin = None
+            raise VideoError('ffmpeg failed: %s' % self.process.communicate()[1].decode('utf-8','replace').strip())
+
+    def close(self):
+        if self.process is None: return
+        stderr = self.process.communicate()[1]
+        if self.process.returncode!=0:
+            raise VideoError('ffmpeg failed: %s' % stderr.decode('utf-8','replace').strip())
+
+    def abort(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.communicate()
+        Writer.abort(self)
+
+class APNGWriter(Writer):
+    """Writes an animated PNG file frame by frame. Frames are compressed and
+    written to disk as they arrive, so memory use does not grow with the
+    length of the animation."""
+    def __init__(self,path,framecount,fps):
+        Writer.__init__(self,path,fps)
+        self.framecount = framecount
+        self.sequence = 0
+        self.f = None
+
+    def writeChunk(self,chunktype,data):
+        self.f.write(struct.pack('>I',len(data)))
+        self.f.write(chunktype)
+        self.f.write(data)
+        self.f.write(struct.pack('>I',zlib.crc32(chunktype+data) & 0xffffffff))
+
+    def writeFrame(self,image):
+        height,width = image.shape[:2]
+        if self.f is None:
+            self.f = open(self.path,'wb')
+            self.f.write(b'\x89PNG\r\n\x1a\n')
+            self.writeChunk(b'IHDR',struct.pack('>IIBBBBB',width,height,8,2,0,0,0))
+            self.writeChunk(b'acTL',struct.pack('>II',self.framecount,0))
+
+        # Apply the "up" filter (difference with the previous row) to all rows, which compresses well for plots.
+        rows = numpy.ascontiguousarray(image).reshape(height,width*3)
+        filtered = numpy.empty((height,width*3+1),dtype=numpy.uint8)
+        filtered[:,0] = 2
+        filtered[:,1:] = rows
+        filtered[1:,1:] -= rows[:-1]
+        data = zlib.compress(filtered.tobytes(),6)
+
+        self.writeChunk(b'fcTL',struct.pack('>IIIIIHHBB',self.sequence,width,height,0,0,1,int(self.fps),0,0))
+        self.sequence += 1
+        if self.count==0:
+            self.writeChunk(b'IDAT',data)
+        else:
+            self.writeChunk(b'fdAT',struct.pack('>I',self.sequence)+data)
+            self.sequence += 1
+
+    def close(self):
+        if self.f is None: return
+        self.writeChunk(b'IEND',b'')
+        self.f.close()
+        self.f = None
+        if self.count!=self.framecount: raise VideoError('Animated PNG "%s" was declared to contain %i frames, but %i were written.' % (self.path,self.framecount,self.count))
+
+    def abort(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        Writer.abort(self)
+
+class GIFWriter(Writer):
+    """Writes an animated GIF file with Pillow. The GIF format needs a
+    palette per frame, and Pillow writes all frames at once, so frames are
+    kept in memory (as 8-bit paletted images) until the file is closed."""
+    def __init__(self,path,fps):
+        Writer.__init__(self,path,fps)
+        self.frames = []
+
+    def writeFrame(self,image):
+        import PIL.Image
+        self.frames.append(PIL.Image.fromarray(image,'RGB').quantize(256))
+
+    def close(self):
+        if not self.frames: return
+        self.frames[0].save(self.path,save_all=True,append_images=self.frames[1:],duration=int(round(1000./self.fps)),loop=0)
+        self.frames = []
+
+    def abort(self):
+        self.frames = []
+        Writer.abort(self)
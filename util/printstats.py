@@ -23,11 +23,12 @@ either the environment variable GOTMDIR must be set, pointing to a
 directory that in turn contains the gui.py directory. Alternatively, the
 environment variable GOTMGUIDIR may be set, pointing to the GOTM-GUI root
 (normally gui.py).""")
-parser.set_defaults(quiet=False,percentiles=False,maxslab=1000000,sources=[])
+parser.set_defaults(quiet=False,percentiles=False,maxslab=1000000,chunkcache=256,sources=[])
 parser.add_option('-s', dest='sources', action='append',metavar='[SOURCENAME=]NCPATH', help='path to a NetCDF file from which variables will be used.')
 parser.add_option('-q', '--quiet', action='store_true', help='suppress output of progress messages')
 parser.add_option('-p', '--percentiles', action='store_true', help='whether to list percentiles in addition to mean, sd, min, max')
 parser.add_option('--maxslab', type='int', help='maximum number of data point to keep in memory (default = 1000000)')
+parser.add_option('--chunkcache', type='int', help='maximum memory for decompressed chunks of each NetCDF-4 variable in MB (default = 256)')
 options,args = parser.parse_args()
 
 assert len(options.sources)>0,'You must specify at least one NetCDF file with the -s switch.'
@@ -58,6 +59,14 @@ except ImportError as e:
     print('Unable to import GOTM-GUI libraries (%s). Please ensure that environment variable GOTMDIR or GOTMGUIDIR is set.' % e)
     sys.exit(1)
 
+# If PyNcView is available, read through its cache of decompressed chunks, so that
+# iterating over a dimension does not decompress chunks that span multiple slabs repeatedly.
+try:
+    from pyncview import ncio,chunks
+    chunks.setMaximumSize(options.chunkcache*1024*1024)
+except ImportError:
+    ncio = None
+
 # -------------------------------------------------------------------
 # Actual code.
 # -------------------------------------------------------------------
@@ -78,6 +87,7 @@ for info in options.sources:
     if not options.quiet:
         print('Opening "%s".' % path)
     res = xmlplot.data.NetCDFStore.loadUnknownConvention(path)
+    if ncio is not None: ncio.protect(res)
     store.addChild(res,sourcename)
     if firstsource is None: firstsource = sourcename
     sourcecount += 1
@@ -178,3 +188,7 @@ if options.percentiles:
     printfn( '75th percentile = %g%s' % (getPercentile(.75),unit))
     printfn( '97.5th percentile = %g%s' % (getPercentile(.975),unit))
 printfn( 'Maximum = %g%s' % (max,unit))
+
+if ncio is not None and not options.quiet:
+    hits,misses,size = chunks.getStatistics()
+    if hits or misses: print('Chunks taken from cache: %i, read from file: %i.' % (hits,misses))